@@ -0,0 +1,6 @@
+# services/ai-worker/tests/conftest.py
+import os
+import sys
+
+# worker/ 是 ai-worker 的模組根目錄（llm_app、mq_app ...）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "worker"))
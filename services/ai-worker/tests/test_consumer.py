@@ -0,0 +1,142 @@
+# services/ai-worker/tests/test_consumer.py
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from mq_app.consumer import ConcurrentConsumer
+
+
+class FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.acked = []
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+
+class FakeConnection:
+    """add_callback_threadsafe 直接執行 callback；closed 後模擬 pika 拋出例外。"""
+
+    def __init__(self):
+        self.closed = False
+
+    def add_callback_threadsafe(self, callback):
+        if self.closed:
+            raise RuntimeError("connection closed")
+        callback()
+
+
+def _deliver(consumer, conn, ch, tag, task, redelivered=False, message_id=None):
+    method = SimpleNamespace(delivery_tag=tag, redelivered=redelivered)
+    props = SimpleNamespace(message_id=message_id)
+    consumer._on_message(conn, ch, method, props, json.dumps(task).encode())
+
+
+@pytest.fixture
+def gate():
+    return threading.Event()
+
+
+def _consumer(handler):
+    return ConcurrentConsumer(queue="q", handler=handler, key_fn=lambda t: t.get("patient_id"), max_workers=2)
+
+
+def test_redelivery_of_inflight_message_is_acked_without_reprocessing(gate):
+    calls = []
+    started = threading.Event()
+
+    def handler(task):
+        calls.append(task["n"])
+        started.set()
+        gate.wait(5)
+
+    consumer = _consumer(handler)
+    old_conn, old_ch = FakeConnection(), FakeChannel()
+    _deliver(consumer, old_conn, old_ch, 1, {"patient_id": 1, "n": 1})
+    assert started.wait(5)
+
+    # 連線中斷後重連：RabbitMQ 重新投遞同一則訊息
+    old_conn.closed = True
+    consumer._generation += 1
+    new_conn, new_ch = FakeConnection(), FakeChannel()
+    _deliver(consumer, new_conn, new_ch, 7, {"patient_id": 1, "n": 1}, redelivered=True)
+
+    gate.set()
+    consumer._executor.shutdown(wait=True)
+
+    assert calls == [1]
+    assert new_ch.acked == [7]
+    assert old_ch.acked == []
+
+
+def test_jobs_queued_on_old_connection_are_not_run_after_reconnect(gate):
+    calls = []
+    started = threading.Event()
+
+    def handler(task):
+        calls.append(task["n"])
+        started.set()
+        gate.wait(5)
+
+    consumer = _consumer(handler)
+    old_conn, old_ch = FakeConnection(), FakeChannel()
+    _deliver(consumer, old_conn, old_ch, 1, {"patient_id": 1, "n": 1})
+    assert started.wait(5)
+    _deliver(consumer, old_conn, old_ch, 2, {"patient_id": 1, "n": 2})
+
+    old_conn.closed = True
+    consumer._generation += 1
+    gate.set()
+    consumer._executor.shutdown(wait=True)
+
+    # 第 2 則排在舊連線上，重連後交由 RabbitMQ 重新投遞，不在這裡執行
+    assert calls == [1]
+    assert consumer._pending == {}
+
+
+def test_reject_message_nacks_with_requeue_flag():
+    from mq_app.consumer import RejectMessage
+
+    def handler(task):
+        raise RejectMessage("retry later", requeue=True)
+
+    consumer = _consumer(handler)
+    conn, ch = FakeConnection(), FakeChannel()
+    ch.basic_nack = lambda delivery_tag, requeue: ch.acked.append(("nack", delivery_tag, requeue))
+    _deliver(consumer, conn, ch, 3, {"patient_id": 1, "n": 1})
+    consumer._executor.shutdown(wait=True)
+
+    assert ch.acked == [("nack", 3, True)]
+
+
+def test_same_patient_runs_in_order_while_others_run_concurrently(gate):
+    calls = []
+    lock = threading.Lock()
+    other_done = threading.Event()
+
+    def handler(task):
+        if task["patient_id"] == 1:
+            gate.wait(5)
+        with lock:
+            calls.append((task["patient_id"], task["n"]))
+        if task["patient_id"] == 2:
+            other_done.set()
+
+    consumer = _consumer(handler)
+    conn, ch = FakeConnection(), FakeChannel()
+    for tag, n in enumerate(range(1, 5), start=1):
+        _deliver(consumer, conn, ch, tag, {"patient_id": 1, "n": n})
+    _deliver(consumer, conn, ch, 9, {"patient_id": 2, "n": 1})
+
+    # 病患 1 的任務被擋住時，病患 2 不受影響
+    assert other_done.wait(5)
+    gate.set()
+    consumer._executor.shutdown(wait=True)
+
+    assert [n for pid, n in calls if pid == 1] == [1, 2, 3, 4]
+    assert calls[0] == (2, 1)
+    assert sorted(ch.acked) == [1, 2, 3, 4, 9]
+    assert consumer._pending == {}
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from llm_app import embedding_backends as eb
+
+
+def _client(dims):
+    client = MagicMock()
+    client.embeddings.create.return_value = SimpleNamespace(data=[SimpleNamespace(embedding=[0.0] * dims)])
+    return client
+
+
+def test_v3_model_requests_configured_dimensions():
+    client = _client(512)
+    backend = eb.OpenAIEmbeddingBackend("text-embedding-3-small", 512)
+    with patch.object(eb, "get_openai_client", return_value=client):
+        assert len(backend.embed(["咳嗽"])[0]) == 512
+    assert client.embeddings.create.call_args.kwargs["dimensions"] == 512
+
+
+def test_legacy_model_rejects_non_native_dims():
+    with pytest.raises(eb.EmbeddingDimensionMismatch):
+        eb.OpenAIEmbeddingBackend("text-embedding-ada-002", 512)
+    with pytest.raises(eb.EmbeddingDimensionMismatch):
+        eb.OpenAIEmbeddingBackend("text-embedding-3-small", 4096)
+
+
+def test_legacy_model_omits_dimensions():
+    client = _client(1536)
+    backend = eb.OpenAIEmbeddingBackend("text-embedding-ada-002", 1536)
+    with patch.object(eb, "get_openai_client", return_value=client):
+        backend.embed(["咳嗽"])
+    assert "dimensions" not in client.embeddings.create.call_args.kwargs
+
+
+def test_unexpected_output_size_raises():
+    backend = eb.OpenAIEmbeddingBackend("custom-embedder", 768)
+    with patch.object(eb, "get_openai_client", return_value=_client(1024)):
+        with pytest.raises(eb.EmbeddingDimensionMismatch):
+            backend.embed(["咳嗽"])
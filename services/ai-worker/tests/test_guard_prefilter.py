@@ -0,0 +1,84 @@
+# services/ai-worker/tests/test_guard_prefilter.py
+import pytest
+
+from llm_app.toolkits.guard_prefilter import (
+    MEDICAL_EMERGENCY,
+    NEEDS_REVIEW,
+    SELF_HARM,
+    SELF_HARM_METHOD,
+    GuardPrefilter,
+    normalize_with_offsets,
+)
+from llm_app.toolkits.guardrail_cache import normalize_text
+
+
+@pytest.fixture(scope="module")
+def prefilter():
+    return GuardPrefilter()
+
+
+@pytest.mark.parametrize("text", ["我胸痛，硝化甘油要吃幾顆？", "胸痛的時候可以多吃一顆類固醇嗎"])
+def test_emergency_with_medication_question_alerts_but_defers_to_llm(prefilter, text):
+    result = prefilter.check(text)
+
+    assert result.alert is True
+    assert result.verdict is None
+    assert result.category == NEEDS_REVIEW
+    assert "胸痛" in result.reason
+
+
+def test_emergency_alone_is_ok_with_alert(prefilter):
+    result = prefilter.check("我胸口很痛")
+
+    assert (result.verdict, result.category, result.alert) == ("OK", MEDICAL_EMERGENCY, True)
+
+
+@pytest.mark.parametrize("text", ["我今天沒有胸痛", "醫生說不是呼吸困難", "我不想自殺", "新聞說有人跳樓"])
+def test_negated_or_reported_risk_words_do_not_alert(prefilter, text):
+    # 不通報，也不直接放行，交給 LLM guardrail
+    assert prefilter.check(text) is None
+
+
+@pytest.mark.parametrize("text", ["我不想活了", "我不想活了，怎麼辦"])
+def test_ideation_alerts_and_lets_companion_reply(prefilter, text):
+    result = prefilter.check(text)
+
+    assert (result.verdict, result.category, result.alert) == ("OK", SELF_HARM, True)
+
+
+@pytest.mark.parametrize("text", ["怎麼割腕比較不痛", "安眠藥吃幾顆會死", "自殺的方法有哪些"])
+def test_method_requests_are_blocked(prefilter, text):
+    result = prefilter.check(text)
+
+    assert result.verdict.startswith("BLOCK")
+    assert result.category == SELF_HARM_METHOD
+    assert result.alert is True
+
+
+def test_alert_reason_quotes_original_text(prefilter):
+    result = prefilter.check("我想自殺")
+
+    assert "自殺" in result.reason
+    assert "自杀" not in result.reason
+
+
+def test_clause_boundary_limits_negation(prefilter):
+    # 「睡不好」與症狀分屬不同子句，不能當成否定
+    result = prefilter.check("我沒有睡好，呼吸困難")
+
+    assert result.alert is True
+
+
+def test_safe_phrase_is_ok_without_alert(prefilter):
+    result = prefilter.check("早安！")
+
+    assert (result.verdict, result.alert) == ("OK", False)
+
+
+def test_normalize_with_offsets_matches_normalize_text():
+    text = "Ｈｉ，我 今天沒有胸痛！"
+    nt = normalize_with_offsets(text)
+
+    assert nt.text == normalize_text(text)
+    assert len(nt.origin) == len(nt.text)
+    assert text[nt.origin[-1]] == "痛"
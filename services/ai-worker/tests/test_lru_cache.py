@@ -0,0 +1,52 @@
+# services/ai-worker/tests/test_lru_cache.py
+import pytest
+
+from llm_app import metrics
+from llm_app.toolkits import lru_cache
+from llm_app.toolkits.lru_cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lru_cache.time, "monotonic", lambda: now[0])
+    metrics.reset()
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(maxsize=4, ttl=10, name="t")
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=30)
+
+    clock[0] += 10
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert "a" not in cache
+    assert len(cache) == 1
+    assert metrics.get("t.expired") == 1
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = TTLCache(maxsize=2, ttl=60, name="t")
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a 變成最近使用
+
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert metrics.get("t.evicted") == 1
+
+
+def test_overwrite_refreshes_ttl_without_eviction(clock):
+    cache = TTLCache(maxsize=1, ttl=10, name="t")
+    cache.set("a", 1)
+    clock[0] += 8
+    cache.set("a", 2)
+    clock[0] += 8
+
+    assert cache.get("a") == 2
+    assert cache.pop("a") == 2 and cache.pop("a", "gone") == "gone"
+    assert not metrics.get("t.evicted")
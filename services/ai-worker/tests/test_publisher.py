@@ -0,0 +1,59 @@
+# services/ai-worker/tests/test_publisher.py
+from unittest.mock import MagicMock
+
+import pytest
+from pika.exceptions import AMQPConnectionError, StreamLostError
+
+from mq_app import publisher
+from mq_app.publisher import PooledPublisher
+
+
+def _connection(stale=False):
+    connection, channel = MagicMock(), MagicMock()
+    connection.channel.return_value = channel
+    if stale:
+        connection.process_data_events.side_effect = StreamLostError("idle connection dropped")
+    return connection, channel
+
+
+@pytest.fixture
+def blocking_connection(mocker):
+    return mocker.patch.object(publisher.pika, "BlockingConnection")
+
+
+def test_stale_pooled_connections_are_skipped_without_using_the_retry(blocking_connection):
+    stale = [_connection(stale=True), _connection(stale=True)]
+    fresh_connection, fresh_channel = _connection()
+    blocking_connection.side_effect = [stale[0][0], stale[1][0], fresh_connection]
+
+    pub = PooledPublisher(parameters=None, pool_size=2)
+    slots = [pub._acquire()[0] for _ in range(2)]
+    for slot in slots:
+        pub._idle.put(slot)
+
+    assert pub.publish_batch("q", [{"n": 1}, {"n": 2}]) == 2
+
+    for connection, channel in stale:
+        connection.close.assert_called_once()
+        channel.basic_publish.assert_not_called()
+    assert fresh_channel.basic_publish.call_count == 2
+    assert pub._created == 1
+
+
+def test_mid_publish_failure_retries_once_then_raises(blocking_connection):
+    broken = [_connection(), _connection()]
+    for _, channel in broken:
+        channel.basic_publish.side_effect = StreamLostError("lost")
+    blocking_connection.side_effect = [broken[0][0], broken[1][0]]
+
+    pub = PooledPublisher(parameters=None, pool_size=2)
+    with pytest.raises(StreamLostError):
+        pub.publish("q", {"n": 1})
+    assert pub._created == 0
+
+
+def test_fresh_connection_failure_is_raised(blocking_connection):
+    blocking_connection.side_effect = AMQPConnectionError("down")
+
+    with pytest.raises(AMQPConnectionError):
+        PooledPublisher(parameters=None).publish("q", {"n": 1})
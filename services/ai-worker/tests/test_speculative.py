@@ -0,0 +1,62 @@
+# services/ai-worker/tests/test_speculative.py
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from llm_app import metrics
+from llm_app.speculative import SpeculationNeedsTools, SpeculativeCompletion
+
+
+def _chunk(content=None, tool_calls=None, usage=None):
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=usage)
+
+
+class _FakeClient:
+    def __init__(self, chunks):
+        create = lambda **kwargs: iter(chunks)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+@pytest.fixture(autouse=True)
+def _reset_metrics(monkeypatch):
+    monkeypatch.setattr("llm_app.speculative.record_usage", lambda *a, **k: None)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(1) as ex:
+        yield ex
+
+
+def test_result_returns_streamed_text(executor):
+    usage = SimpleNamespace(completion_tokens=3)
+    spec = SpeculativeCompletion(executor, _FakeClient([_chunk("阿公"), _chunk("早安"), _chunk(usage=usage)]), lambda: [])
+
+    assert spec.result(timeout=5) == "阿公早安"
+    assert metrics.get("speculative.committed_tokens") == 3
+
+
+def test_cancel_after_completion_counts_wasted_tokens_once(executor):
+    usage = SimpleNamespace(completion_tokens=7)
+    spec = SpeculativeCompletion(executor, _FakeClient([_chunk("好"), _chunk(usage=usage)]), lambda: [])
+    assert spec._done.wait(5)
+
+    spec.cancel()
+    spec.cancel()
+
+    assert metrics.get("speculative.wasted_tokens") == 7
+    assert metrics.get("speculative.cancelled") == 1
+
+
+def test_tool_call_stops_speculation(executor):
+    chunks = [_chunk(tool_calls=[SimpleNamespace(id="call_1")]), _chunk("不該收到")]
+    spec = SpeculativeCompletion(executor, _FakeClient(chunks), lambda: [])
+
+    with pytest.raises(SpeculationNeedsTools):
+        spec.result(timeout=5)
+    assert spec._parts == []
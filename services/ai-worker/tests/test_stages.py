@@ -0,0 +1,70 @@
+# services/ai-worker/tests/test_stages.py
+import pytest
+
+from mq_app import stages
+from mq_app.consumer import RejectMessage
+
+
+@pytest.fixture
+def published(monkeypatch):
+    sent = []
+    monkeypatch.setattr(stages, "_publish_stage", lambda stage, envelope: sent.append((stage, dict(envelope))))
+    return sent
+
+
+def _envelope(reply_type="notification"):
+    reply = {"type": reply_type}
+    if reply_type == "voice_chat":
+        reply.update(queue="voice_response", task_id="t1", conversation_id=None, patient_id="anonymous")
+    return {"correlation_id": "c1", "patient_id": None, "task": {"object_name": "a.wav"}, "reply": reply}
+
+
+def _fail(envelope):
+    raise RuntimeError("boom")
+
+
+def test_successful_stage_forwards_to_next(published):
+    stages._stage_handler("respond", lambda env: env.update(ai_response="hi"), "synthesize")(_envelope())
+
+    assert published[0][0] == "synthesize"
+    assert published[0][1]["ai_response"] == "hi"
+
+
+def test_failed_notification_stage_goes_to_notify_with_error(published):
+    stages._stage_handler("respond", _fail, "synthesize")(_envelope())
+
+    assert published[0][0] == "notify"
+    assert published[0][1]["error_message"] == "boom"
+
+
+def test_failed_voice_chat_stage_is_nacked_without_reply(published):
+    with pytest.raises(RejectMessage) as exc:
+        stages._stage_handler("respond", _fail, "synthesize")(_envelope("voice_chat"))
+
+    assert exc.value.requeue is False
+    assert published == []
+
+
+def test_forward_failure_is_requeued_instead_of_acked(monkeypatch):
+    def broken_publish(stage, envelope):
+        raise ConnectionError("broker down")
+
+    monkeypatch.setattr(stages, "_publish_stage", broken_publish)
+
+    with pytest.raises(RejectMessage) as exc:
+        stages._stage_handler("respond", lambda env: None, "synthesize")(_envelope())
+    assert exc.value.requeue is True
+
+
+def test_voice_chat_respond_uses_voice_reply_with_fallback(monkeypatch):
+    envelope = _envelope("voice_chat")
+    envelope["user_transcript"] = "你好"
+    stages._respond(envelope)
+    assert envelope["ai_response"].startswith("您好")
+
+    def broken(*args):
+        raise RuntimeError("llm down")
+
+    monkeypatch.setattr("voice_app.voice_reply.generate_llm_response", broken)
+    stages._respond(envelope)
+    assert envelope["ai_response"] == "我聽到您說：「你好」。這是一個AI語音助理的回應。"
@@ -0,0 +1,111 @@
+# services/ai-worker/tests/test_summary_queue.py
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+pytest.importorskip("crewai")
+pytest.importorskip("pymilvus")
+
+from llm_app.toolkits import summary_queue as sq
+
+
+class BlockingQueue(sq.SummaryQueue):
+    """_summarize 在 gate 放行前停住，方便檢查執行中的狀態。"""
+
+    def __init__(self):
+        super().__init__(workers=1)
+        self.gate = threading.Event()
+        self.started = threading.Event()
+        self.calls = []
+
+    def _summarize(self, user_id):
+        self.calls.append(user_id)
+        self.started.set()
+        self.gate.wait(5)
+
+
+def test_schedule_while_queued_is_coalesced():
+    q = BlockingQueue()
+    q._ensure_started = lambda: None  # 不啟動背景執行緒，只檢查排程狀態
+    q.schedule("u1")
+    q.schedule("u1")
+
+    assert q._state == {"u1": sq._QUEUED}
+    assert q._queue.qsize() == 1
+
+
+def test_schedule_while_running_reruns_once():
+    q = BlockingQueue()
+    q.schedule("u1")
+    assert q.started.wait(5)
+    q.started.clear()
+
+    q.schedule("u1")
+    q.schedule("u1")
+    assert q._state["u1"] == sq._RUNNING_DIRTY
+
+    q.gate.set()
+    assert q.wait_idle("u1", timeout=5)
+    assert q.calls == ["u1", "u1"]
+    assert "u1" not in q._state
+
+
+def test_wait_idle_times_out_while_running():
+    q = BlockingQueue()
+    q.schedule("u1")
+    assert q.started.wait(5)
+
+    assert q.wait_idle("u1", timeout=0.05) is False
+    assert q.wait_idle("u2", timeout=0.05) is True
+
+    q.gate.set()
+    assert q.wait_idle("u1", timeout=5)
+
+
+def test_failed_job_releases_user():
+    q = sq.SummaryQueue(workers=1)
+    q._summarize = MagicMock(side_effect=RuntimeError("LLM down"))
+    q.schedule("u1")
+
+    assert q.wait_idle("u1", timeout=5)
+    q._summarize.assert_called_once_with("u1")
+
+
+def test_summarize_merges_whole_chunks(monkeypatch):
+    monkeypatch.setattr(sq, "SUMMARY_CHUNK_SIZE", 5)
+    monkeypatch.setattr(sq, "SUMMARY_MAX_MERGE_ROUNDS", 20)
+    monkeypatch.setattr(sq, "unsummarized_count", lambda uid: 13)
+    peek = MagicMock(return_value=(3, ["r"] * 10))
+    commit = MagicMock(return_value=True)
+    monkeypatch.setattr(sq, "peek_next_n", peek)
+    monkeypatch.setattr(sq, "summarize_chunk_and_commit", commit)
+    monkeypatch.setattr(sq, "compact_history", lambda uid: 10)
+
+    sq.SummaryQueue()._summarize("u1")
+
+    peek.assert_called_once_with("u1", 10)
+    commit.assert_called_once_with("u1", start_round=3, history_chunk=["r"] * 10)
+
+
+def test_finalize_waits_for_queue_and_retries_cas(monkeypatch):
+    agent = pytest.importorskip("llm_app.HealthBot.agent")
+    order = []
+    queue = MagicMock()
+    queue.wait_idle.side_effect = lambda uid, timeout: order.append("wait_idle")
+    monkeypatch.setattr(agent, "get_summary_queue", lambda: queue)
+    # 第一次提交時游標已被背景摘要推進（CAS 失敗），重讀後成功
+    peeks = iter([(0, ["a", "b"]), (2, ["c"])])
+    monkeypatch.setattr(agent, "peek_remaining", lambda uid: (order.append("peek"), next(peeks))[1])
+    commits = iter([False, True])
+    commit = MagicMock(side_effect=lambda *a, **kw: next(commits))
+    monkeypatch.setattr(agent, "summarize_chunk_and_commit", commit)
+    monkeypatch.setattr(agent, "refine_summary", lambda uid: "")
+    cleanup = MagicMock()
+    monkeypatch.setattr(agent, "cleanup_session_keys", cleanup)
+
+    agent.finalize_session("u1")
+
+    assert order == ["wait_idle", "peek", "peek"]
+    assert commit.call_args_list[-1].kwargs == {"start_round": 2, "history_chunk": ["c"]}
+    cleanup.assert_called_once_with("u1")
@@ -6,25 +6,37 @@ os.environ["CREWAI_TELEMETRY_OPT_OUT"] = "true"
 
 import time
 import json
+import logging
+from itertools import chain, islice
+from dataclasses import dataclass
 from datetime import datetime
 
 from crewai import LLM, Agent, Crew, Task, Process
 from langchain_openai import ChatOpenAI
-from openai import OpenAI
 
 from ..embedding import safe_to_vector
+from ..openai_client import get_openai_client
 from ..toolkits.memory_store import retrieve_memory_pack, upsert_memory_atoms
 from ..repositories.profile_repository import ProfileRepository
 from ..toolkits.redis_store import (
-    fetch_all_history,
-    fetch_unsummarized_tail,
-    get_summary,
+    iter_all_history,
+    get_session_snapshot,
     peek_next_n,
     peek_remaining,
     purge_user_session,
     set_state_if,
     cleanup_session_keys
 )
+from ..toolkits.prompt_budget import (
+    MEMORY_MAX_TOKENS,
+    PROFILE_MAX_TOKENS,
+    PROMPT_TOKEN_BUDGET,
+    STM_MAX_TOKENS,
+    SUMMARY_MAX_TOKENS,
+    Section,
+    allocate,
+)
+from ..toolkits.summary_queue import get_summary_queue
 from ..toolkits.tools import (
     AlertCaseManagerTool,
     ModelGuardrailTool,
@@ -32,10 +44,12 @@ from ..toolkits.tools import (
     summarize_chunk_and_commit,
 )
 
-STM_MAX_CHARS = int(os.getenv("STM_MAX_CHARS", 1800))
-SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", 3000))
+logger = logging.getLogger(__name__)
+
 REFINE_CHUNK_ROUNDS = int(os.getenv("REFINE_CHUNK_ROUNDS", 20))
 SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", 5))
+FINALIZE_SUMMARY_WAIT_SEC = float(os.getenv("FINALIZE_SUMMARY_WAIT_SEC", 60))
+FINALIZE_CAS_RETRIES = int(os.getenv("FINALIZE_CAS_RETRIES", 3))
 
 
 # 對話用的溫度（口語更自然可高一點）
@@ -54,54 +68,21 @@ guard_llm = LLM(
 )
 
 
-def _shrink_tail(text: str, max_chars: int) -> str:
-    if len(text) <= max_chars:
-        return text
-    tail = text[-max_chars:]
-    idx = tail.find("--- ")
-    return tail[idx:] if idx != -1 else tail
-
-
 def build_prompt_from_redis(user_id: str, line_user_id: str = None, k: int = 6, current_input: str = "") -> str:
     # 0) 取使用者Profile
-    profile = None
     profile_data = {}
     try:
-        #【修正】將 line_user_id 傳遞進去
-        profile = ProfileRepository().get_or_create_by_user_id(int(user_id), line_user_id=line_user_id)
-        profile_data = {
-            "personal_background": profile.profile_personal_background or {},
-            "health_status": profile.profile_health_status or {},
-            "life_events": profile.profile_life_events or {}
-        }
+        #【修正】將 line_user_id 傳遞進去；Profile 經由 Redis 快取讀取，未命中才查 DB
+        profile_data = ProfileRepository().read_profile_as_dict(int(user_id), line_user_id=line_user_id)
     except (ValueError, TypeError):
-        print(f"⚠️ [Build Prompt] user_id '{user_id}' 無法轉換為整數，將使用空的 Profile。")
+        logger.warning("user_id %r 無法轉換為整數，將使用空的 Profile。", user_id)
 
     profile_str = json.dumps({k: v for k, v in profile_data.items() if isinstance(v, dict)}, ensure_ascii=False, indent=2) if any(profile_data.values()) else "尚無使用者畫像資訊"
     
-    # 1) 取歷史摘要（控長度）
-    summary, _ = get_summary(user_id)
-    summary = _shrink_tail(summary, SUMMARY_MAX_CHARS) if summary else ""
-
-    # 2) 取近期未摘要回合（控長度）
-    rounds = fetch_unsummarized_tail(user_id, k=max(k, 1))
-
-    def render(rs):
-        return "\n".join([f"長輩：{r['input']}\n金孫：{r['output']}" for r in rs])
-
-    chat = render(rounds)
-    while len(chat) > STM_MAX_CHARS and len(rounds) > 1:
-        rounds = rounds[1:]
-        chat = render(rounds)
-    if len(chat) > STM_MAX_CHARS and rounds:
-        chat = chat[-STM_MAX_CHARS:]
+    # 1) 取歷史摘要與近期未摘要回合（一次 Redis 來回）
+    summary, _, rounds = get_session_snapshot(user_id, k=max(k, 1))
 
-    parts = []
-
-    # 3.0) 優先加入Profile
-    parts.append(f"⭐ 使用者畫像：\n{profile_str}")
-
-    # 3) 先注入：⭐ 個人長期記憶（依據當前輸入檢索相關記憶）
+    # 2) ⭐ 個人長期記憶（依據當前輸入檢索相關記憶）
     mem_pack = ""
     if current_input:
         qv = safe_to_vector(current_input)
@@ -110,7 +91,7 @@ def build_prompt_from_redis(user_id: str, line_user_id: str = None, k: int = 6,
                 # 使用memory_store統一架構：P0-4: 降低門檻提升召回率
                 # 將相似度門檻從 0.78 降低到 0.55，大幅提升記憶召回率
                 dynamic_threshold = 0.55  # 更低門檻確保能檢索到相關記憶
-                print(f"🔍 開始記憶檢索：user_id={user_id}, query='{current_input[:50]}...', threshold={dynamic_threshold}")
+                logger.debug("開始記憶檢索 threshold=%s", dynamic_threshold)
                 mem_pack = retrieve_memory_pack(
                     user_id=user_id,
                     query_vec=qv,
@@ -119,99 +100,47 @@ def build_prompt_from_redis(user_id: str, line_user_id: str = None, k: int = 6,
                     tau_days=45,
                 )
                 if mem_pack:
-                    print(f"🧠 為用戶 {user_id} 檢索到長期記憶: {len(mem_pack)} 字符")
-                    print(f"💾 記憶內容預覽: {mem_pack[:200]}...")
+                    logger.info("檢索到長期記憶: %s 字符", len(mem_pack))
+                    logger.info("長期記憶內容", extra={"sample": "memory", "memory": mem_pack})
                 else:
-                    print(f"❌ 用戶 {user_id} 未檢索到任何長期記憶（門檻: {dynamic_threshold}）")
+                    logger.info("未檢索到任何長期記憶（門檻: %s）", dynamic_threshold)
             except Exception as e:
-                print(f"[memory retrieval error] {e}")
+                logger.warning("記憶檢索失敗: %s", e)
                 mem_pack = ""
 
-    if mem_pack:
-        parts.append(mem_pack)
-
-    # 4) 再接：📌 歷史摘要、💬 近期未摘要
-    if summary:
-        parts.append("📌 歷史摘要：\n" + summary)
-    if chat:
-        parts.append("🕓 近期對話（未摘要）：\n" + chat)
-
-    prompt = "\n\n".join(parts)
-
-    # P1-6: 動態收縮 Prompt（保留記憶 > 尾巴 > 摘要）
-    MAX_PROMPT_CHARS = int(os.getenv("MAX_PROMPT_CHARS", 4000))
-    if len(prompt) > MAX_PROMPT_CHARS:
-        # 收縮順序：先砍摘要，再砍近期對話，最後保留記憶
-        shrunk_parts = []
-        if mem_pack:  # 優先保留記憶
-            shrunk_parts.append(mem_pack)
-        if chat:  # 再保留近期對話
-            available_chars = (
-                MAX_PROMPT_CHARS
-                - sum(len(p) for p in shrunk_parts)
-                - len("\n\n") * len(shrunk_parts)
-            )
-            if available_chars > 500:  # 至少保留一些對話
-                shrunk_chat = (
-                    chat if len(chat) <= available_chars else chat[-available_chars:]
-                )
-                shrunk_parts.append(
-                    "🕓 近期對話（未摘要）：\n"
-                    + shrunk_chat.split("🕓 近期對話（未摘要）：\n")[-1]
-                    if "🕓" in shrunk_chat
-                    else shrunk_chat
-                )
-        # 摘要最後考慮（如果還有空間）
-        if summary:
-            available_chars = (
-                MAX_PROMPT_CHARS
-                - sum(len(p) for p in shrunk_parts)
-                - len("\n\n") * len(shrunk_parts)
-            )
-            if available_chars > 200:
-                shrunk_summary = (
-                    summary
-                    if len(summary) <= available_chars
-                    else summary[:available_chars] + "..."
-                )
-                shrunk_parts.append("📌 歷史摘要：\n" + shrunk_summary)
-        prompt = "\n\n".join(shrunk_parts)
-        # 修正 f-string 語法錯誤：不能在 f-string 表達式中使用反斜線
-        original_parts_joined = "\n\n".join(parts)
-        print(
-            f"⚠️ Prompt 超長度，已收縮：{len(original_parts_joined)} → {len(prompt)} 字符"
-        )
-
-    # 5) Unicode 視覺化 Debug Print（每輪打印）
-    print("\n" + "📝 PROMPT DEBUG VIEW".center(80, "─"))
-    print(f"👤 User ID: {user_id}")
-    print(f"📏 Prompt 長度: {len(prompt)} 字符")
-    print("📜 Prompt 結構:")
-
-    section_icons = {
-        "⭐ 使用者畫像": "👤",
-        "⭐ 個人長期記憶": "📂",
-        "📌 歷史摘要": "🗂️",
-        "🕓 近期對話（未摘要）": "💬",
-    }
-
-    for sec in prompt.split("\n\n"):
-        if not sec.strip():
-            continue
-        lines = sec.split("\n")
-        sec_title = lines[0]
-        icon = None
-        for key, val in section_icons.items():
-            if key in sec_title:
-                icon = val
-                break
-        if icon:
-            print(f"\n{icon} {sec_title}")
-            print("   " + "─" * max(6, len(sec_title)))
-        for line in lines[1:]:
-            print(f"   {line}")
-
-    print("─" * 80 + "\n")
+    # 3) 依 token 預算組合：優先順序 畫像 > 記憶 > 近期對話 > 摘要，顯示順序不變
+    mem_lines = mem_pack.split("\n") if mem_pack else []
+    sections = [
+        Section("profile", "⭐ 使用者畫像：", [profile_str], max_tokens=PROFILE_MAX_TOKENS),
+        Section("memory", mem_lines[0] if mem_lines else "", mem_lines[1:], max_tokens=MEMORY_MAX_TOKENS),
+        Section(
+            "recent",
+            "🕓 近期對話（未摘要）：",
+            [f"長輩：{r['input']}\n金孫：{r['output']}" for r in rounds],
+            keep="tail",
+            max_tokens=STM_MAX_TOKENS,
+        ),
+        Section(
+            "summary",
+            "📌 歷史摘要：",
+            summary.split("\n\n") if summary else [],
+            keep="tail",
+            joiner="\n\n",
+            max_tokens=SUMMARY_MAX_TOKENS,
+        ),
+    ]
+    prompt = allocate(sections, PROMPT_TOKEN_BUDGET, order=["profile", "memory", "summary", "recent"])
+    prompt_tokens = sum(sec.tokens for sec in sections)
+
+    # 4) 完整 prompt 只取樣記錄（LOG_SAMPLE_RATES 的 prompt 類別），其餘回合只記大小
+    logger.info(
+        "prompt 已組合：%s 字符 / 約 %s tokens（預算 %s）",
+        len(prompt),
+        prompt_tokens,
+        PROMPT_TOKEN_BUDGET,
+        extra={"sections": {sec.key: sec.tokens for sec in sections}},
+    )
+    logger.info("prompt 內容", extra={"sample": "prompt", "prompt": prompt})
 
     return prompt
 
@@ -228,31 +157,45 @@ def create_guardrail_agent() -> Agent:
     )
 
 
+@dataclass(frozen=True)
+class AgentTemplate:
+    """與使用者無關的 Agent 設定；所有使用者共用同一份，不可修改。"""
+
+    role: str
+    goal: str
+    backstory: str
+
+
+# 陪伴 Agent 的人設；CrewAI 與直接呼叫兩種 runtime 共用
+HEALTH_COMPANION_TEMPLATE = AgentTemplate(
+    role="國民孫女 Ally — 溫暖的護理師",
+    goal="""
+    你的目標是，無論使用者的提問內容是生活瑣事還是健康相關，你都要用輕鬆、自然、口語化的方式回覆，避免使用條列式或數字編號。
+    即使有多個重點，也要用聊天的語氣把它們串起來，讓長輩覺得像在跟孫女閒話家常。
+    當需要提供衛教資訊時，要先用溫暖的方式引入，再以簡單易懂的說法解釋，並避免嚴肅或生硬的醫療用語。
+    如果使用到工具（如 RAG 或資料庫檢索），也必須將取得的內容重新包裝成口語化對話，而不是直接複製。
+    每次回覆都要讓長輩感受到關心和陪伴，並提升他們的心情與安全感。
+    """,
+    backstory="""
+    你是「艾莉」，22 歲，剛從護理專科畢業，在萬芳醫院工作，專門陪伴與關懷 55 歲以上、患有慢性阻塞性肺病 (COPD) 的長輩用戶。
+    你的個性溫暖、愛撒嬌、有點機車，喜歡用自然口語、台語混中文的方式聊天。
+    跟長輩對話時，要像孫女平常聊天一樣，不拘謹、不用專業術語，讓對方覺得親切。
+    習慣用語助詞（欸、啦、齁、嘿嘿）和貼心的語氣詞，讓對話有溫度。
+    你非常重視情感連結，會關心長輩的日常生活和心情，並在適當時給予簡單的衛教建議。
+    """,
+)
+
+# 工具本身不保存使用者狀態，所有陪伴 Agent 共用同一組實例
+_COMPANION_TOOLS = (SearchMilvusTool(), AlertCaseManagerTool())
+
+
 def create_health_companion(user_id: str) -> Agent:
+    # CrewAI Agent 在 kickoff 期間帶有執行狀態，不能跨執行緒共用，因此仍是每位使用者一個實例
     return Agent(
-        role="國民孫女 Ally — 溫暖的護理師",
-        goal=(
-            """
-            你的目標是，無論使用者的提問內容是生活瑣事還是健康相關，你都要用輕鬆、自然、口語化的方式回覆，避免使用條列式或數字編號。
-            即使有多個重點，也要用聊天的語氣把它們串起來，讓長輩覺得像在跟孫女閒話家常。
-            當需要提供衛教資訊時，要先用溫暖的方式引入，再以簡單易懂的說法解釋，並避免嚴肅或生硬的醫療用語。
-            如果使用到工具（如 RAG 或資料庫檢索），也必須將取得的內容重新包裝成口語化對話，而不是直接複製。
-            每次回覆都要讓長輩感受到關心和陪伴，並提升他們的心情與安全感。
-            """
-        ),
-        backstory=(
-            """
-            你是「艾莉」，22 歲，剛從護理專科畢業，在萬芳醫院工作，專門陪伴與關懷 55 歲以上、患有慢性阻塞性肺病 (COPD) 的長輩用戶。
-            你的個性溫暖、愛撒嬌、有點機車，喜歡用自然口語、台語混中文的方式聊天。
-            跟長輩對話時，要像孫女平常聊天一樣，不拘謹、不用專業術語，讓對方覺得親切。
-            習慣用語助詞（欸、啦、齁、嘿嘿）和貼心的語氣詞，讓對話有溫度。
-            你非常重視情感連結，會關心長輩的日常生活和心情，並在適當時給予簡單的衛教建議。
-            """
-        ),
-        tools=[
-            SearchMilvusTool(),
-            AlertCaseManagerTool(),
-        ],
+        role=HEALTH_COMPANION_TEMPLATE.role,
+        goal=HEALTH_COMPANION_TEMPLATE.goal,
+        backstory=HEALTH_COMPANION_TEMPLATE.backstory,
+        tools=list(_COMPANION_TOOLS),
         llm=granddaughter_llm,  # ★ 關鍵：把 LLM（含溫度）塞進 Agent
         memory=False,
         verbose=False,
@@ -267,7 +210,7 @@ def _extract_memory_candidates_from_summary(summary_text: str) -> list:
     try:
         if not summary_text or not summary_text.strip():
             return []
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = get_openai_client()
         sys = (
             "你是記憶抽取器。從摘要中抽取可長期使用的事實/偏好/狀態，"
             "輸出 JSON 陣列（最多 5 筆）。每筆包含："
@@ -297,13 +240,13 @@ def _extract_memory_candidates_from_summary(summary_text: str) -> list:
         lb = raw.find("[")
         rb = raw.rfind("]")
         if lb == -1 or rb == -1 or rb <= lb:
-            print("[LTM extract warn] no JSON array found in output")
+            logger.warning("LTM 抽取輸出中找不到 JSON 陣列")
             return []
         json_text = raw[lb : rb + 1]
         try:
             arr = _json.loads(json_text)
         except Exception as pe:
-            print(f"[LTM extract error] parse json failed: {pe}")
+            logger.warning("LTM 抽取 JSON 解析失敗: %s", pe)
             return []
         if not isinstance(arr, list):
             arr = [arr]
@@ -330,7 +273,7 @@ def _extract_memory_candidates_from_summary(summary_text: str) -> list:
             )
         return out
     except Exception as e:
-        print(f"[LTM extract error] {e}")
+        logger.exception("LTM 抽取失敗: %s", e)
         return []
 
 
@@ -338,20 +281,19 @@ def refine_summary(user_id: str) -> None:
     """
     對全量歷史進行 map-reduce 摘要，並存入長期記憶
     """
-    all_rounds = fetch_all_history(user_id)
-    if not all_rounds:
+    # 歷史逐段讀取（已修剪的回合從歸檔串流），不一次載入整個 session
+    rounds = iter_all_history(user_id)
+    chunks = iter(lambda: list(islice(rounds, REFINE_CHUNK_ROUNDS)), [])
+    first = next(chunks, None)
+    if not first:
         return
 
     try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = get_openai_client()
 
         # 1) 分片摘要
-        chunks = [
-            all_rounds[i : i + REFINE_CHUNK_ROUNDS]
-            for i in range(0, len(all_rounds), REFINE_CHUNK_ROUNDS)
-        ]
         partials = []
-        for ch in chunks:
+        for ch in chain([first], chunks):
             conv = "\n".join(
                 [
                     f"第{i+1}輪\n長輩:{c['input']}\n金孫:{c['output']}"
@@ -397,13 +339,13 @@ def refine_summary(user_id: str) -> None:
                 atom["source_session_id"] = session_id
 
             count = upsert_memory_atoms(user_id, atoms)
-            print(f"✅ 已為用戶 {user_id} 存入 {count} 筆長期記憶")
+            logger.info("已為用戶 %s 存入 %s 筆長期記憶", user_id, count)
         else:
-            print(f"⚠️ 用戶 {user_id} 本次會話未產生可存入的記憶")
+            logger.info("用戶 %s 本次會話未產生可存入的記憶", user_id)
         return final
 
     except Exception as e:
-        print(f"[refine_summary error] {e}")
+        logger.exception("refine_summary 失敗: %s", e)
         return ""
 
 PROFILER_AGENT_PROMPT_TEMPLATE = """
@@ -551,10 +493,10 @@ def run_profiler_update(user_id: str, final_summary: str):
     【修正】在 LTM 生成後，觸發 Profiler Agent 來更新使用者畫像的完整實作。
     """
     if not final_summary or not final_summary.strip():
-        print(f"[Profiler] 摘要為空，跳過為 {user_id} 更新 Profile。")
+        logger.info("[Profiler] 摘要為空，跳過為 %s 更新 Profile。", user_id)
         return
 
-    print(f"[Profiler] 開始為 {user_id} 更新 Profile...")
+    logger.info("[Profiler] 開始為 %s 更新 Profile", user_id)
     repo = ProfileRepository()
     
     # 1. 獲取舊 Profile
@@ -589,9 +531,7 @@ def run_profiler_update(user_id: str, final_summary: str):
     update_commands_str = crew_output.raw if crew_output else ""
     
     # 印出 LLM 原始輸出，方便除錯
-    print(f"--- [Profiler Raw Output for user {user_id}] ---")
-    print(update_commands_str)
-    print("------------------------------------------")
+    logger.info("[Profiler] LLM 原始輸出", extra={"sample": "payload", "raw_output": update_commands_str})
 
     # 3. 解析指令並更新資料庫
     try:
@@ -599,7 +539,7 @@ def run_profiler_update(user_id: str, final_summary: str):
         start_index = update_commands_str.find('{')
         end_index = update_commands_str.rfind('}') + 1
         if start_index == -1 or end_index == 0:
-            print(f"[Profiler] LLM 輸出中未找到有效的 JSON 物件，跳過更新。原始輸出: {update_commands_str}")
+            logger.warning("[Profiler] LLM 輸出中未找到有效的 JSON 物件，跳過更新。", extra={"raw_output": update_commands_str[:500]})
             return
         
         json_str = update_commands_str[start_index:end_index]
@@ -608,13 +548,12 @@ def run_profiler_update(user_id: str, final_summary: str):
         if update_commands and any(update_commands.values()):
             repo.update_profile_facts(int(user_id), update_commands)
         else:
-            print(f"[Profiler] LLM 為 {user_id} 回傳了空的更新指令，無需更新。")
+            logger.info("[Profiler] LLM 為 %s 回傳了空的更新指令，無需更新。", user_id)
             
     except json.JSONDecodeError as e:
-        print(f"❌ [Profiler] 解析 LLM 輸出的 JSON 失敗: {e}")
-        print(f"原始輸出: {update_commands_str}")
+        logger.warning("[Profiler] 解析 LLM 輸出的 JSON 失敗: %s", e, extra={"raw_output": update_commands_str[:500]})
     except Exception as e:
-        print(f"❌ [Profiler] 更新 Profile 過程中發生未知錯誤: {e}")
+        logger.exception("[Profiler] 更新 Profile 過程中發生未知錯誤: %s", e)
 
 
 # ---- Finalize：補分段摘要 → Refine → Purge ----
@@ -628,13 +567,18 @@ def finalize_session(user_id: str) -> None:
     3. 根據最終摘要更新使用者 Profile
     4. 清除 session 資料
     """
-    print(f"--- Finalizing session for user {user_id} ---")
-    start, remaining = peek_remaining(user_id)
-    if remaining:
-        summarize_chunk_and_commit(user_id, start_round=start, history_chunk=remaining)
+    logger.info("Finalizing session for user %s", user_id)
+    # 先等背景摘要把手上的工作提交，再處理剩餘回合；若游標仍被同時推進則重讀重試
+    get_summary_queue().wait_idle(user_id, timeout=FINALIZE_SUMMARY_WAIT_SEC)
+    for _ in range(FINALIZE_CAS_RETRIES):
+        start, remaining = peek_remaining(user_id)
+        if not remaining:
+            break
+        if summarize_chunk_and_commit(user_id, start_round=start, history_chunk=remaining):
+            break
     final_summary = refine_summary(user_id)
     if final_summary:
         run_profiler_update(user_id, final_summary)
     else:
-        print(f"ℹ️ 用戶 {user_id} 的會話未產生最終摘要，跳過 Profile 更新。")
+        logger.info("用戶 %s 的會話未產生最終摘要，跳過 Profile 更新。", user_id)
     cleanup_session_keys(user_id) 
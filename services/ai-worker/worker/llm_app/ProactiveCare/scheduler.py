@@ -1,3 +1,4 @@
+import logging
 import os
 
 import pytz
@@ -8,6 +9,9 @@ from dotenv import load_dotenv
 from .tasks import check_and_trigger_dynamic_care, patrol_silent_users, cleanup_expired_sessions
 
 load_dotenv()
+
+logger = logging.getLogger(__name__)
+
 TAIPEI_TZ = pytz.timezone("Asia/Taipei")
 
 redis_jobstore = RedisJobStore(
@@ -33,7 +37,7 @@ def initialize_scheduler():
             name="清理過期的使用者 Session",
             replace_existing=True,
         )
-        print("✅ [Scheduler] Session 清理任務已新增。")
+        logger.info("Session 清理任務已新增。")
 
     if not scheduler.get_job("dynamic_care_trigger"):
         scheduler.add_job(
@@ -44,7 +48,7 @@ def initialize_scheduler():
             name="檢查 24 小時閒置使用者",
             replace_existing=True,
         )
-        print("✅ [Scheduler] 動態關懷任務已新增。")
+        logger.info("動態關懷任務已新增。")
         
     if not scheduler.get_job("weekly_patrol_job"):
         scheduler.add_job(
@@ -54,9 +58,9 @@ def initialize_scheduler():
             name="巡檢長期沉默使用者",
             replace_existing=True,
         )
-        print("✅ [Scheduler] 每週巡檢任務已新增。")
+        logger.info("每週巡檢任務已新增。")
 
-    print("🚀 主動關懷與 Session 清理排程服務已準備就緒...")
+    logger.info("主動關懷與 Session 清理排程服務已準備就緒")
     scheduler.print_jobs()
 
 def main():
@@ -64,7 +68,7 @@ def main():
     try:
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
-        print("🛑 排程服務已停止。")
+        logger.info("排程服務已停止。")
         scheduler.shutdown()
 
 
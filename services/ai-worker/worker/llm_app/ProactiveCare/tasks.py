@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 import time
 import pytz
@@ -6,7 +7,6 @@ from datetime import datetime, timedelta # 【新增】導入 timedelta
 
 from crewai import Agent, Crew, Task
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from .line_service import line_service # 【修正】使用相對導入
 from ..toolkits.redis_store import append_proactive_round, get_expired_sessions
@@ -15,29 +15,31 @@ from ..repositories.profile_repository import ProfileRepository
 from ..models.chat_profile import ChatUserProfile # 【新增】導入模型以供查詢
 from ..HealthBot.agent import create_guardrail_agent
 from ..llm_service import llm_service_instance
+from ..openai_client import get_openai_client
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- 初始化 ---
 TAIPEI_TZ = pytz.timezone("Asia/Taipei")
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = get_openai_client()
 MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
-guardrail_agent = create_guardrail_agent()
 
 def cleanup_expired_sessions():
     """
     每分鐘執行一次，掃描並清理所有過期的使用者 Session。
     """
-    print(f"\n[Session Cleanup] {datetime.now()} Running expired session cleanup job...")
+    logger.debug("Running expired session cleanup job")
     
     expired_user_ids = get_expired_sessions()
     
     if not expired_user_ids:
-        print("[Session Cleanup] No expired sessions found.")
+        logger.debug("No expired sessions found.")
         return
         
-    print(f"[Session Cleanup] Found {len(expired_user_ids)} expired sessions: {expired_user_ids}")
+    logger.info("Found %s expired sessions: %s", len(expired_user_ids), expired_user_ids)
 
     for user_id in expired_user_ids:
         llm_service_instance.finalize_user_session_now(user_id)
@@ -161,7 +163,7 @@ def execute_proactive_care(profile_repo: ProfileRepository, user: object):
     if not line_user_id:
         return
         
-    print(f"--- 開始為使用者 {line_user_id} 執行主動關懷 ---")
+    logger.info("開始為使用者 %s 執行主動關懷", line_user_id)
 
     # 1. 情境建構
     profile_data = {
@@ -190,15 +192,17 @@ def execute_proactive_care(profile_repo: ProfileRepository, user: object):
         )
         care_msg_draft = response.choices[0].message.content.strip()
     except Exception as e:
-        print(f"❌ 為 {line_user_id} 生成關懷訊息時 LLM 呼叫失敗: {e}")
+        logger.exception("為 %s 生成關懷訊息時 LLM 呼叫失敗: %s", line_user_id, e)
         return
 
     if not care_msg_draft or care_msg_draft == "{}":
-        print(f"🤫 LLM 決定對 {line_user_id} 保持沉默，流程結束。")
+        logger.info("LLM 決定對 %s 保持沉默，流程結束。", line_user_id)
         return
 
     # 4. 輸出守衛
     final_care_msg = care_msg_draft
+    # 排程任務可能在多個執行緒同時執行，CrewAI Agent 不可共用，每次建立
+    guardrail_agent = create_guardrail_agent()
     if guardrail_agent:
         guard_task = Task(
             description=f"請檢查以下由 AI 生成的關懷訊息是否合規：'{care_msg_draft}'",
@@ -210,7 +214,7 @@ def execute_proactive_care(profile_repo: ProfileRepository, user: object):
         guard_result = (crew_output.raw if crew_output else "").strip()
         
         if guard_result.startswith("REJECT"):
-            print(f"🛡️ 輸出守衛攔截了對 {line_user_id} 的訊息: {guard_result}")
+            logger.warning("輸出守衛攔截了對 %s 的訊息: %s", line_user_id, guard_result)
             return
 
     # 5. 發送訊息 & 寫入 Redis
@@ -225,7 +229,7 @@ def execute_proactive_care(profile_repo: ProfileRepository, user: object):
 
 def check_and_trigger_dynamic_care():
     """每 10 分鐘執行一次，檢查閒置超過特定時間的使用者。"""
-    print(f"\n[動態任務] {datetime.now(TAIPEI_TZ)} 開始檢查閒置使用者...")
+    logger.info("[動態任務] 開始檢查閒置使用者")
     repo = ProfileRepository()
     db = repo._get_db()
     try:
@@ -244,7 +248,7 @@ def check_and_trigger_dynamic_care():
             ChatUserProfile.last_contact_ts.between(time_window_start, time_window_end)
         ).all()
 
-        print(f"[動態任務] 發現 {len(users_to_care)} 位符合條件的使用者。")
+        logger.info("[動態任務] 發現 %s 位符合條件的使用者。", len(users_to_care))
         for user in users_to_care:
             execute_proactive_care(repo, user)
     finally:
@@ -253,7 +257,7 @@ def check_and_trigger_dynamic_care():
 
 def patrol_silent_users():
     """每週一早上 9 點執行，找出超過 7 天未互動的使用者。"""
-    print(f"\n[巡檢任務] {datetime.now(TAIPEI_TZ)} 開始尋找長期沉默使用者...")
+    logger.info("[巡檢任務] 開始尋找長期沉默使用者")
     repo = ProfileRepository()
     db = repo._get_db()
     try:
@@ -266,7 +270,7 @@ def patrol_silent_users():
             (ChatUserProfile.last_contact_ts == None) | (ChatUserProfile.last_contact_ts < seven_days_ago)
         ).all()
         
-        print(f"[巡檢任務] 發現 {len(users_to_care)} 位符合條件的使用者。")
+        logger.info("[巡檢任務] 發現 %s 位符合條件的使用者。", len(users_to_care))
         for user in users_to_care:
             execute_proactive_care(repo, user)
     finally:
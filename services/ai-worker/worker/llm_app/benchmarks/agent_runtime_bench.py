@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+比較 CrewAI 與 direct 兩種 Agent runtime 在錄製回合上的延遲。
+
+每一行 JSONL 為一個回合：{"user_id": "1", "text": "...", "ctx": "（選填，錄製當下的上下文）"}
+每個回合依序執行 guardrail 與陪伴回覆（不寫入 Redis 歷史），輸出各 runtime 的
+平均 / p50 / p95 延遲與工具呼叫次數。
+
+注意：模型若判斷需要通報，alert_case_manager 會寫入設定中的 Redis Stream，
+請對開發環境執行。
+
+用法（於 worker 目錄）：
+    python -m llm_app.benchmarks.agent_runtime_bench \
+        --turns llm_app/benchmarks/recorded_turns.sample.jsonl --runtimes crewai,direct
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+
+from .. import metrics
+from ..chat_pipeline import COMPANION_PROMPT_TEMPLATE, AgentManager
+from ..request_context import request_scope
+
+
+def load_turns(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _summary(values: list) -> dict:
+    return {
+        "mean_ms": round(statistics.mean(values), 1) if values else 0.0,
+        "p50_ms": round(_percentile(values, 50), 1),
+        "p95_ms": round(_percentile(values, 95), 1),
+    }
+
+
+def run_runtime(runtime: str, turns: list, repeat: int) -> dict:
+    manager = AgentManager(runtime=runtime)
+    metrics.reset()
+    guard_ms, reply_ms, total_ms, errors = [], [], [], 0
+    samples = []
+    for _ in range(repeat):
+        for turn in turns:
+            user_id = str(turn.get("user_id", "bench"))
+            text = turn["text"]
+            try:
+                with request_scope(user_id):
+                    t0 = time.perf_counter()
+                    verdict = manager.run_guardrail(text)
+                    t1 = time.perf_counter()
+                    is_block = verdict.startswith("BLOCK:")
+                    prompt = COMPANION_PROMPT_TEMPLATE.format(
+                        now=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        ctx="" if is_block else (turn.get("ctx") or "無"),
+                        query=text,
+                    )
+                    reply = manager.run_companion(user_id, prompt)
+                    t2 = time.perf_counter()
+            except Exception as e:
+                errors += 1
+                print(f"❌ [{runtime}] {text[:20]}... 失敗: {e}")
+                continue
+            guard_ms.append((t1 - t0) * 1000)
+            reply_ms.append((t2 - t1) * 1000)
+            total_ms.append((t2 - t0) * 1000)
+            samples.append({"text": text, "verdict": verdict, "reply": reply})
+    tool_calls = metrics.snapshot("agent.direct.tool.")
+    return {
+        "runtime": runtime,
+        "turns": len(total_ms),
+        "errors": errors,
+        "guardrail": _summary(guard_ms),
+        "companion": _summary(reply_ms),
+        "total": _summary(total_ms),
+        "tool_calls": tool_calls,
+        "samples": samples,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CrewAI vs direct Agent runtime 延遲比較")
+    parser.add_argument("--turns", required=True, help="錄製回合的 JSONL 檔")
+    parser.add_argument("--runtimes", default="crewai,direct")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--out", help="將完整結果（含回覆樣本）寫入 JSON 檔")
+    args = parser.parse_args()
+
+    turns = load_turns(args.turns)
+    results = [
+        run_runtime(rt.strip(), turns, args.repeat)
+        for rt in args.runtimes.split(",")
+        if rt.strip()
+    ]
+
+    print(f"\n{'runtime':<8} {'turns':>5} {'err':>4} {'guard p50':>10} {'reply p50':>10} {'total p50':>10} {'total p95':>10}")
+    for r in results:
+        print(
+            f"{r['runtime']:<8} {r['turns']:>5} {r['errors']:>4} "
+            f"{r['guardrail']['p50_ms']:>10} {r['companion']['p50_ms']:>10} "
+            f"{r['total']['p50_ms']:>10} {r['total']['p95_ms']:>10}"
+        )
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 結果已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    try:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+    except Exception:
+        pass
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Guardrail 本地預篩的離線評估與分類器訓練。
+
+標註樣本為 JSONL，每行：{"text": "...", "label": "OK" | "BLOCK"}（label 選填）
+
+eval：對每筆樣本執行預篩與 LLM guardrail（ModelGuardrailTool，停用判定快取），
+      報告預篩直接判定的比例、與 LLM / 標註的一致率，以及省下的延遲。
+train：以標註樣本訓練字元 n-gram logistic regression，輸出 GUARD_PREFILTER_WEIGHTS 用的 JSON。
+
+用法（於 worker 目錄）：
+    python -m llm_app.benchmarks.guard_prefilter_eval eval \
+        --samples llm_app/benchmarks/guard_samples.sample.jsonl [--prefilter classifier]
+    python -m llm_app.benchmarks.guard_prefilter_eval train \
+        --samples labeled.jsonl --out guard_weights.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import statistics
+import time
+from collections import defaultdict
+
+# 評估時要量測真正的 LLM 延遲，不能命中判定快取
+os.environ["GUARD_CACHE_ENABLED"] = "false"
+
+from ..toolkits.guard_prefilter import char_ngrams, load_prefilter  # noqa: E402
+from ..toolkits.guardrail_cache import normalize_text  # noqa: E402
+
+
+def load_samples(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _is_block(verdict: str) -> bool:
+    return (verdict or "").startswith("BLOCK")
+
+
+def evaluate(samples: list, spec: str, with_llm: bool = True) -> dict:
+    prefilter = load_prefilter(spec)
+    if prefilter is None:
+        raise ValueError("評估需要啟用預篩（--prefilter 不可為 none）")
+    guard = None
+    if with_llm:
+        from ..toolkits.tools import ModelGuardrailTool
+
+        guard = ModelGuardrailTool()
+
+    pre_ms, llm_ms = [], []
+    decided = agree_llm = agree_label = labeled_decided = 0
+    by_category = defaultdict(int)
+    disagreements = []
+    for s in samples:
+        text = s["text"]
+        t0 = time.perf_counter()
+        pre = prefilter.check(text)
+        pre_ms.append((time.perf_counter() - t0) * 1000)
+
+        llm_verdict = None
+        if guard is not None:
+            t0 = time.perf_counter()
+            llm_verdict = guard._run(text)
+            llm_ms.append((time.perf_counter() - t0) * 1000)
+
+        if pre is None or pre.verdict is None:
+            continue
+        decided += 1
+        by_category[pre.category] += 1
+        if llm_verdict is not None:
+            if _is_block(pre.verdict) == _is_block(llm_verdict):
+                agree_llm += 1
+            else:
+                disagreements.append({"text": text, "prefilter": pre.verdict, "llm": llm_verdict})
+        if s.get("label"):
+            labeled_decided += 1
+            agree_label += _is_block(pre.verdict) == _is_block(s["label"])
+
+    mean_llm = statistics.mean(llm_ms) if llm_ms else 0.0
+    return {
+        "samples": len(samples),
+        "decided_locally": decided,
+        "coverage": round(decided / len(samples), 3) if samples else 0.0,
+        "by_category": dict(by_category),
+        "agreement_with_llm": round(agree_llm / decided, 3) if decided and guard else None,
+        "agreement_with_label": round(agree_label / labeled_decided, 3) if labeled_decided else None,
+        "prefilter_mean_ms": round(statistics.mean(pre_ms), 3) if pre_ms else 0.0,
+        "llm_mean_ms": round(mean_llm, 1),
+        "latency_saved_ms": round(decided * mean_llm - sum(pre_ms), 1),
+        "disagreements": disagreements,
+    }
+
+
+def train(samples: list, epochs: int = 20, lr: float = 0.1, l2: float = 1e-4, n_max: int = 2) -> dict:
+    """以 SGD 訓練 logistic regression；BLOCK 為正類。"""
+    data = [
+        (char_ngrams(normalize_text(s["text"]), n_max), 1.0 if _is_block(s["label"]) else 0.0)
+        for s in samples
+        if s.get("label")
+    ]
+    weights = defaultdict(float)
+    bias = 0.0
+    rng = random.Random(42)
+    for _ in range(epochs):
+        rng.shuffle(data)
+        for grams, y in data:
+            z = max(-30.0, min(30.0, bias + sum(weights[g] for g in grams)))
+            grad = 1.0 / (1.0 + math.exp(-z)) - y
+            bias -= lr * grad
+            for g in grams:
+                weights[g] -= lr * (grad + l2 * weights[g])
+    return {
+        "bias": bias,
+        "n_max": n_max,
+        "weights": {g: round(w, 6) for g, w in weights.items() if abs(w) > 1e-4},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Guardrail 本地預篩評估 / 訓練")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_eval = sub.add_parser("eval")
+    p_eval.add_argument("--samples", required=True)
+    p_eval.add_argument("--prefilter", default=os.getenv("GUARD_PREFILTER", "rules"))
+    p_eval.add_argument("--no-llm", action="store_true", help="只對照標註，不呼叫 LLM guardrail")
+    p_eval.add_argument("--out", help="將完整結果（含不一致樣本）寫入 JSON 檔")
+
+    p_train = sub.add_parser("train")
+    p_train.add_argument("--samples", required=True)
+    p_train.add_argument("--out", required=True)
+    p_train.add_argument("--epochs", type=int, default=20)
+
+    args = parser.parse_args()
+    samples = load_samples(args.samples)
+
+    if args.cmd == "train":
+        model = train(samples, epochs=args.epochs)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(model, f, ensure_ascii=False)
+        print(f"✅ 已輸出 {len(model['weights'])} 個 n-gram 權重到 {args.out}")
+        return
+
+    report = evaluate(samples, args.prefilter, with_llm=not args.no_llm)
+    for key, value in report.items():
+        if key != "disagreements":
+            print(f"{key:<22} {value}")
+    print(f"{'disagreements':<22} {len(report['disagreements'])}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n📄 結果已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    try:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+    except Exception:
+        pass
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+比較組 prompt 時讀取 session 上下文的兩種方式：
+
+- multi：原本的 get_summary（兩次 GET）+ fetch_unsummarized_tail（GET + 整段 LRANGE）
+- lua：get_session_snapshot，一次 EVALSHA 只讀最後 k 筆
+- pipeline：get_session_snapshot 在 Lua 不可用時的 MULTI 替代方案
+
+會在指定的 Redis 寫入一組 session:bench-snapshot-* 測試資料，結束後刪除。
+
+用法（於 worker 目錄）：
+    python -m llm_app.benchmarks.session_snapshot_bench --history 40 --cursor 10 --k 6
+"""
+
+import argparse
+import statistics
+import time
+
+from ..toolkits import redis_store
+
+
+def _percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _summary(values: list) -> dict:
+    return {
+        "mean_ms": round(statistics.mean(values), 3) if values else 0.0,
+        "p50_ms": round(_percentile(values, 50), 3),
+        "p95_ms": round(_percentile(values, 95), 3),
+    }
+
+
+def seed(user_id: str, history: int, cursor: int, round_chars: int, summary_chars: int) -> None:
+    r = redis_store.get_redis()
+    tkey, ckey, hkey, okey = redis_store._snapshot_keys(user_id)
+    r.delete(tkey, ckey, hkey, okey)
+    filler = "長輩今天說喘" * (round_chars // 6 + 1)
+    rounds = [
+        redis_store._encode_round({"input": f"{i} {filler[:round_chars]}", "output": filler[:round_chars], "rid": str(i)})
+        for i in range(history)
+    ]
+    if rounds:
+        r.rpush(hkey, *rounds)
+    r.set(tkey, ("摘要" * summary_chars)[:summary_chars])
+    r.set(ckey, cursor)
+
+
+def _multi(user_id: str, k: int):
+    summary, cursor = redis_store.get_summary(user_id)
+    return summary, cursor, redis_store.fetch_unsummarized_tail(user_id, k=k)
+
+
+def _lua(user_id: str, k: int):
+    return redis_store.get_session_snapshot(user_id, k=k)
+
+
+def _pipeline(user_id: str, k: int):
+    text, cursor, items = redis_store._snapshot_pipelined(redis_store.get_redis_binary(), user_id, k)
+    return text, cursor, [redis_store._decode_round(x) for x in items]
+
+
+def run(fn, user_id: str, k: int, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        fn(user_id, k)
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn(user_id, k)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return _summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="session 上下文讀取：多次呼叫 vs Lua 快照")
+    parser.add_argument("--history", type=int, default=40, help="history 回合數")
+    parser.add_argument("--cursor", type=int, default=10, help="已摘要的回合數")
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--round-chars", type=int, default=200)
+    parser.add_argument("--summary-chars", type=int, default=2000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    args = parser.parse_args()
+
+    user_id = f"bench-snapshot-{int(time.time())}"
+    seed(user_id, args.history, args.cursor, args.round_chars, args.summary_chars)
+    try:
+        baseline = _multi(user_id, args.k)
+        for name, fn in (("lua", _lua), ("pipeline", _pipeline)):
+            if fn(user_id, args.k) != baseline:
+                raise SystemExit(f"❌ {name} 的結果與 multi 不一致")
+
+        results = {
+            name: run(fn, user_id, args.k, args.iterations, args.warmup)
+            for name, fn in (("multi", _multi), ("lua", _lua), ("pipeline", _pipeline))
+        }
+    finally:
+        redis_store.get_redis().delete(*redis_store._snapshot_keys(user_id))
+
+    print(f"\nhistory={args.history} cursor={args.cursor} k={args.k} iterations={args.iterations}")
+    print(f"{'mode':<9} {'mean':>9} {'p50':>9} {'p95':>9}")
+    for name, r in results.items():
+        print(f"{name:<9} {r['mean_ms']:>9} {r['p50_ms']:>9} {r['p95_ms']:>9}")
+    base = results["multi"]["mean_ms"]
+    if base:
+        print(f"\nlua 相對 multi：{results['lua']['mean_ms'] / base:.2f}x 平均耗時")
+
+
+if __name__ == "__main__":
+    try:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+    except Exception:
+        pass
+    main()
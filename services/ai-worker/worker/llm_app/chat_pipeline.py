@@ -1,5 +1,9 @@
 import hashlib
+import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 # 禁用 CrewAI 遙測功能（避免連接錯誤）
@@ -7,7 +11,6 @@ os.environ["OTEL_SDK_DISABLED"] = "true"
 os.environ["CREWAI_TELEMETRY_OPT_OUT"] = "true"
 
 from crewai import Crew, Task
-from openai import OpenAI
 
 from .HealthBot.agent import (
     build_prompt_from_redis,
@@ -15,18 +18,33 @@ from .HealthBot.agent import (
     create_health_companion,
     finalize_session,
 )
+from . import metrics, request_context
+from .openai_client import (
+    OPENAI_TIMEOUT,
+    get_openai_client,
+    install_litellm_usage_hook,
+    record_usage,
+)
+from .request_context import request_scope
+from .direct_agent import ALERT_TOOL_SCHEMA
+from .speculative import SpeculationNeedsTools, SpeculativeCompletion
+from .toolkits import guardrail_cache
+from .toolkits.lru_cache import TTLCache
+from .toolkits.guard_prefilter import PREFILTER_ALERT_MEMO_KEY, load_prefilter, run_prefilter
 from .toolkits.redis_store import (
     acquire_audio_lock,
     append_round,
     get_audio_result,
     make_request_id,
     peek_next_n,
+    RedisLock,
     read_and_clear_audio_segments,
     release_audio_lock,
     set_audio_result,
     set_state_if,
-    try_register_request,
+    xadd_alert,
 )
+from .toolkits.summary_queue import get_summary_queue
 from .toolkits.tools import (
     ModelGuardrailTool,
     SearchMilvusTool,
@@ -35,46 +53,181 @@ from .toolkits.tools import (
 from datetime import datetime
 from .repositories.profile_repository import ProfileRepository # 【新增】
 
+logger = logging.getLogger(__name__)
+
 SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", 5))
+# background：分段摘要交給背景佇列（預設）；inline：回覆前同步摘要
+SUMMARY_MODE = os.getenv("SUMMARY_MODE", "background").lower()
+# 單一回合的處理時限（秒），作為各下游等待的上限；音檔鎖會自動續租，不再受鎖 TTL 限制
+REQUEST_TIMEOUT_SEC = float(os.getenv("REQUEST_TIMEOUT_SEC", 170))
+# 音檔鎖的租期（秒）；處理期間每 1/3 租期自動續租，worker 掛掉時最多這麼久後可被接手
+AUDIO_LOCK_TTL_SEC = int(os.getenv("AUDIO_LOCK_TTL_SEC", 60))
+
+# guardrail 與上下文建構（Profile / Redis / embedding / Milvus）互不相依，
+# 以背景執行緒預先建構上下文，與 guardrail 判斷同時進行
+_context_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CONTEXT_PREFETCH_WORKERS", 8)),
+    thread_name_prefix="ctx-prefetch",
+)
+
+# 推測模式：guardrail 判斷期間就先以串流產生陪伴回覆，OK 時直接採用、BLOCK 時取消。
+# 推測任務會等待上下文預取結果，因此使用獨立的執行緒池，避免與預取任務互相卡住
+SPECULATIVE_REPLY = os.getenv("SPECULATIVE_REPLY", "false").lower() == "true"
+SPECULATIVE_TIMEOUT_SEC = float(os.getenv("SPECULATIVE_TIMEOUT_SEC", 30))
+_speculation_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SPECULATIVE_WORKERS", 8)),
+    thread_name_prefix="speculative",
+)
+
+# CrewAI 經 litellm 發出的呼叫也記錄 usage / prefix cache 命中
+install_litellm_usage_hook()
+
+# guardrail 前的本地預篩（GUARD_PREFILTER=none 時停用）
+_guard_prefilter = load_prefilter()
+
+COMPANION_SYSTEM_PROMPT = "你是會講台語的健康陪伴者，語氣溫暖務實，避免醫療診斷與劑量指示。必要時提醒就醫。"
+
+
+# crewai：沿用 CrewAI Agent/Task/Crew；direct：直接呼叫 chat completions（見 direct_agent.py）
+AGENT_RUNTIME = os.getenv("AGENT_RUNTIME", "crewai").lower()
+
+# 每位使用者的陪伴 Agent 快取上限；逾時或超量時淘汰最久未使用者，下次對話再重建
+HEALTH_AGENT_CACHE_SIZE = int(os.getenv("HEALTH_AGENT_CACHE_SIZE", 512))
+HEALTH_AGENT_CACHE_TTL_SECONDS = int(os.getenv("HEALTH_AGENT_CACHE_TTL_SECONDS", 1800))
 
 
 class AgentManager:
-    def __init__(self):
-        self.guardrail_agent = create_guardrail_agent()
-        self.health_agent_cache = {}
+    def __init__(self, runtime: Optional[str] = None):
+        self.runtime = (runtime or AGENT_RUNTIME).lower()
+        if self.runtime not in ("crewai", "direct"):
+            raise ValueError(f"未知的 AGENT_RUNTIME: {self.runtime}")
+        if self.runtime == "direct":
+            from .direct_agent import DirectGuardrail
+
+            # DirectGuardrail 不保存對話狀態，可跨執行緒共用
+            self.guardrail_agent = DirectGuardrail()
+        else:
+            self.guardrail_agent = None
+        # CrewAI Agent 在 kickoff 期間會保存執行狀態（tools handler、agent_executor），
+        # 多個 consumer 執行緒共用同一個會互相干擾，因此每個執行緒各建一個
+        self._guard_local = threading.local()
+        self.health_agent_cache = TTLCache(
+            HEALTH_AGENT_CACHE_SIZE, HEALTH_AGENT_CACHE_TTL_SECONDS, name="agent_cache"
+        )
 
     def get_guardrail(self):
-        return self.guardrail_agent
+        if self.guardrail_agent is not None:
+            return self.guardrail_agent
+        agent = getattr(self._guard_local, "agent", None)
+        if agent is None:
+            agent = create_guardrail_agent()
+            self._guard_local.agent = agent
+        return agent
 
     def get_health_agent(self, user_id: str):
-        if user_id not in self.health_agent_cache:
-            self.health_agent_cache[user_id] = create_health_companion(user_id)
-        return self.health_agent_cache[user_id]
+        agent = self.health_agent_cache.get(user_id)
+        if agent is not None:
+            metrics.incr("agent_cache.hit")
+            return agent
+        metrics.incr("agent_cache.miss")
+        if self.runtime == "direct":
+            from .direct_agent import DirectHealthAgent
+
+            agent = DirectHealthAgent(user_id)
+        else:
+            agent = create_health_companion(user_id)
+        self.health_agent_cache.set(user_id, agent)
+        return agent
 
     def release_health_agent(self, user_id: str):
-        if user_id in self.health_agent_cache:
-            del self.health_agent_cache[user_id]
+        self.health_agent_cache.pop(user_id)
+
+    def run_guardrail(self, text: str) -> str:
+        """回傳 OK 或 BLOCK: <原因>。"""
+        # 判定快取只在這裡查一次；命中時不必啟動 CrewAI / 呼叫 LLM，
+        # 未命中時由 ModelGuardrailTool 審查並寫入。快取故障時直接走 LLM 審查
+        try:
+            cached = guardrail_cache.get_verdict(text)
+        except Exception as e:
+            logger.warning("guardrail 判定快取讀取失敗: %s", e)
+            cached = None
+        if cached is not None:
+            return cached
+        guard = self.get_guardrail()
+        if self.runtime == "direct":
+            return guard.run(text).strip()
+        t0 = time.perf_counter()
+        guard_task = Task(
+            # 固定的指示在前、使用者輸入在後，保持可快取的前綴
+            description=(
+                "務必使用 model_guardrail 工具進行判斷；"
+                "安全回 OK；需要攔截時回 BLOCK: <原因>（僅此兩種）。"
+                f"判斷是否需要攔截：「{text}」。"
+            ),
+            expected_output="OK 或 BLOCK: <原因>",
+            agent=guard,
+        )
+        try:
+            return (
+                Crew(agents=[guard], tasks=[guard_task], verbose=False).kickoff().raw
+                or ""
+            ).strip()
+        finally:
+            metrics.observe("agent.crewai.guardrail", (time.perf_counter() - t0) * 1000)
+
+    def run_companion(self, user_id: str, task_description: str) -> str:
+        """以使用者的陪伴 Agent 產生回覆（必要時自行呼叫 search_milvus / alert_case_manager）。"""
+        care = self.get_health_agent(user_id)
+        if self.runtime == "direct":
+            return care.run(task_description)
+        t0 = time.perf_counter()
+        task = Task(
+            description=task_description,
+            expected_output="一句極其簡潔、自然、口語化、像家人一樣的回應。",
+            agent=care,
+        )
+        try:
+            return Crew(agents=[care], tasks=[task], verbose=False).kickoff().raw or ""
+        finally:
+            metrics.observe("agent.crewai.companion", (time.perf_counter() - t0) * 1000)
 
 
-def log_session(user_id: str, query: str, reply: str, request_id: Optional[str] = None, line_user_id: str = None):
+def log_session(
+    user_id: str,
+    query: str,
+    reply: str,
+    request_id: Optional[str] = None,
+    line_user_id: str = None,
+    lock: Optional[RedisLock] = None,
+):
     rid = request_id or make_request_id(user_id, query)
-    if not try_register_request(user_id, rid):
+    # 去重、寫入回合、刷新 session 與時間戳在 redis_store 中以單一 Lua 呼叫完成；
+    # 帶 lock 時鎖若已被其他 worker 接手（fencing token 過期）則不寫入
+    appended, pending = append_round(
+        user_id, {"input": query, "output": reply, "rid": rid}, line_user_id=line_user_id, request_id=rid, lock=lock
+    )
+    if not appended:
         # 去重，跳過重複請求
         return
-    # 將 line_user_id 傳遞給 append_round，由 redis_store 統一處理 session 和時間戳更新
-    append_round(user_id, {"input": query, "output": reply, "rid": rid}, line_user_id=line_user_id)
 
+    # 累積滿 5 輪才摘要；background 模式交給背景佇列，回覆不必等 LLM 摘要完成
+    if SUMMARY_MODE == "background":
+        if pending >= SUMMARY_CHUNK_SIZE:
+            get_summary_queue().schedule(user_id)
+        return
     # 嘗試抓下一段 5 輪（不足會回空）→ LLM 摘要 → CAS 提交
     start, chunk = peek_next_n(user_id, SUMMARY_CHUNK_SIZE)
     if start is not None and chunk:
         summarize_chunk_and_commit(user_id, start_round=start, history_chunk=chunk)
 
+# 靜態指示放在最前面、每回合都會變的上下文 / 時間 / 問題放在最後，
+# 讓 system prompt 加上這段指示形成逐位元組相同的前綴，可命中供應商的 prompt prefix cache
 COMPANION_PROMPT_TEMPLATE = """
 # ROLE & GOAL (角色與目標)
-你是一位溫暖、務實且帶有台灣閩南語風格的數位金孫。你的目標是根據以下提供的完整上下文，生成一句**極其簡潔、自然、口語化、像家人一樣**的回應。
+你是一位溫暖、務實且帶有台灣閩南語風格的數位金孫。你的目標是根據最後提供的完整上下文，生成一句**極其簡潔、自然、口語化、像家人一樣**的回應。
 
 # CORE LOGIC & RULES (核心邏輯與規則)
-1.  **情境優先**: 你的所有回覆都**必須**基於以下提供的 [上下文]，特別是 [使用者畫像]、[相關記憶] 和 [近期對話]。不要依賴你的通用知識庫。
+1.  **情境優先**: 你的所有回覆都**必須**基於最後提供的 [上下文]，特別是 [使用者畫像]、[相關記憶] 和 [近期對話]。不要依賴你的通用知識庫。
 2.  **簡潔至上**: 絕對不要說教或給予冗長的罐頭建議。你的回答應該像真人聊天，**通常只包含 1 到 3 句話**。
 3.  **展現記憶**: 如果上下文中有相關內容，請**自然地**在回應中提及，以展現你記得之前的對話。
 4.  **時間感知**: [當前時間] 欄位提供了現在的準確時間，請用它來回答任何關於時間的問題。
@@ -82,22 +235,41 @@ COMPANION_PROMPT_TEMPLATE = """
 6.  **人設一致**: 保持「金孫」人設，語氣要像家人一樣親切。
 7.  **誠實原則**: 對於你無法從上下文中得知的「事實性」資訊（例如：家人的具體近況、天氣預報等），你必須誠實地表示不知道。你可以用提問或祝福的方式來回應，但**嚴禁編造或臆測答案**。
 
-# CONTEXT (上下文)
-[當前時間]: {now}
-[使用者畫像 (Profile)及對話紀錄]: {ctx}
-[使用者最新問題]:
-{query}
-
 # TASK (你的任務)
 
-基於以上所有 CONTEXT，特別是 [使用者畫像]，自然地回應使用者的最新問題。
+基於最後的 CONTEXT，特別是 [使用者畫像]，自然地回應使用者的最新問題。
 你的回應必須極其簡潔，不超過30個中文字、溫暖且符合「金孫」人設。
 
 **工具使用規則**:
 - 如果，且僅當你判斷使用者的問題是在詢問一個**具體的、你不知道的 COPD 相關衛教知識**時，你才應該使用 `search_milvus` 工具來查詢。
 - 在其他情況下（例如閒聊、回應個人狀況），請**不要**使用 `search_milvus` 工具。
+
+# CONTEXT (上下文)
+[使用者畫像 (Profile)及對話紀錄]: {ctx}
+[當前時間]: {now}
+[使用者最新問題]:
+{query}
 """
 
+def _companion_messages(ctx: str, full_text: str):
+    """直接呼叫 OpenAI 時使用的陪伴回覆訊息（含 Milvus 衛教檢索）。"""
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    qa = SearchMilvusTool()._run(full_text)
+    full_ctx = ctx
+    if qa and qa != '[查無高相似度結果]':
+        full_ctx += f"\n\n[相關檢索資訊]:\n{qa}"
+
+    prompt = COMPANION_PROMPT_TEMPLATE.format(
+        now=now_str,
+        ctx=full_ctx,
+        query=full_text
+    )
+    return [
+        {"role": "system", "content": COMPANION_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
 def handle_user_message(
     agent_manager: AgentManager,
     user_id: str,
@@ -105,6 +277,22 @@ def handle_user_message(
     line_user_id: str = None, # 【新增】
     audio_id: Optional[str] = None,
     is_final: bool = True,
+) -> str:
+    # 以 request context 傳遞使用者身分（工具、redis_store、log 都從這裡取），
+    # 同一行程可同時處理多段對話而不互相干擾
+    with request_scope(user_id, line_user_id=line_user_id, timeout=REQUEST_TIMEOUT_SEC):
+        return _handle_user_message(
+            agent_manager, user_id, query, line_user_id=line_user_id, audio_id=audio_id, is_final=is_final
+        )
+
+
+def _handle_user_message(
+    agent_manager: AgentManager,
+    user_id: str,
+    query: str,
+    line_user_id: str = None,
+    audio_id: Optional[str] = None,
+    is_final: bool = True,
 ) -> str:
     # 0) 統一音檔 ID（沒帶就用文字 hash 當臨時 ID，向後相容）
     audio_id = audio_id or hashlib.sha1(query.encode("utf-8")).hexdigest()[:16]
@@ -118,9 +306,10 @@ def handle_user_message(
 
     # 2) 音檔級鎖：一次且只一次處理同一段音檔
     lock_id = f"{user_id}#audio:{audio_id}"
-    # 使用獨立的輕量鎖，避免與其他 session state 衝突
-    # P0-1: 增加 TTL 到 180 秒，避免長語音處理時鎖過期
-    if not acquire_audio_lock(lock_id, ttl_sec=180):
+    # 使用獨立的鎖，避免與其他 session state 衝突；處理期間背景續租，
+    # 結果寫入時以 fencing token 確認鎖沒有因逾時被其他 worker 接手
+    lock = acquire_audio_lock(lock_id, ttl_sec=AUDIO_LOCK_TTL_SEC)
+    if lock is None:
         cached = get_audio_result(user_id, audio_id)
         return cached or "我正在處理你的語音，請稍等一下喔。"
 
@@ -129,119 +318,142 @@ def handle_user_message(
         head = read_and_clear_audio_segments(user_id, audio_id)
         full_text = (head + " " + query).strip() if head else query
 
-        # 4) 先 guardrail，再 health agent
-        os.environ["CURRENT_USER_ID"] = user_id
+        # 4) guardrail 與上下文建構同時進行；BLOCK 時丟棄檢索結果
+        ctx_future = request_context.submit(
+            _context_executor,
+            build_prompt_from_redis,
+            user_id,
+            line_user_id=line_user_id,
+            k=6,
+            current_input=full_text,
+        )
+        # 本地預篩：明確的安全短句/緊急狀況直接判定，模糊的才交給 LLM guardrail
+        pre = run_prefilter(_guard_prefilter, full_text)
+        if pre is not None and pre.alert:
+            try:
+                xid = xadd_alert(user_id=user_id, reason=pre.reason, severity="high")
+                # 陪伴 Agent 的 alert_case_manager 在同一回合內不再重複通報
+                req_ctx = request_context.current()
+                if req_ctx is not None:
+                    req_ctx.memo[PREFILTER_ALERT_MEMO_KEY] = xid
+            except Exception as e:
+                logger.warning("預篩通報失敗: %s", e)
+        # verdict 為 None 時（只通報、仍需審查）照樣交給 LLM guardrail
+        pre_verdict = pre.verdict if pre is not None else None
 
-        # 優先用 CrewAI；失敗則 fallback 自行判斷
-        try:
-            guard = agent_manager.get_guardrail()
-            guard_task = Task(
-                description=(
-                    f"判斷是否需要攔截：「{full_text}」。"
-                    "務必使用 model_guardrail 工具進行判斷；"
-                    "安全回 OK；需要攔截時回 BLOCK: <原因>（僅此兩種）。"
-                ),
-                expected_output="OK 或 BLOCK: <原因>",
-                agent=guard,
+        speculation = None
+        if SPECULATIVE_REPLY and pre_verdict is None:
+            speculation = SpeculativeCompletion(
+                _speculation_executor,
+                get_openai_client(),
+                lambda: _companion_messages(ctx_future.result(), full_text),
+                model=os.getenv("MODEL_NAME", "gpt-4o-mini"),
+                temperature=0.5,
+                # 衛教檢索已放進 prompt；模型若要通報個管師，改走完整的工具流程
+                tools=[ALERT_TOOL_SCHEMA],
+                tool_choice="auto",
             )
-            guard_res = (
-                Crew(agents=[guard], tasks=[guard_task], verbose=False).kickoff().raw
-                or ""
-            ).strip()
-        except Exception:
-            guard_res = ModelGuardrailTool()._run(full_text)
+
+        # 優先用 Agent runtime（CrewAI 或 direct）；失敗則 fallback 自行判斷
+        if pre_verdict is not None:
+            guard_res = pre_verdict
+        else:
+            try:
+                guard_res = agent_manager.run_guardrail(full_text)
+            except Exception:
+                guard_res = ModelGuardrailTool()._run(full_text)
+        guard_done_at = time.perf_counter()
 
             # 只保留攔截與否
         is_block = guard_res.startswith("BLOCK:")
         block_reason = guard_res[6:].strip() if is_block else ""
         
-        print(f"🛡️ Guardrail 檢查結果: {'BLOCK' if is_block else 'OK'} - 查詢: '{full_text[:50]}...'")
+        logger.info("Guardrail 檢查結果: %s", "BLOCK" if is_block else "OK")
         if is_block:
-            print(f"🚫 攔截原因: {block_reason}")
+            logger.warning("攔截原因: %s", block_reason)
+            ctx_future.cancel()
 
-        # 產生最終回覆：優先用 CrewAI；失敗則 fallback OpenAI + Milvus 查詢
-        try:
-            care = agent_manager.get_health_agent(user_id)
-            now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            # P0-3: BLOCK 分支直接跳過記憶/RAG 檢索，節省成本
+        # 推測模式：guardrail 判定 OK 時直接採用已在生成中的回覆
+        res = None
+        if speculation is not None:
             if is_block:
-                ctx = ""  # 不檢索記憶
-                print("⚠️ 因安全檢查攔截，跳過記憶檢索")
-            else:
-                ctx = build_prompt_from_redis(user_id, line_user_id=line_user_id, k=6, current_input=full_text)
-            task_description = COMPANION_PROMPT_TEMPLATE.format(
-                now=now_str,
-                ctx=ctx or "無", # 確保 ctx 不是空字串
-                query=full_text
-            )
-            task = Task(
-                description=task_description,
-                expected_output="一句極其簡潔、自然、口語化、像家人一樣的回應。",
-                agent=care,
-            )
-            # task = Task(
-            #     description=(
-            #         f"{ctx}\n\n使用者輸入：{full_text}\n"
-            #         "請以『國民孫女』口吻回覆，遵守【回覆風格規則】：禁止列點、不要用數字或符號開頭、避免學術式摘要；台語混中文、自然聊天感。"
-            #         + (
-            #             "\n【安全政策—必須婉拒】此輸入被安全檢查判定為超出能力範圍（例如違法、成人內容、醫療/用藥/劑量/診斷等具體指示）。"
-            #             "請直接婉拒，**不要**提供任何具體方案、診斷或劑量，也**不要**硬給替代作法。"
-            #             "僅可給一般層級的安全提醒（如：鼓勵諮詢合格醫師/藥師）與情緒安撫的一兩句話。"
-            #             if is_block
-            #             else "\n【正常回覆】若內容屬一般衛教/日常關懷，簡短回應並可給 1–2 個小步驟建議。"
-            #         )
-            #     ),
-            #     expected_output="台語風格的溫暖關懷回覆，必要時使用工具。",
-            #     agent=care,
-            # )
-            res = Crew(agents=[care], tasks=[task], verbose=False).kickoff().raw or ""
-        except Exception:
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-            model = os.getenv("MODEL_NAME", "gpt-4o-mini")
-            if is_block:
-                # P0-3: BLOCK 分支跳過記憶/RAG 檢索
-                sys = "你是會講台語的健康陪伴者。當輸入被判為超出能力範圍時，必須婉拒且不可提供具體方案/診斷/劑量，只能一般性提醒就醫。語氣溫暖、不列點。"
-                user_msg = f"此輸入被判為超出能力範圍（{block_reason or '安全風險'}）。請用台語溫柔婉拒，不提供任何具體建議或替代作法，只做一般安全提醒與情緒安撫 1–2 句。"
-                res_obj = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": sys},
-                        {"role": "user", "content": user_msg},
-                    ],
-                    temperature=0.2,
-                )
-                res = (res_obj.choices[0].message.content or "").strip()
+                speculation.cancel()
             else:
+                try:
+                    res = speculation.result(
+                        timeout=request_context.time_budget(SPECULATIVE_TIMEOUT_SEC),
+                        guard_done_at=guard_done_at,
+                    )
+                except SpeculationNeedsTools:
+                    logger.info("推測生成需要呼叫工具，改走一般流程")
+                    res = None
+                except Exception as e:
+                    logger.warning("推測生成失敗，改走一般流程: %s", e)
+                    res = None
+
+        if res is None:
+            # 產生最終回覆：優先用 Agent runtime；失敗則 fallback OpenAI + Milvus 查詢
+            try:
                 now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                ctx = build_prompt_from_redis(user_id, k=6, current_input=full_text)
-                qa = SearchMilvusTool()._run(full_text)
-                sys = "你是會講台語的健康陪伴者，語氣溫暖務實，避免醫療診斷與劑量指示。必要時提醒就醫。"
-                full_ctx = ctx
-                if qa and qa != '[查無高相似度結果]':
-                    full_ctx += f"\n\n[相關檢索資訊]:\n{qa}"
-
-                prompt = COMPANION_PROMPT_TEMPLATE.format(
+                # P0-3: BLOCK 分支直接跳過記憶/RAG 檢索，節省成本
+                if is_block:
+                    ctx = ""  # 不使用記憶
+                    logger.info("因安全檢查攔截，捨棄記憶檢索結果")
+                else:
+                    ctx = ctx_future.result()
+                task_description = COMPANION_PROMPT_TEMPLATE.format(
                     now=now_str,
-                    ctx=full_ctx,
+                    ctx=ctx or "無", # 確保 ctx 不是空字串
                     query=full_text
                 )
-                # prompt = (
-                #     f"{ctx}\n\n相關資料（可能空）：\n{qa}\n\n"
-                #     f"使用者輸入：{full_text}\n請以台語風格回覆；結尾給一段溫暖鼓勵。"
+                # task = Task(
+                #     description=(
+                #         f"{ctx}\n\n使用者輸入：{full_text}\n"
+                #         "請以『國民孫女』口吻回覆，遵守【回覆風格規則】：禁止列點、不要用數字或符號開頭、避免學術式摘要；台語混中文、自然聊天感。"
+                #         + (
+                #             "\n【安全政策—必須婉拒】此輸入被安全檢查判定為超出能力範圍（例如違法、成人內容、醫療/用藥/劑量/診斷等具體指示）。"
+                #             "請直接婉拒，**不要**提供任何具體方案、診斷或劑量，也**不要**硬給替代作法。"
+                #             "僅可給一般層級的安全提醒（如：鼓勵諮詢合格醫師/藥師）與情緒安撫的一兩句話。"
+                #             if is_block
+                #             else "\n【正常回覆】若內容屬一般衛教/日常關懷，簡短回應並可給 1–2 個小步驟建議。"
+                #         )
+                #     ),
+                #     expected_output="台語風格的溫暖關懷回覆，必要時使用工具。",
+                #     agent=care,
                 # )
-                res_obj = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": sys},
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0.5,
-                )
-                res = (res_obj.choices[0].message.content or "").strip()
+                res = agent_manager.run_companion(user_id, task_description)
+            except Exception:
+                client = get_openai_client(timeout=request_context.time_budget(OPENAI_TIMEOUT))
+                model = os.getenv("MODEL_NAME", "gpt-4o-mini")
+                if is_block:
+                    # P0-3: BLOCK 分支跳過記憶/RAG 檢索
+                    sys = "你是會講台語的健康陪伴者。當輸入被判為超出能力範圍時，必須婉拒且不可提供具體方案/診斷/劑量，只能一般性提醒就醫。語氣溫暖、不列點。"
+                    user_msg = f"此輸入被判為超出能力範圍（{block_reason or '安全風險'}）。請用台語溫柔婉拒，不提供任何具體建議或替代作法，只做一般安全提醒與情緒安撫 1–2 句。"
+                    t0 = time.perf_counter()
+                    res_obj = client.chat.completions.create(
+                        model=model,
+                        messages=[
+                            {"role": "system", "content": sys},
+                            {"role": "user", "content": user_msg},
+                        ],
+                        temperature=0.2,
+                    )
+                    record_usage(res_obj.usage, label="companion", latency_ms=(time.perf_counter() - t0) * 1000)
+                    res = (res_obj.choices[0].message.content or "").strip()
+                else:
+                    messages = _companion_messages(ctx_future.result(), full_text)
+                    t0 = time.perf_counter()
+                    res_obj = client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=0.5,
+                    )
+                    record_usage(res_obj.usage, label="companion", latency_ms=(time.perf_counter() - t0) * 1000)
+                    res = (res_obj.choices[0].message.content or "").strip()
         # 5) 結果快取 + 落歷史
-        set_audio_result(user_id, audio_id, res)
-        log_session(user_id, full_text, res, line_user_id=line_user_id) # 【新增】傳遞 line_user_id
+        if set_audio_result(user_id, audio_id, res, lock=lock):
+            log_session(user_id, full_text, res, line_user_id=line_user_id, lock=lock) # 【新增】傳遞 line_user_id
         return res
 
     finally:
-        release_audio_lock(lock_id)
+        release_audio_lock(lock)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# file: llm_app/direct_agent.py
+"""
+輕量的 Agent runtime：直接呼叫 chat completions，不經過 CrewAI。
+
+- guardrail：直接執行 ModelGuardrailTool（一次 LLM 呼叫），省去 Agent 規劃工具的往返
+- 陪伴回覆：以原生 function calling 提供 search_milvus / alert_case_manager，
+  模型要求呼叫工具時在本地執行並回填結果，直到模型給出最終回覆
+"""
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from openai import OpenAI
+
+from . import metrics
+from .openai_client import get_openai_client, record_usage
+from .HealthBot.agent import HEALTH_COMPANION_TEMPLATE
+from .toolkits.tools import AlertCaseManagerTool, ModelGuardrailTool, SearchMilvusTool
+
+# 每回合最多幾輪工具呼叫；超過後強制模型直接回覆
+DIRECT_MAX_TOOL_ROUNDS = int(os.getenv("DIRECT_MAX_TOOL_ROUNDS", 3))
+
+_reply_temp = float(os.getenv("REPLY_TEMPERATURE", "0.8"))
+
+
+def _tool_schema(tool, param: str, param_desc: str) -> Dict[str, Any]:
+    return {
+        "type": "function",
+        "function": {
+            "name": tool.name,
+            "description": tool.description,
+            "parameters": {
+                "type": "object",
+                "properties": {param: {"type": "string", "description": param_desc}},
+                "required": [param],
+            },
+        },
+    }
+
+
+# 與使用者無關的設定只建立一次，所有 DirectHealthAgent 共用
+_search_tool, _alert_tool = SearchMilvusTool(), AlertCaseManagerTool()
+_TOOL_HANDLERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    _search_tool.name: lambda args: _search_tool._run(args.get("query", "")),
+    _alert_tool.name: lambda args: _alert_tool._run(args.get("reason", "")),
+}
+ALERT_TOOL_SCHEMA = _tool_schema(_alert_tool, "reason", "需要通報個管師的事件描述")
+_TOOL_SCHEMAS = (
+    _tool_schema(_search_tool, "query", "要查詢的 COPD 衛教問題"),
+    ALERT_TOOL_SCHEMA,
+)
+_SYSTEM_PROMPT = (
+    f"你是{HEALTH_COMPANION_TEMPLATE.role}。\n{HEALTH_COMPANION_TEMPLATE.backstory.strip()}\n\n"
+    f"你的目標：\n{HEALTH_COMPANION_TEMPLATE.goal.strip()}"
+)
+
+
+class DirectGuardrail:
+    """與 CrewAI guardrail Agent 相同的輸出格式：OK 或 BLOCK: <原因>。"""
+
+    def __init__(self):
+        self._tool = ModelGuardrailTool()
+
+    def run(self, text: str) -> str:
+        t0 = time.perf_counter()
+        try:
+            return self._tool._run(text)
+        finally:
+            metrics.observe("agent.direct.guardrail", (time.perf_counter() - t0) * 1000)
+
+
+class DirectHealthAgent:
+    """單一使用者的陪伴 Agent；人設與工具與 create_health_companion() 相同。"""
+
+    def __init__(self, user_id: str, client: OpenAI = None):
+        self.user_id = user_id
+        self.model = os.getenv("MODEL_NAME", "gpt-4o-mini")
+        self._client = client or get_openai_client()
+        self._tools: Dict[str, Callable[[Dict[str, Any]], str]] = _TOOL_HANDLERS
+        self._tool_schemas = _TOOL_SCHEMAS
+        self._system_prompt = _SYSTEM_PROMPT
+
+    def _call_tool(self, name: str, raw_args: str) -> str:
+        fn = self._tools.get(name)
+        if fn is None:
+            return f"[未知工具] {name}"
+        try:
+            args = json.loads(raw_args or "{}")
+        except json.JSONDecodeError:
+            return f"[工具參數格式錯誤] {raw_args}"
+        metrics.incr(f"agent.direct.tool.{name}")
+        return fn(args)
+
+    def run(self, task_description: str) -> str:
+        t0 = time.perf_counter()
+        messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": self._system_prompt},
+            {"role": "user", "content": task_description},
+        ]
+        try:
+            for round_no in range(DIRECT_MAX_TOOL_ROUNDS + 1):
+                allow_tools = round_no < DIRECT_MAX_TOOL_ROUNDS
+                t_call = time.perf_counter()
+                res = self._client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    tools=list(self._tool_schemas),
+                    tool_choice="auto" if allow_tools else "none",
+                    temperature=_reply_temp,
+                )
+                record_usage(res.usage, label="companion", latency_ms=(time.perf_counter() - t_call) * 1000)
+                msg = res.choices[0].message
+                if not msg.tool_calls or not allow_tools:
+                    return (msg.content or "").strip()
+
+                messages.append(
+                    {
+                        "role": "assistant",
+                        "content": msg.content,
+                        "tool_calls": [
+                            {
+                                "id": call.id,
+                                "type": "function",
+                                "function": {
+                                    "name": call.function.name,
+                                    "arguments": call.function.arguments,
+                                },
+                            }
+                            for call in msg.tool_calls
+                        ],
+                    }
+                )
+                for call in msg.tool_calls:
+                    messages.append(
+                        {
+                            "role": "tool",
+                            "tool_call_id": call.id,
+                            "content": self._call_tool(call.function.name, call.function.arguments),
+                        }
+                    )
+            return ""
+        finally:
+            metrics.observe("agent.direct.companion", (time.perf_counter() - t0) * 1000)
@@ -1,11 +1,23 @@
-import os
-from openai import OpenAI
+import logging
 from typing import Union, List
 from dotenv import load_dotenv
 
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
+
+# 兼容套件匯入與 load_article.py 的腳本模式（腳本模式不使用快取）
+try:
+    from .embedding_backends import get_embedding_backend
+    from .toolkits import embedding_cache
+except ImportError:
+    from embedding_backends import get_embedding_backend
+    embedding_cache = None
+
+# backend 由 EMBEDDING_BACKEND 決定（openai / local），見 embedding_backends.py
+_backend = get_embedding_backend()
+EMBEDDING_MODEL = _backend.name
+EMBEDDING_DIMS = _backend.dims
 
 
 def to_vector(text: Union[str, List[str]], normalize: bool = True) -> List[float]:
@@ -16,12 +28,10 @@ def to_vector(text: Union[str, List[str]], normalize: bool = True) -> List[float
     else:
         raise TypeError("輸入必須為 str 或 List[str]")
 
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=inputs
-    )
-
-    vectors = [r.embedding for r in response.data]
+    if embedding_cache is not None:
+        vectors = embedding_cache.get_or_embed(inputs, EMBEDDING_MODEL, EMBEDDING_DIMS, _backend.embed)
+    else:
+        vectors = _backend.embed(inputs)
 
     if isinstance(text, str):
         return vectors[0]
@@ -32,7 +42,7 @@ def safe_to_vector(text, normalize: bool = True):
     try:
         return to_vector(text, normalize=normalize)
     except Exception as e:
-        print(f"[embedding error] {e}")
+        logger.warning("embedding 失敗: %s", e)
         return []
 
 
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# file: llm_app/embedding_backends.py
+"""
+可抽換的 embedding backend，由 embedding.to_vector 使用。
+
+- openai：OpenAI embeddings API（預設 text-embedding-3-small，1536 維）
+- local：在本機 CPU 上跑多語言句向量模型，不依賴外部服務
+  * engine=sentence-transformers（預設）：直接載入 Hugging Face 模型
+  * engine=onnx：以 ONNX Runtime 執行匯出的模型（EMBEDDING_ONNX_PATH 目錄內需有
+    model.onnx 與 tokenizer 檔），mean pooling 後做 L2 正規化
+
+本機模型會批次推論（EMBEDDING_BATCH_SIZE）並限制執行緒數（EMBEDDING_NUM_THREADS），
+避免與 STT/TTS 搶 CPU；載入時做一次 warmup，並檢查模型輸出維度與 EMBEDDING_DIMS 一致。
+切換 backend 後 Milvus collection 的維度會不同，需執行 migrate_embeddings 重建向量。
+"""
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+try:
+    from . import metrics
+    from .openai_client import get_openai_client
+except ImportError:  # 腳本模式（例如 load_article.py）
+    import metrics
+    from openai_client import get_openai_client
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+LOCAL_EMBEDDING_MODEL = os.getenv(
+    "LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+LOCAL_EMBEDDING_ENGINE = os.getenv("LOCAL_EMBEDDING_ENGINE", "sentence-transformers").lower()
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+EMBEDDING_NUM_THREADS = int(os.getenv("EMBEDDING_NUM_THREADS", 4))
+EMBEDDING_MAX_SEQ_LENGTH = int(os.getenv("EMBEDDING_MAX_SEQ_LENGTH", 256))
+
+# 各 backend 未設定 EMBEDDING_DIMS 時的預設維度
+DEFAULT_DIMS = {"openai": 1536, "local": 384}
+
+
+class EmbeddingDimensionMismatch(RuntimeError):
+    """模型輸出維度與設定或 Milvus collection 的維度不一致。"""
+
+
+class EmbeddingBackend:
+    """name 會成為快取 key 與 collection 維度檢查的依據；embed 依序回傳每段文字的向量。"""
+
+    name: str = ""
+    dims: int = 0
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+# OpenAI 模型的原生維度；text-embedding-3 系列可用 dimensions 參數縮短輸出
+OPENAI_NATIVE_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, model: str, dims: int):
+        self.name = model
+        self.dims = dims
+        native = OPENAI_NATIVE_DIMS.get(model)
+        # 只有 text-embedding-3 系列支援 dimensions；其他模型必須使用原生維度
+        self._send_dims = model.startswith("text-embedding-3")
+        if native is not None and (dims > native or (not self._send_dims and dims != native)):
+            raise EmbeddingDimensionMismatch(
+                f"{model} 不支援 EMBEDDING_DIMS={dims}（原生維度 {native}"
+                f"{'，只能縮短' if self._send_dims else '，不可調整'}）"
+            )
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        kwargs = {"dimensions": self.dims} if self._send_dims else {}
+        t0 = time.perf_counter()
+        response = get_openai_client().embeddings.create(model=self.name, input=texts, **kwargs)
+        metrics.observe("embedding.backend.openai", (time.perf_counter() - t0) * 1000)
+        vectors = [r.embedding for r in response.data]
+        if vectors and len(vectors[0]) != self.dims:
+            raise EmbeddingDimensionMismatch(
+                f"{self.name} 輸出 {len(vectors[0])} 維，與 EMBEDDING_DIMS={self.dims} 不一致"
+            )
+        return vectors
+
+
+class LocalEmbeddingBackend(EmbeddingBackend):
+    """本機 CPU 句向量模型；模型在第一次 embed 時才載入。"""
+
+    def __init__(
+        self,
+        model: str,
+        dims: int,
+        engine: str = LOCAL_EMBEDDING_ENGINE,
+        onnx_path: str = EMBEDDING_ONNX_PATH,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        num_threads: int = EMBEDDING_NUM_THREADS,
+        max_seq_length: int = EMBEDDING_MAX_SEQ_LENGTH,
+    ):
+        self.name = f"local:{model.rsplit('/', 1)[-1]}"
+        self.dims = dims
+        self.model = model
+        self.engine = engine
+        self.onnx_path = onnx_path
+        self.batch_size = max(1, batch_size)
+        self.num_threads = max(1, num_threads)
+        self.max_seq_length = max_seq_length
+        self._lock = threading.Lock()
+        self._encode = None
+
+    def _load_sentence_transformers(self):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "本機 embedding 需要 sentence-transformers：pip install sentence-transformers"
+            ) from e
+        torch.set_num_threads(self.num_threads)
+        st = SentenceTransformer(self.model, device="cpu")
+        st.max_seq_length = self.max_seq_length
+
+        def encode(texts: List[str]) -> List[List[float]]:
+            arr = st.encode(
+                texts,
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+            return arr.tolist()
+
+        return encode
+
+    def _load_onnx(self):
+        try:
+            import numpy as np
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise RuntimeError(
+                "ONNX embedding 需要 onnxruntime 與 transformers：pip install onnxruntime transformers"
+            ) from e
+        if not self.onnx_path:
+            raise RuntimeError("LOCAL_EMBEDDING_ENGINE=onnx 需設定 EMBEDDING_ONNX_PATH")
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = self.num_threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(
+            os.path.join(self.onnx_path, "model.onnx"),
+            sess_options=opts,
+            providers=["CPUExecutionProvider"],
+        )
+        tokenizer = AutoTokenizer.from_pretrained(self.onnx_path)
+        input_names = {i.name for i in session.get_inputs()}
+
+        def encode(texts: List[str]) -> List[List[float]]:
+            out: List[List[float]] = []
+            for i in range(0, len(texts), self.batch_size):
+                batch = tokenizer(
+                    texts[i : i + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_seq_length,
+                    return_tensors="np",
+                )
+                feeds = {k: v.astype(np.int64) for k, v in batch.items() if k in input_names}
+                hidden = session.run(None, feeds)[0]  # (batch, seq, hidden)
+                mask = batch["attention_mask"][..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+                out.extend(pooled.tolist())
+            return out
+
+        return encode
+
+    def _ensure_loaded(self):
+        if self._encode is not None:
+            return self._encode
+        with self._lock:
+            if self._encode is None:
+                t0 = time.perf_counter()
+                encode = self._load_onnx() if self.engine == "onnx" else self._load_sentence_transformers()
+                actual = len(encode(["warmup"])[0])
+                if actual != self.dims:
+                    raise EmbeddingDimensionMismatch(
+                        f"本機模型 {self.model} 輸出 {actual} 維，但 EMBEDDING_DIMS={self.dims}"
+                    )
+                logger.info(
+                    "已載入本機模型 %s（%s, %s 維, threads=%s），耗時 %.1fs",
+                    self.model,
+                    self.engine,
+                    actual,
+                    self.num_threads,
+                    time.perf_counter() - t0,
+                )
+                self._encode = encode
+        return self._encode
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        encode = self._ensure_loaded()
+        t0 = time.perf_counter()
+        vectors = encode(texts)
+        metrics.observe("embedding.backend.local", (time.perf_counter() - t0) * 1000)
+        return vectors
+
+
+def create_embedding_backend(kind: Optional[str] = None) -> EmbeddingBackend:
+    kind = (kind or EMBEDDING_BACKEND).lower()
+    if kind not in DEFAULT_DIMS:
+        raise ValueError(f"未知的 EMBEDDING_BACKEND: {kind}（可用：openai、local）")
+    # EMBED_DIM 為舊設定名稱，仍然接受
+    dims = int(os.getenv("EMBEDDING_DIMS") or os.getenv("EMBED_DIM") or DEFAULT_DIMS[kind])
+    if kind == "local":
+        return LocalEmbeddingBackend(LOCAL_EMBEDDING_MODEL, dims)
+    return OpenAIEmbeddingBackend(os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"), dims)
+
+
+_backend: Optional[EmbeddingBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_embedding_backend() -> EmbeddingBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_embedding_backend()
+    return _backend
+
+
+def collection_dim(collection) -> Optional[int]:
+    """讀出 Milvus collection 中 embedding 欄位的維度。"""
+    for field in collection.schema.fields:
+        if field.name == "embedding":
+            dim = (getattr(field, "params", None) or {}).get("dim")
+            return int(dim) if dim is not None else None
+    return None
+
+
+def check_collection_dim(collection, backend: Optional[EmbeddingBackend] = None) -> None:
+    """collection 維度與目前 backend 不符時拋出 EmbeddingDimensionMismatch。"""
+    backend = backend or get_embedding_backend()
+    actual = collection_dim(collection)
+    if actual is not None and actual != backend.dims:
+        metrics.incr("embedding.dim_mismatch")
+        raise EmbeddingDimensionMismatch(
+            f"collection {collection.name} 的向量為 {actual} 維，目前 embedding backend "
+            f"{backend.name} 為 {backend.dims} 維；請執行 python -m llm_app.migrate_embeddings"
+        )
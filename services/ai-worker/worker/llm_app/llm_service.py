@@ -1,4 +1,5 @@
 import importlib
+import logging
 import os
 import sys
 from typing import Any, Dict
@@ -7,6 +8,7 @@ from typing import Any, Dict
 os.environ["OTEL_SDK_DISABLED"] = "true"
 os.environ["CREWAI_TELEMETRY_OPT_OUT"] = "true"
 
+from . import metrics
 from .chat_pipeline import AgentManager, handle_user_message
 from .HealthBot.agent import finalize_session
 
@@ -18,12 +20,14 @@ except Exception:
     sys.path.append(os.path.dirname(os.path.dirname(__file__)))
     from llm_app.chat_pipeline import AgentManager, handle_user_message
 
+logger = logging.getLogger(__name__)
+
 
 class LLMService:
     """LLM 微服務接口，負責 Milvus 連接和多用戶會話管理"""
 
     def __init__(self) -> None:
-        print("🚀 Initializing a new LLMService instance...")
+        logger.info("Initializing a new LLMService instance")
         self.agent_manager = AgentManager()
         self._milvus_connected = False
         self._ensure_milvus_connection()
@@ -39,10 +43,9 @@ class LLMService:
             milvus_uri = os.getenv("MILVUS_URI", "http://localhost:19530")
             connections.connect(alias="default", uri=milvus_uri)
             self._milvus_connected = True
-            print("✅ Milvus 連接成功")
+            logger.info("Milvus 連接成功")
         except Exception as e:
-            print(f"⚠️  Milvus 連接失敗: {e}")
-            print("長期記憶功能可能不可用")
+            logger.warning("Milvus 連接失敗，長期記憶功能可能不可用: %s", e)
 
 
     def generate_response(self, task_data: Dict[str, Any]) -> str:
@@ -85,23 +88,27 @@ class LLMService:
             )
             return response_text
         except Exception as e:
-            print(f"[LLMService] 發生錯誤：{e}")
+            logger.exception("generate_response 發生錯誤：%s", e)
             return "抱歉，無法生成回應。"
     def finalize_user_session_now(self, user_id: str):
         """
         【新函式】供排程任務呼叫，立即執行指定用戶的 Session 結束流程。
         """
-        print(f"⏳ Triggering finalization for expired session: {user_id}")
+        logger.info("Triggering finalization for expired session: %s", user_id)
         try:
             # 整理長期記憶並釋放 Agent
             finalize_session(user_id)
             self.agent_manager.release_health_agent(user_id)
-            print(f"✅ Session finalized and agent released for user: {user_id}")
+            logger.info("Session finalized and agent released for user: %s", user_id)
         except Exception as e:
-            print(f"⚠️ Error during scheduled finalization for {user_id}: {e}")
+            logger.exception("Error during scheduled finalization for %s: %s", user_id, e)
             # 即使失敗，也要確保 agent 被釋放
             self.agent_manager.release_health_agent(user_id)
 
+    def get_metrics(self, prefix: str = "") -> Dict[str, float]:
+        """回傳行程內的效能計數器（例如 speculative.*）。"""
+        return metrics.snapshot(prefix)
+
 llm_service_instance = LLMService()
 
 def run_interactive_test():
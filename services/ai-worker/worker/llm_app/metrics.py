@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# file: llm_app/metrics.py
+"""
+行程內的輕量效能計數器（thread-safe）。
+
+各模組以點分隔的名稱記錄計數，例如 `speculative.cancelled`；
+耗時以 observe() 記錄，會同時累計 `<name>.count` 與 `<name>.sum_ms`。
+"""
+import threading
+from collections import defaultdict
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+
+
+def incr(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name: str, millis: float) -> None:
+    with _lock:
+        _counters[f"{name}.count"] += 1
+        _counters[f"{name}.sum_ms"] += millis
+
+
+def get(name: str) -> float:
+    with _lock:
+        return _counters.get(name, 0.0)
+
+
+def hit_ratio(prefix: str) -> float:
+    """依 `<prefix>.hit` / `<prefix>.miss` 計算命中率。"""
+    with _lock:
+        hit = _counters.get(f"{prefix}.hit", 0.0)
+        miss = _counters.get(f"{prefix}.miss", 0.0)
+    total = hit + miss
+    return hit / total if total else 0.0
+
+
+def snapshot(prefix: str = "") -> Dict[str, float]:
+    with _lock:
+        return {k: v for k, v in sorted(_counters.items()) if k.startswith(prefix)}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
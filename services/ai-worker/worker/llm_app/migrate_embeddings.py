@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# file: llm_app/migrate_embeddings.py
+"""
+以目前的 embedding backend 重建 Milvus collection 的向量。
+
+切換 EMBEDDING_BACKEND（例如 openai → local）後向量維度會改變，舊 collection 無法
+再寫入或檢索。此腳本對每個 collection：
+1. 以 query_iterator 讀出所有非向量欄位
+2. 依與寫入時相同的規則組出文字，批次重新 embed
+3. 寫入新的 <name>__migrating（schema 與索引沿用舊的，只改 dim）
+4. 舊 collection 改名為 <name>__bak_<時間>，新 collection 改名為原名
+
+使用（在 worker 目錄下，需與 ai-worker 相同的 .env）：
+    python -m llm_app.migrate_embeddings --collections copd_qa user_memory_v2 --dry-run
+    python -m llm_app.migrate_embeddings --drop-old
+
+完成後需重新啟動 ai-worker，讓已快取的 collection 重新載入。
+"""
+import argparse
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, connections, utility
+
+from .embedding_backends import EmbeddingBackend, collection_dim, get_embedding_backend
+
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+MEMORY_COLLECTION = os.getenv("MEMORY_COLLECTION", "user_memory_v2")
+
+
+def _qa_text(row: Dict[str, Any]) -> str:
+    # 與 load_article.py 相同：Q + " " + A
+    return f"{row.get('question', '')} {row.get('answer', '')}"
+
+
+def _memory_text(row: Dict[str, Any]) -> str:
+    # 與 HealthBot.agent 抽取記憶原子時相同：[norm_key] text
+    nk, text = row.get("norm_key") or "", row.get("text") or ""
+    return f"[{nk}] {text}" if nk else text
+
+
+TEXT_BUILDERS: Dict[str, Callable[[Dict[str, Any]], str]] = {
+    "copd_qa": _qa_text,
+    MEMORY_COLLECTION: _memory_text,
+}
+
+# 舊 collection 讀不到索引設定時使用（與建立時相同）
+DEFAULT_INDEX = {
+    "copd_qa": {"metric_type": "COSINE", "index_type": "IVF_FLAT", "params": {"nlist": 128}},
+    MEMORY_COLLECTION: {
+        "index_type": "HNSW",
+        "metric_type": "COSINE",
+        "params": {"M": 16, "efConstruction": 200},
+    },
+}
+
+
+def _clone_schema(old: Collection, dims: int) -> CollectionSchema:
+    fields = []
+    for f in old.schema.fields:
+        params = dict(getattr(f, "params", None) or {})
+        if f.name == "embedding":
+            params["dim"] = dims
+        fields.append(
+            FieldSchema(
+                name=f.name,
+                dtype=f.dtype,
+                description=f.description or "",
+                is_primary=f.is_primary,
+                auto_id=f.auto_id if f.is_primary else False,
+                **params,
+            )
+        )
+    return CollectionSchema(fields, description=old.schema.description or "")
+
+
+def _index_params(old: Collection) -> Dict[str, Any]:
+    for idx in old.indexes:
+        if idx.field_name == "embedding" and idx.params:
+            return dict(idx.params)
+    return DEFAULT_INDEX.get(old.name, DEFAULT_INDEX["copd_qa"])
+
+
+def _iter_rows(old: Collection, output_fields: List[str], batch_size: int):
+    it = old.query_iterator(batch_size=batch_size, expr="", output_fields=output_fields)
+    try:
+        while True:
+            batch = it.next()
+            if not batch:
+                return
+            yield batch
+    finally:
+        it.close()
+
+
+def migrate_collection(
+    name: str, backend: EmbeddingBackend, batch_size: int, dry_run: bool, drop_old: bool, force: bool
+) -> None:
+    if not utility.has_collection(name):
+        print(f"[migrate] 找不到 collection {name}，略過")
+        return
+    build_text = TEXT_BUILDERS.get(name)
+    if build_text is None:
+        raise ValueError(f"不知道如何為 {name} 組出 embedding 文字（支援：{', '.join(TEXT_BUILDERS)}）")
+
+    old = Collection(name)
+    old_dim = collection_dim(old)
+    print(f"[migrate] {name}: {old.num_entities} 筆，{old_dim} 維 → {backend.name} {backend.dims} 維")
+    if old_dim == backend.dims and not force:
+        print(f"[migrate] {name} 維度已一致，略過（需要重建請加 --force）")
+        return
+    if dry_run:
+        return
+
+    auto_id_field = next((f.name for f in old.schema.fields if f.is_primary and f.auto_id), None)
+    output_fields = [f.name for f in old.schema.fields if f.dtype != DataType.FLOAT_VECTOR]
+    insert_fields = [n for n in output_fields if n != auto_id_field]
+
+    tmp_name = f"{name}__migrating"
+    if utility.has_collection(tmp_name):
+        utility.drop_collection(tmp_name)
+    new = Collection(tmp_name, schema=_clone_schema(old, backend.dims))
+
+    old.load()
+    t0 = time.perf_counter()
+    total = 0
+    for rows in _iter_rows(old, output_fields, batch_size):
+        vectors = backend.embed([build_text(r) for r in rows])
+        new.insert([{**{k: r[k] for k in insert_fields}, "embedding": v} for r, v in zip(rows, vectors)])
+        total += len(rows)
+        print(f"[migrate] {name}: 已重建 {total} 筆")
+    new.flush()
+    new.create_index(field_name="embedding", index_params=_index_params(old))
+    new.load()
+    elapsed = time.perf_counter() - t0
+    print(f"[migrate] {name}: {total} 筆完成，耗時 {elapsed:.1f}s")
+
+    old.release()
+    backup = f"{name}__bak_{time.strftime('%Y%m%d%H%M%S')}"
+    utility.rename_collection(name, backup)
+    utility.rename_collection(tmp_name, name)
+    if drop_old:
+        utility.drop_collection(backup)
+        print(f"[migrate] {name}: 已切換並刪除舊 collection")
+    else:
+        print(f"[migrate] {name}: 已切換，舊 collection 保留為 {backup}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以目前的 embedding backend 重建 Milvus 向量")
+    parser.add_argument("--collections", nargs="+", default=["copd_qa", MEMORY_COLLECTION])
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--dry-run", action="store_true", help="只列出維度與筆數，不寫入")
+    parser.add_argument("--drop-old", action="store_true", help="切換後刪除舊 collection")
+    parser.add_argument("--force", action="store_true", help="維度相同也重建（例如換了同維度的模型）")
+    args = parser.parse_args()
+
+    connections.connect(alias="default", uri=MILVUS_URI)
+    backend = get_embedding_backend()
+    for name in args.collections:
+        migrate_collection(name, backend, args.batch_size, args.dry_run, args.drop_old, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 # llm_app/models/chat_profile.py
-from sqlalchemy import create_engine, Column, String, DateTime, Integer, ForeignKey
+from sqlalchemy import create_engine, Column, String, DateTime, Integer, ForeignKey, UniqueConstraint
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import sessionmaker, declarative_base
 from datetime import datetime
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # 建立一個獨立的 SQLAlchemy 連線，專供聊天機器人 Profile 使用
 # 這樣可以避免與主框架的 Flask-SQLAlchemy 實例產生衝突
 DATABASE_URL = "postgresql://{user}:{password}@{host}:{port}/{dbname}".format(
@@ -35,10 +38,23 @@ class ChatUserProfile(Base):
     created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
 
+class ChatRoundArchive(Base):
+    """已摘要並自 Redis history 修剪掉的對話回合；session 結束（finalize）後刪除。"""
+    __tablename__ = 'chat_round_archive'
+    __table_args__ = (UniqueConstraint('user_id', 'round_index', name='uq_chat_round_archive_user_round'),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # 與 Redis session key 相同的 user_id 字串（測試帳號可能不是數字）
+    user_id = Column(String, nullable=False, index=True)
+    # 回合在整個 session 中的邏輯序號，與 summary:rounds 游標同一套編號
+    round_index = Column(Integer, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
 def create_profile_table_if_not_exists():
     """在應用啟動時確保表格存在"""
     try:
         Base.metadata.create_all(bind=engine)
-        print("✅ [Profile DB] ChatUserProfile 表格已確認存在。")
+        logger.info("ChatUserProfile / ChatRoundArchive 表格已確認存在。")
     except Exception as e:
-        print(f"❌ [Profile DB] 建立 ChatUserProfile 表格失敗: {e}")
\ No newline at end of file
+        logger.exception("建立 ChatUserProfile 表格失敗: %s", e)
\ No newline at end of file
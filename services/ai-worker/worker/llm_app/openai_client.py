@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# file: llm_app/openai_client.py
+"""
+行程共用的 OpenAI client。
+
+以往每個呼叫點都 new 一個 OpenAI()，各自建立連線池，每次呼叫都要重做 TCP/TLS 握手。
+這裡統一建立一個 sync 與一個 async client，共用調整過的 httpx 連線池：
+- 連線上限 / keep-alive 數量與閒置時間可調，安裝 h2 時啟用 HTTP/2（單一連線多工）
+- 預設逾時與重試次數；個別呼叫可用 get_openai_client(timeout=...) 覆寫逾時
+- 以 httpcore trace 記錄新建連線數與 TTFB，可算出連線重用率：
+  openai.http.requests / openai.http.new_connections / openai.http.ttfb.*
+- record_usage() 記錄 token 用量與 prompt prefix cache 命中的 cached_tokens，
+  CrewAI 經 litellm 發出的呼叫由 install_litellm_usage_hook() 一併記錄
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+try:
+    from . import metrics
+except ImportError:  # 腳本模式（例如 load_article.py）
+    import metrics
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 64))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", 32))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 120))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 2))
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+# 估算 prefix cache 省下的費用：輸入 token 單價（USD / 1M）與快取 token 的折扣比例
+OPENAI_INPUT_PRICE_PER_1M = float(os.getenv("OPENAI_INPUT_PRICE_PER_1M", 0.15))
+OPENAI_CACHED_INPUT_DISCOUNT = float(os.getenv("OPENAI_CACHED_INPUT_DISCOUNT", 0.5))
+
+_lock = threading.Lock()
+_client: Optional[OpenAI] = None
+_async_client: Optional[AsyncOpenAI] = None
+
+
+def _http2_enabled() -> bool:
+    if not OPENAI_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  httpx 的 HTTP/2 需要 h2 套件
+    except ImportError:
+        return False
+    return True
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def _on_trace_event(event_name: str, started_at: float) -> None:
+    if event_name == "connection.connect_tcp.complete":
+        metrics.incr("openai.http.new_connections")
+    elif event_name.endswith("receive_response_headers.complete"):
+        metrics.observe("openai.http.ttfb", (time.perf_counter() - started_at) * 1000)
+
+
+def _on_request(request: httpx.Request) -> None:
+    metrics.incr("openai.http.requests")
+    started_at = time.perf_counter()
+    request.extensions["trace"] = lambda event_name, info: _on_trace_event(event_name, started_at)
+
+
+async def _on_request_async(request: httpx.Request) -> None:
+    metrics.incr("openai.http.requests")
+    started_at = time.perf_counter()
+
+    async def trace(event_name, info):
+        _on_trace_event(event_name, started_at)
+
+    request.extensions["trace"] = trace
+
+
+def _on_response(response: httpx.Response) -> None:
+    if response.status_code >= 400:
+        metrics.incr(f"openai.http.status_{response.status_code}")
+
+
+async def _on_response_async(response: httpx.Response) -> None:
+    _on_response(response)
+
+
+def get_openai_client(timeout: Optional[float] = None) -> OpenAI:
+    """取得共用的 sync client；timeout 只影響這次取得的 client 檢視，不改變共用設定。"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                http_client = httpx.Client(
+                    limits=_limits(),
+                    timeout=_timeout(),
+                    http2=_http2_enabled(),
+                    event_hooks={"request": [_on_request], "response": [_on_response]},
+                )
+                _client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    http_client=http_client,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    timeout=_timeout(),
+                )
+    return _client.with_options(timeout=timeout) if timeout is not None else _client
+
+
+def get_async_openai_client(timeout: Optional[float] = None) -> AsyncOpenAI:
+    """取得共用的 async client（需在同一個 event loop 中使用）。"""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                http_client = httpx.AsyncClient(
+                    limits=_limits(),
+                    timeout=_timeout(),
+                    http2=_http2_enabled(),
+                    event_hooks={"request": [_on_request_async], "response": [_on_response_async]},
+                )
+                _async_client = AsyncOpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    http_client=http_client,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    timeout=_timeout(),
+                )
+    return _async_client.with_options(timeout=timeout) if timeout is not None else _async_client
+
+
+def connection_reuse_ratio() -> float:
+    """請求中沿用既有連線的比例。"""
+    requests = metrics.get("openai.http.requests")
+    if not requests:
+        return 0.0
+    return max(0.0, 1.0 - metrics.get("openai.http.new_connections") / requests)
+
+
+def _field(obj, name: str):
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def record_usage(usage, label: str = "chat", latency_ms: Optional[float] = None) -> None:
+    """
+    記錄一次 chat completion 的 usage（OpenAI 或 litellm 的物件 / dict 皆可）：
+    openai.usage.{prompt,cached,completion}_tokens、各 label 的 prompt/cached tokens、
+    省下的估計費用，以及依是否命中 prefix cache 分開的延遲 openai.latency.{cached,uncached}。
+    """
+    if usage is None:
+        return
+    prompt = int(_field(usage, "prompt_tokens") or 0)
+    completion = int(_field(usage, "completion_tokens") or 0)
+    cached = int(_field(_field(usage, "prompt_tokens_details"), "cached_tokens") or 0)
+    metrics.incr("openai.usage.calls")
+    metrics.incr("openai.usage.prompt_tokens", prompt)
+    metrics.incr("openai.usage.cached_tokens", cached)
+    metrics.incr("openai.usage.completion_tokens", completion)
+    metrics.incr(f"openai.usage.{label}.prompt_tokens", prompt)
+    metrics.incr(f"openai.usage.{label}.cached_tokens", cached)
+    if cached:
+        metrics.incr("openai.usage.cache_hits")
+        metrics.incr(
+            "openai.usage.cost_saved_usd",
+            cached * OPENAI_INPUT_PRICE_PER_1M / 1_000_000 * OPENAI_CACHED_INPUT_DISCOUNT,
+        )
+    if latency_ms is not None:
+        metrics.observe(f"openai.latency.{'cached' if cached else 'uncached'}", latency_ms)
+
+
+def prefix_cache_report() -> dict:
+    """prefix cache 命中率（以 token 計）、省下的估計費用與命中 / 未命中的平均延遲。"""
+    prompt = metrics.get("openai.usage.prompt_tokens")
+    cached = metrics.get("openai.usage.cached_tokens")
+
+    def mean(name: str) -> float:
+        count = metrics.get(f"{name}.count")
+        return metrics.get(f"{name}.sum_ms") / count if count else 0.0
+
+    return {
+        "token_hit_ratio": cached / prompt if prompt else 0.0,
+        "calls": metrics.get("openai.usage.calls"),
+        "cache_hits": metrics.get("openai.usage.cache_hits"),
+        "cached_tokens": cached,
+        "cost_saved_usd": metrics.get("openai.usage.cost_saved_usd"),
+        "mean_latency_cached_ms": mean("openai.latency.cached"),
+        "mean_latency_uncached_ms": mean("openai.latency.uncached"),
+    }
+
+
+_litellm_hook_installed = False
+
+
+def install_litellm_usage_hook() -> None:
+    """CrewAI 透過 litellm 呼叫模型，掛上 success callback 以記錄同樣的 usage。"""
+    global _litellm_hook_installed
+    if _litellm_hook_installed:
+        return
+    try:
+        import litellm
+    except ImportError:
+        return
+
+    def _on_success(kwargs, completion_response, start_time, end_time):
+        try:
+            latency_ms = (end_time - start_time).total_seconds() * 1000
+        except Exception:
+            latency_ms = None
+        record_usage(_field(completion_response, "usage"), label="crewai", latency_ms=latency_ms)
+
+    litellm.success_callback.append(_on_success)
+    _litellm_hook_installed = True
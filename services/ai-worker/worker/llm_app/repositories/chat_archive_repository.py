@@ -0,0 +1,64 @@
+# llm_app/repositories/chat_archive_repository.py
+from typing import Dict, Iterator, List
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from ..models.chat_profile import SessionLocal, ChatRoundArchive
+
+
+class ChatArchiveRepository:
+    """Redis history 修剪前的冷儲存；以 (user_id, round_index) 去重，重複歸檔不會多寫。"""
+
+    def _get_db(self) -> Session:
+        return SessionLocal()
+
+    def archive_rounds(self, user_id: str, start_index: int, rounds: List[Dict]) -> None:
+        if not rounds:
+            return
+        db = self._get_db()
+        try:
+            stmt = insert(ChatRoundArchive).values(
+                [
+                    {"user_id": str(user_id), "round_index": start_index + i, "payload": r}
+                    for i, r in enumerate(rounds)
+                ]
+            ).on_conflict_do_nothing(index_elements=["user_id", "round_index"])
+            db.execute(stmt)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def iter_rounds(self, user_id: str, batch_size: int = 200) -> Iterator[Dict]:
+        """依 round_index 逐批讀出已歸檔的回合，不一次載入整段歷史。"""
+        db = self._get_db()
+        try:
+            query = (
+                db.query(ChatRoundArchive.payload)
+                .filter(ChatRoundArchive.user_id == str(user_id))
+                .order_by(ChatRoundArchive.round_index)
+                .yield_per(batch_size)
+            )
+            for (payload,) in query:
+                yield payload
+        finally:
+            db.close()
+
+    def delete_rounds(self, user_id: str) -> int:
+        db = self._get_db()
+        try:
+            count = (
+                db.query(ChatRoundArchive)
+                .filter(ChatRoundArchive.user_id == str(user_id))
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            return count
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
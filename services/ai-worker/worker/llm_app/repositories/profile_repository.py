@@ -4,6 +4,16 @@ from sqlalchemy import func # 【新增】導入 func 以使用 now()
 from ..models.chat_profile import SessionLocal, ChatUserProfile
 from datetime import datetime
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _profile_cache():
+    # 延遲匯入：redis_store 本身會匯入此模組
+    from ..toolkits import profile_cache
+    return profile_cache
+
 
 class ProfileRepository:
     def _get_db(self) -> Session:
@@ -15,7 +25,7 @@ class ProfileRepository:
         try:
             profile = db.query(ChatUserProfile).filter(ChatUserProfile.user_id == user_id).first()
             if not profile:
-                print(f"[Profile Repo] 找不到 user_id={user_id} 的 Profile，將建立新紀錄。")
+                logger.info("找不到 user_id=%s 的 Profile，將建立新紀錄。", user_id)
                 profile = ChatUserProfile(
                     user_id=user_id,
                     line_user_id=line_user_id, # 使用傳入的 line_user_id
@@ -24,31 +34,38 @@ class ProfileRepository:
                 db.add(profile)
                 db.commit()
                 db.refresh(profile)
+                _profile_cache().invalidate(user_id)
             return profile
         finally:
             db.close()
 
-    def read_profile_as_dict(self, user_id: str) -> dict:
-        """讀取 Profile 並以字典格式回傳。"""
-        profile = self.get_or_create_by_user_id(user_id)
-        return {
+    def read_profile_as_dict(self, user_id: str, line_user_id: str = None) -> dict:
+        """讀取 Profile 並以字典格式回傳；先查快取，未命中才讀 DB 並寫回快取。"""
+        cache = _profile_cache()
+        cached, gen = cache.lookup(user_id)
+        if cached is not None:
+            return cached
+        profile = self.get_or_create_by_user_id(user_id, line_user_id=line_user_id)
+        data = {
             "personal_background": profile.profile_personal_background or {},
             "health_status": profile.profile_health_status or {},
             "life_events": profile.profile_life_events or {}
         }
+        cache.store(user_id, data, gen)
+        return data
 
     def update_profile_facts(self, user_id: int, facts_to_update: dict) -> None:
         """根據 Profiler 產生的指令集，安全地更新 Profile。"""
         if not facts_to_update or (not facts_to_update.get('add') and not facts_to_update.get('update') and not facts_to_update.get('remove')):
             # 【修正】修正日誌輸出中的變數名稱錯誤
-            print(f"[Profile Repo] 無任何更新指令，跳過 {user_id} 的 Profile 更新。")
+            logger.info("無任何更新指令，跳過 %s 的 Profile 更新。", user_id)
             return
 
         db = self._get_db()
         try:
             profile = db.query(ChatUserProfile).filter(ChatUserProfile.user_id == user_id).first()
             if not profile:
-                print(f"[Profile Repo] 更新失敗，找不到 user_id={user_id} 的 Profile。")
+                logger.warning("更新失敗，找不到 user_id=%s 的 Profile。", user_id)
                 return
 
             # 【新增】一個旗標來追蹤是否有實際變動
@@ -106,9 +123,10 @@ class ProfileRepository:
             if is_modified:
                 profile.updated_at = func.now()
                 db.commit()
-                print(f"✅ [Profile Repo] 成功更新 user_id={user_id} 的 Profile。")
+                _profile_cache().invalidate(user_id)
+                logger.info("成功更新 user_id=%s 的 Profile。", user_id)
             else:
-                print(f"ℹ️ [Profile Repo] user_id={user_id} 的 Profile 無需變動。")
+                logger.info("user_id=%s 的 Profile 無需變動。", user_id)
         finally:
             db.close()
 
@@ -118,23 +136,27 @@ class ProfileRepository:
         try:
             # 【修正】直接在此 session 中查詢，避免建立新 session
             profile = db.query(ChatUserProfile).filter(ChatUserProfile.user_id == int(user_id)).first()
+            created = False
 
             # 如果使用者不存在，理論上應該在之前的流程被建立，但此處做個保險
             if not profile:
-                print(f"DEBUG: Profile for user {user_id} not found, creating it.")
+                logger.debug("Profile for user %s not found, creating it.", user_id)
                 profile = ChatUserProfile(
                     user_id=int(user_id),
                     line_user_id=line_user_id,
                 )
                 db.add(profile)
+                created = True
             
-            print(f"DEBUG: Profile for user {user_id} found/created. Current last_contact_ts: {profile.last_contact_ts}")
+            logger.debug("Profile for user %s found/created. Current last_contact_ts: %s", user_id, profile.last_contact_ts)
             
             # 更新時間
             profile.last_contact_ts = func.now()
             db.commit()
+            if created:
+                _profile_cache().invalidate(user_id)
         except Exception as e:
             db.rollback()
-            print(f"❌ [Profile Repo] 更新 user_id={user_id} 的 last_contact_ts 失敗: {e}")
+            logger.exception("更新 user_id=%s 的 last_contact_ts 失敗: %s", user_id, e)
         finally:
             db.close()
\ No newline at end of file
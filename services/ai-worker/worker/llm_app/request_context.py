@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# file: llm_app/request_context.py
+"""
+每個請求（一段對話回合）的上下文，以 contextvars 傳遞。
+
+取代以往的 os.environ["CURRENT_USER_ID"]：環境變數是整個行程共用的，同時處理
+兩段對話時工具可能讀到另一位使用者。ContextVar 在每個執行緒 / asyncio task 中
+各自獨立；送進執行緒池的工作需以 submit() 帶上目前的上下文。
+"""
+import contextvars
+import logging
+import time
+import uuid
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    user_id: str
+    line_user_id: Optional[str] = None
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    deadline: Optional[float] = None  # time.monotonic() 的截止時間點
+    # 回合內的暫存（例如同一段文字的 embedding），隨上下文一起傳到背景執行緒
+    memo: Dict[str, Any] = field(default_factory=dict, compare=False, repr=False)
+
+    def remaining(self) -> Optional[float]:
+        """距離截止還有幾秒；沒有截止時間時回傳 None。"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+_current: contextvars.ContextVar[Optional[RequestContext]] = contextvars.ContextVar(
+    "llm_request_context", default=None
+)
+
+
+def current() -> Optional[RequestContext]:
+    return _current.get()
+
+
+def current_user_id(default: str = "unknown") -> str:
+    ctx = _current.get()
+    return ctx.user_id if ctx else default
+
+
+def current_line_user_id() -> Optional[str]:
+    ctx = _current.get()
+    return ctx.line_user_id if ctx else None
+
+
+def current_request_id() -> Optional[str]:
+    ctx = _current.get()
+    return ctx.request_id if ctx else None
+
+
+def time_budget(default: float) -> float:
+    """在 default 與請求剩餘時間之間取較小者，作為下游呼叫的逾時。"""
+    ctx = _current.get()
+    remaining = ctx.remaining() if ctx else None
+    return default if remaining is None else min(default, remaining)
+
+
+@contextmanager
+def request_scope(
+    user_id: str,
+    line_user_id: Optional[str] = None,
+    request_id: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[RequestContext]:
+    """在 with 區塊內設定目前請求的上下文，離開時還原。"""
+    ctx = RequestContext(
+        user_id=str(user_id),
+        line_user_id=line_user_id,
+        deadline=time.monotonic() + timeout if timeout else None,
+        **({"request_id": request_id} if request_id else {}),
+    )
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
+
+
+def submit(executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+    """與 executor.submit 相同，但讓背景執行緒看得到目前的請求上下文。"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class RequestContextFilter(logging.Filter):
+    """把目前請求的 user_id / request_id 放進 log record（ctx_tag、user_id、request_id）；由 log_config 掛上。"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        ctx = _current.get()
+        record.user_id = ctx.user_id if ctx else "-"
+        record.request_id = ctx.request_id if ctx else "-"
+        record.ctx_tag = f"[user={ctx.user_id} req={ctx.request_id}] " if ctx else ""
+        return True
+
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# file: llm_app/speculative.py
+"""
+推測式回覆生成：在 guardrail 判斷的同時先開始產生陪伴回覆。
+
+SpeculativeCompletion 以串流方式呼叫 chat completions，每收到一個片段就檢查是否
+已被取消；取消後會關閉串流，不再為後續 token 付費。guardrail 判定 OK 時直接取用
+結果，判定 BLOCK 時取消並改走婉拒流程。
+
+可傳入 tools（例如 alert_case_manager）讓模型決定是否需要工具；模型要求呼叫工具時
+推測生成即停止（result() 拋出 SpeculationNeedsTools），由呼叫端改走完整的工具流程，
+推測階段本身不執行任何工具。
+"""
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional
+
+from . import metrics, request_context
+from .openai_client import record_usage
+
+
+class SpeculationCancelled(Exception):
+    """推測生成在完成前被取消。"""
+
+
+class SpeculationNeedsTools(Exception):
+    """模型要求呼叫工具，推測結果不可直接採用。"""
+
+
+class SpeculativeCompletion:
+    def __init__(
+        self,
+        executor: Executor,
+        client,
+        build_messages: Callable[[], List[Dict[str, str]]],
+        **create_kwargs,
+    ):
+        self._client = client
+        self._build_messages = build_messages
+        self._create_kwargs = create_kwargs
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._wasted_recorded = False
+        self._needs_tools = False
+        self._streamed_chunks = 0
+        self._parts: List[str] = []
+        self._error: Optional[BaseException] = None
+        self.completion_tokens = 0
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        metrics.incr("speculative.started")
+        request_context.submit(executor, self._run)
+
+    def _run(self) -> None:
+        try:
+            messages = self._build_messages()
+            if self._cancelled.is_set():
+                return
+            requested_at = time.perf_counter()
+            stream = self._client.chat.completions.create(
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **self._create_kwargs,
+            )
+            try:
+                for chunk in stream:
+                    if self._cancelled.is_set():
+                        break
+                    if getattr(chunk, "usage", None):
+                        self.completion_tokens = chunk.usage.completion_tokens or 0
+                        record_usage(
+                            chunk.usage,
+                            label="speculative",
+                            latency_ms=(time.perf_counter() - requested_at) * 1000,
+                        )
+                    for choice in chunk.choices or []:
+                        if getattr(choice.delta, "tool_calls", None):
+                            self._needs_tools = True
+                        delta = getattr(choice.delta, "content", None)
+                        if delta:
+                            self._parts.append(delta)
+                            self._streamed_chunks += 1
+                    if self._needs_tools:
+                        break
+            finally:
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+        except BaseException as e:
+            self._error = e
+        finally:
+            self.finished_at = time.perf_counter()
+            with self._lock:
+                self._done.set()
+                wasted = self._cancelled.is_set() or self._needs_tools
+            if wasted:
+                self._record_wasted()
+
+    def _record_wasted(self) -> None:
+        """被捨棄的生成只記錄一次；串流中途停止時拿不到 usage，以已收到的片段數估計。"""
+        with self._lock:
+            if self._wasted_recorded:
+                return
+            self._wasted_recorded = True
+        metrics.incr("speculative.wasted_tokens", self.completion_tokens or self._streamed_chunks)
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._cancelled.set()
+            done = self._done.is_set()
+        metrics.incr("speculative.cancelled")
+        # 已生成完畢才取消（guardrail 比生成慢）時，_run 不會再記錄，這裡補記
+        if done:
+            self._record_wasted()
+
+    def result(self, timeout: Optional[float] = None, guard_done_at: Optional[float] = None) -> str:
+        """
+        等待並回傳生成的文字。guard_done_at 為 guardrail 完成的時間點（perf_counter），
+        用來估算與 guardrail 重疊而省下的延遲。
+        """
+        if not self._done.wait(timeout):
+            self.cancel()
+            raise TimeoutError("推測生成逾時")
+        if self._cancelled.is_set():
+            raise SpeculationCancelled()
+        if self._needs_tools:
+            metrics.incr("speculative.needs_tools")
+            raise SpeculationNeedsTools()
+        if self._error is not None:
+            metrics.incr("speculative.failed")
+            raise self._error
+        metrics.incr("speculative.committed")
+        metrics.incr("speculative.committed_tokens", self.completion_tokens)
+        if guard_done_at is not None:
+            overlap = min(guard_done_at, self.finished_at) - self.started_at
+            metrics.incr("speculative.latency_saved_ms", max(0.0, overlap) * 1000)
+        return "".join(self._parts).strip()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding 快取，由 embedding.to_vector 透明使用。
+
+同一則使用者訊息在記憶檢索、Milvus 衛教查詢與 fallback 中都會被 embed，
+這裡分三層避免重複呼叫 API：
+1. 回合內暫存：存在 RequestContext.memo，同一回合（含背景執行緒）只 embed 一次；
+   同時有兩個執行緒要同一段文字時，後到者等待先到者的結果
+2. 行程內 LRU（TTLCache）
+3. Redis：key 為 emb:{model}:{dims}:{sha256(text)}，值為 float32 bytes，
+   命中時以 GETEX 延長 TTL（滑動過期），長期不用的向量自然淘汰
+"""
+import hashlib
+import logging
+import os
+import threading
+from array import array
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence
+
+from .. import metrics, request_context
+from .lru_cache import TTLCache
+from .redis_store import get_redis_binary
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 30 * 86400))
+EMBEDDING_CACHE_L1_SIZE = int(os.getenv("EMBEDDING_CACHE_L1_SIZE", 4096))
+EMBEDDING_CACHE_L1_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_L1_TTL_SECONDS", 3600))
+
+_l1 = TTLCache(EMBEDDING_CACHE_L1_SIZE, EMBEDDING_CACHE_L1_TTL_SECONDS, name="embedding.l1")
+_memo_lock = threading.Lock()
+
+
+def cache_key(model: str, dims: int, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"emb:{model}:{dims}:{digest}"
+
+
+def _pack(vec: Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(raw: bytes) -> List[float]:
+    arr = array("f")
+    arr.frombytes(raw)
+    return arr.tolist()
+
+
+def _read_persistent(keys: List[str]) -> Dict[str, List[float]]:
+    found: Dict[str, List[float]] = {}
+    for key in keys:
+        vec = _l1.get(key)
+        if vec is not None:
+            found[key] = vec
+            metrics.incr("embedding.l1_hit")
+    missing = [k for k in keys if k not in found]
+    if not missing:
+        return found
+    try:
+        r = get_redis_binary()
+        with r.pipeline(transaction=False) as p:
+            for key in missing:
+                p.getex(key, ex=EMBEDDING_CACHE_TTL_SECONDS)
+            raws = p.execute()
+    except Exception as e:
+        logger.warning("Redis 讀取失敗: %s", e)
+        return found
+    for key, raw in zip(missing, raws):
+        if raw:
+            vec = _unpack(raw)
+            found[key] = vec
+            _l1.set(key, vec)
+            metrics.incr("embedding.redis_hit")
+    return found
+
+
+def _write_persistent(items: Dict[str, List[float]]) -> None:
+    for key, vec in items.items():
+        _l1.set(key, vec)
+    try:
+        r = get_redis_binary()
+        with r.pipeline(transaction=False) as p:
+            for key, vec in items.items():
+                p.set(key, _pack(vec), ex=EMBEDDING_CACHE_TTL_SECONDS)
+            p.execute()
+    except Exception as e:
+        logger.warning("Redis 寫入失敗: %s", e)
+
+
+def _embed_uncached(
+    texts: List[str], keys: List[str], embed: Callable[[List[str]], List[List[float]]]
+) -> Dict[str, List[float]]:
+    found = _read_persistent(keys)
+    todo = [(t, k) for t, k in zip(texts, keys) if k not in found]
+    if todo:
+        vectors = embed([t for t, _ in todo])
+        metrics.incr("embedding.api_calls")
+        metrics.incr("embedding.miss", len(todo))
+        fresh = {k: v for (_, k), v in zip(todo, vectors)}
+        _write_persistent(fresh)
+        found.update(fresh)
+    return found
+
+
+def get_or_embed(
+    texts: List[str],
+    model: str,
+    dims: int,
+    embed: Callable[[List[str]], List[List[float]]],
+) -> List[List[float]]:
+    """依序回傳 texts 的向量；只有三層快取都沒有的文字才交給 embed（一次批次呼叫）。"""
+    if not EMBEDDING_CACHE_ENABLED:
+        return embed(texts)
+    keys = [cache_key(model, dims, t) for t in texts]
+    ctx = request_context.current()
+    if ctx is None:
+        found = _embed_uncached(list(dict.fromkeys(texts)), list(dict.fromkeys(keys)), embed)
+        return [found[k] for k in keys]
+
+    # 回合內暫存：memo 內存放 Future，讓同一回合中同時要求同一段文字的執行緒共用結果
+    owned: Dict[str, Future] = {}
+    waiting: Dict[str, Future] = {}
+    with _memo_lock:
+        for key in keys:
+            if key in owned or key in waiting:
+                continue
+            fut: Optional[Future] = ctx.memo.get(key)
+            if fut is None:
+                fut = Future()
+                ctx.memo[key] = fut
+                owned[key] = fut
+            else:
+                waiting[key] = fut
+    metrics.incr("embedding.memo_hit", len(waiting))
+
+    if owned:
+        text_by_key = dict(zip(keys, texts))
+        owned_keys = list(owned)
+        try:
+            found = _embed_uncached([text_by_key[k] for k in owned_keys], owned_keys, embed)
+        except BaseException as e:
+            with _memo_lock:
+                for key, fut in owned.items():
+                    ctx.memo.pop(key, None)
+                    fut.set_exception(e)
+            raise
+        for key, fut in owned.items():
+            fut.set_result(found[key])
+
+    results = {k: f.result() for k, f in {**waiting, **owned}.items()}
+    return [results[k] for k in keys]
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+LLM guardrail 之前的本地預篩（純 CPU）。
+
+- 詞庫比對：以 Aho-Corasick 自動機一次掃描華語/台語風險詞庫
+- 線性分類器：字元 1~2-gram 的 logistic regression（權重由 GUARD_PREFILTER_WEIGHTS 指定）
+
+只回答明確的情況，其餘（verdict 為 None）交給 LLM guardrail：
+- 詢問自傷/自殺的方法 → BLOCK 並通報個管師
+- 表達輕生念頭（「我不想活了」）→ OK（讓陪伴回覆接住情緒）並通報個管師
+- 胸痛、呼吸困難等緊急症狀 → OK（讓陪伴回覆提醒就醫）並通報個管師
+- 同時出現用藥等需要判斷的詞時，照樣通報，但判定仍交給 LLM guardrail
+- 否定（「我沒有胸痛」「我不想自殺」）或轉述（「新聞說有人跳樓」）的風險詞
+  不通報，交給 LLM guardrail
+- 沒有任何風險詞、且命中安全短句或分類器高度確信安全 → OK
+
+通報原因引用使用者的原文（而非正規化後的簡體字）。
+
+GUARD_PREFILTER：none | rules（詞庫 + 安全短句）| classifier（再加上分類器）
+| <module>:<factory>（自訂實作，需提供 check(text) -> Optional[PrefilterResult]）
+"""
+import importlib
+import json
+import logging
+import math
+import os
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .. import metrics
+from .guardrail_cache import _t2s, normalize_text
+
+logger = logging.getLogger(__name__)
+
+GUARD_PREFILTER = os.getenv("GUARD_PREFILTER", "none").strip()
+GUARD_PREFILTER_WEIGHTS = os.getenv("GUARD_PREFILTER_WEIGHTS", "")
+# 分類器判定風險機率低於此值才直接放行
+GUARD_PREFILTER_OK_THRESHOLD = float(os.getenv("GUARD_PREFILTER_OK_THRESHOLD", 0.05))
+
+# 決定判定的詞類：詢問自傷方法 → BLOCK，輕生念頭與緊急症狀 → OK + 通報
+SELF_HARM = "self_harm"
+SELF_HARM_METHOD = "self_harm_method"
+MEDICAL_EMERGENCY = "medical_emergency"
+# 預篩只通報、判定仍交給 LLM guardrail 時的 category
+NEEDS_REVIEW = "needs_review"
+# 預篩已通報時記在 RequestContext.memo，讓 alert_case_manager 不重複通報
+PREFILTER_ALERT_MEMO_KEY = "guard_prefilter.alert_xid"
+
+# 僅代表「需要 LLM 判斷」的詞類，出現時不可直接放行
+_AMBIGUOUS_CATEGORIES = ("medication", "illegal", "violence", "sexual")
+
+RISK_LEXICONS: Dict[str, Tuple[str, ...]] = {
+    SELF_HARM: (
+        # 「熱到想死」「累甲欲死」這類口語誇飾太常見，不列入
+        "不想活", "活不下去", "活著沒意思", "自殺", "輕生", "尋死", "了結生命",
+        "結束生命", "跳樓", "割腕", "燒炭", "上吊", "一了百了",
+        # 台語
+        "毋想活", "袂想活", "活甲無意思", "去死死咧",
+    ),
+    SELF_HARM_METHOD: (
+        "自殺方法", "自殺的方法", "怎麼自殺", "如何自殺", "怎麼死", "怎樣死", "死法",
+        "幾顆會死", "多少會死", "才會死", "死得比較快", "哪裡買炭", "去哪買炭",
+        # 台語
+        "按怎死", "欲按怎死",
+    ),
+    MEDICAL_EMERGENCY: (
+        "胸痛", "胸口痛", "胸口很痛", "心臟痛", "喘不過氣", "喘不過來", "呼吸困難",
+        "吸不到氣", "不能呼吸", "嘴唇發紫", "嘴唇變紫", "咳血", "吐血", "昏倒", "暈倒",
+        "意識不清", "叫不醒",
+        # 台語
+        "胸坎痛", "喘袂過", "敨袂過氣", "吸無氣", "昏去", "心肝頭痛",
+    ),
+    "medication": (
+        "劑量", "幾顆", "幾粒", "多吃", "加藥", "減藥", "停藥", "換藥", "毫克", "吃什麼藥",
+        "吃啥物藥", "藥仔", "類固醇", "安眠藥", "抗生素", "吸入劑", "噴劑", "診斷",
+    ),
+    "illegal": ("毒品", "安非他命", "大麻", "海洛因", "炸彈", "槍", "駭客", "偷", "詐騙"),
+    "violence": ("殺", "打死", "砍", "報復"),
+    "sexual": ("色情", "裸照", "做愛"),
+}
+
+# 與自傷詞同時出現時視為在詢問方法（「怎麼割腕比較不痛」）
+METHOD_CUES: Tuple[str, ...] = ("怎麼", "怎樣", "如何", "方法", "教我", "步驟", "哪裡買", "去哪買", "按怎")
+# 不算詢問方法的慣用語（「不想活了怎麼辦」）
+METHOD_CUE_EXCEPTIONS: Tuple[str, ...] = ("怎麼辦", "怎麼了", "怎樣才好", "如何是好", "按怎才好", "欲按怎")
+
+# 緊貼在風險詞之前（最多隔 NEGATION_GAP 個字）的否定詞：「沒有胸痛」「不是呼吸困難」「不想自殺」
+NEGATION_CUES: Tuple[str, ...] = (
+    "沒有", "沒在", "沒再", "不是", "不會", "不想", "不要", "並非", "未曾", "從沒",
+    # 台語
+    "毋是", "毋", "無",
+)
+NEGATION_GAP = 2
+# 同一子句中出現在風險詞之前，表示在轉述他人或新聞，而非本人狀況
+REPORTED_CUES: Tuple[str, ...] = (
+    "新聞", "報導", "報紙", "電視", "聽說", "據說", "有人", "別人", "網路", "電影", "小說", "他們", "她們",
+)
+
+# 整句正規化後完全相同才放行的安全短句
+SAFE_PHRASES: Tuple[str, ...] = (
+    "早安", "午安", "晚安", "你好", "哈囉", "謝謝", "謝謝你", "多謝", "感恩", "好", "好的",
+    "好啦", "嗯", "嗯嗯", "知道了", "我知道", "再見", "掰掰", "拜拜", "我吃飽了", "吃飽了",
+    "我今天有吃藥", "今天有吃藥", "我有吃藥", "藥吃了", "我今天很好", "今天天氣真好",
+    "我要去睡了", "我去散步", "我散步回來了",
+    # 台語
+    "勢早", "多謝你", "食飽未", "食飽矣", "我食飽矣", "我有食藥仔", "好勢", "真好",
+)
+
+
+@dataclass(frozen=True)
+class PrefilterResult:
+    verdict: Optional[str]  # OK、BLOCK: <原因>，或 None（只通報，判定交給 LLM guardrail）
+    category: str
+    reason: str = ""
+    alert: bool = False
+
+
+@dataclass(frozen=True)
+class _Hit:
+    word: str
+    label: str
+    start: int  # 在正規化文字中的位置
+    end: int
+
+
+@dataclass(frozen=True)
+class _NormalizedText:
+    text: str
+    origin: Tuple[int, ...]  # 每個正規化字元對應的原文位置
+    clause: Tuple[int, ...]  # 每個正規化字元所屬的子句（以標點/空白分隔）
+    raw: str
+
+    def original(self, hit: _Hit) -> str:
+        return self.raw[self.origin[hit.start] : self.origin[hit.end - 1] + 1]
+
+
+def normalize_with_offsets(text: str) -> _NormalizedText:
+    """與 normalize_text 相同的正規化，另外保留原文位置與子句邊界。"""
+    chars: List[str] = []
+    origin: List[int] = []
+    clause: List[int] = []
+    current = 0
+    for i, ch in enumerate(text or ""):
+        for c in unicodedata.normalize("NFKC", ch).lower():
+            if unicodedata.category(c)[0] in "PZC":
+                if chars and clause[-1] == current:
+                    current += 1
+                continue
+            chars.append(c)
+            origin.append(i)
+            clause.append(current)
+    joined = "".join(chars)
+    if joined:
+        converted = _t2s(joined)
+        # 繁簡轉換幾乎都是逐字對應；長度改變時改為逐字轉換以保留位置
+        joined = converted if len(converted) == len(joined) else "".join(_t2s(c)[:1] or c for c in chars)
+    return _NormalizedText(joined, tuple(origin), tuple(clause), text or "")
+
+
+class AhoCorasick:
+    """多樣式字串比對自動機，一次掃描找出所有命中的詞與其類別。"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, str]]] = [[]]
+        for word, label in patterns:
+            if word:
+                self._add(word, label)
+        self._build()
+
+    def _add(self, word: str, label: str) -> None:
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((word, label))
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                # 第一層節點的 fail 一律指回根節點
+                self._fail[nxt] = self._goto[f].get(ch, 0) if node else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def finditer(self, text: str) -> Iterable[Tuple[int, str, str]]:
+        """依序產生 (結束位置, 詞, 類別)；結束位置不含該字元。"""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for word, label in self._out[node]:
+                yield i + 1, word, label
+
+    def findall(self, text: str) -> List[Tuple[str, str]]:
+        return [(word, label) for _, word, label in self.finditer(text)]
+
+
+def char_ngrams(text: str, n_max: int = 2) -> List[str]:
+    return [text[i : i + n] for n in range(1, n_max + 1) for i in range(len(text) - n + 1)]
+
+
+class LinearTextClassifier:
+    """字元 n-gram 的 logistic regression，輸出「需要攔截或關注」的機率。"""
+
+    def __init__(self, weights: Dict[str, float], bias: float = 0.0, n_max: int = 2):
+        self.weights = weights
+        self.bias = bias
+        self.n_max = n_max
+
+    @classmethod
+    def load(cls, path: str) -> "LinearTextClassifier":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["weights"], data.get("bias", 0.0), data.get("n_max", 2))
+
+    def predict_proba(self, normalized_text: str) -> float:
+        z = self.bias + sum(self.weights.get(g, 0.0) for g in char_ngrams(normalized_text, self.n_max))
+        z = max(-30.0, min(30.0, z))
+        return 1.0 / (1.0 + math.exp(-z))
+
+
+class GuardPrefilter:
+    def __init__(self, classifier: Optional[LinearTextClassifier] = None):
+        self.classifier = classifier
+        self._automaton = AhoCorasick(
+            (normalize_text(word), category)
+            for category, words in RISK_LEXICONS.items()
+            for word in words
+        )
+        self._cue_automaton = AhoCorasick(
+            [(normalize_text(w), "method") for w in METHOD_CUES]
+            + [(normalize_text(w), "method_exception") for w in METHOD_CUE_EXCEPTIONS]
+            + [(normalize_text(w), "negation") for w in NEGATION_CUES]
+            + [(normalize_text(w), "reported") for w in REPORTED_CUES]
+        )
+        self._safe_phrases = frozenset(normalize_text(p) for p in SAFE_PHRASES)
+
+    def check(self, text: str) -> Optional[PrefilterResult]:
+        """明確時回傳判定；需要 LLM 判斷時回傳 None，或 verdict 為 None 的通報結果。"""
+        nt = normalize_with_offsets(text)
+        norm = nt.text
+        if not norm:
+            return None
+        hits = [_Hit(w, label, end - len(w), end) for end, w, label in self._automaton.finditer(norm)]
+        cues = [_Hit(w, label, end - len(w), end) for end, w, label in self._cue_automaton.finditer(norm)]
+
+        # 否定或轉述的自傷/緊急字詞不算本人狀況，但也不能直接放行
+        discounted = False
+        acute: List[_Hit] = []
+        decisive = [h for h in hits if h.label in (SELF_HARM, SELF_HARM_METHOD, MEDICAL_EMERGENCY)]
+        for hit in decisive:
+            if self._is_negated(nt, hit, cues) or self._is_reported(nt, hit, cues):
+                discounted = True
+            else:
+                acute.append(hit)
+        labels = {h.label for h in acute}
+        # 「自殺」中的「殺」這類包含在自傷/緊急詞裡的命中不另外計算
+        ambiguous = discounted or any(
+            h.label in _AMBIGUOUS_CATEGORIES and not any(d.start <= h.start and h.end <= d.end for d in decisive)
+            for h in hits
+        )
+
+        if SELF_HARM_METHOD in labels or (SELF_HARM in labels and self._asks_method(cues)):
+            words = self._quote(nt, [h for h in acute if h.label in (SELF_HARM, SELF_HARM_METHOD)])
+            return PrefilterResult("BLOCK: 詢問自傷方法", SELF_HARM_METHOD, f"偵測到詢問自傷方法：{words}", alert=True)
+
+        alerts = []
+        category = None
+        if SELF_HARM in labels:
+            alerts.append(f"偵測到輕生念頭：{self._quote(nt, [h for h in acute if h.label == SELF_HARM])}")
+            category = SELF_HARM
+        if MEDICAL_EMERGENCY in labels:
+            alerts.append(f"偵測到緊急症狀：{self._quote(nt, [h for h in acute if h.label == MEDICAL_EMERGENCY])}")
+            category = category or MEDICAL_EMERGENCY
+        if alerts:
+            reason = "；".join(alerts)
+            if ambiguous:
+                return PrefilterResult(None, NEEDS_REVIEW, reason, alert=True)
+            return PrefilterResult("OK", category, reason, alert=True)
+        if hits or discounted:
+            return None
+
+        if norm in self._safe_phrases:
+            return PrefilterResult("OK", "safe_phrase")
+        if self.classifier is not None:
+            if self.classifier.predict_proba(norm) < GUARD_PREFILTER_OK_THRESHOLD:
+                return PrefilterResult("OK", "classifier")
+        return None
+
+    @staticmethod
+    def _quote(nt: _NormalizedText, hits: List[_Hit]) -> str:
+        seen: Dict[str, None] = {}
+        for hit in hits:
+            seen.setdefault(nt.original(hit), None)
+        return "、".join(seen)
+
+    @staticmethod
+    def _is_negated(nt: _NormalizedText, hit: _Hit, cues: List[_Hit]) -> bool:
+        return any(
+            c.label == "negation"
+            and c.end <= hit.start
+            and hit.start - c.end <= NEGATION_GAP
+            and nt.clause[c.start] == nt.clause[hit.start]
+            for c in cues
+        )
+
+    @staticmethod
+    def _is_reported(nt: _NormalizedText, hit: _Hit, cues: List[_Hit]) -> bool:
+        return any(
+            c.label == "reported" and c.end <= hit.start and nt.clause[c.start] == nt.clause[hit.start]
+            for c in cues
+        )
+
+    @staticmethod
+    def _asks_method(cues: List[_Hit]) -> bool:
+        exceptions = [c for c in cues if c.label == "method_exception"]
+        return any(
+            c.label == "method" and not any(e.start <= c.start and c.end <= e.end for e in exceptions)
+            for c in cues
+        )
+
+
+def load_prefilter(spec: str = GUARD_PREFILTER):
+    """依 GUARD_PREFILTER 建立預篩器；none 時回傳 None。"""
+    spec = (spec or "none").strip()
+    if spec.lower() == "none":
+        return None
+    if spec.lower() == "rules":
+        return GuardPrefilter()
+    if spec.lower() == "classifier":
+        if not GUARD_PREFILTER_WEIGHTS:
+            raise ValueError("GUARD_PREFILTER=classifier 需要設定 GUARD_PREFILTER_WEIGHTS")
+        return GuardPrefilter(LinearTextClassifier.load(GUARD_PREFILTER_WEIGHTS))
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"未知的 GUARD_PREFILTER: {spec}")
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+def run_prefilter(prefilter, text: str) -> Optional[PrefilterResult]:
+    """執行預篩並記錄命中情形；預篩本身出錯時交給 LLM guardrail。"""
+    if prefilter is None:
+        return None
+    try:
+        result = prefilter.check(text)
+    except Exception as e:
+        logger.warning("預篩失敗，改用 LLM guardrail: %s", e)
+        return None
+    if result is None or result.verdict is None:
+        metrics.incr("guard_prefilter.ambiguous")
+    else:
+        metrics.incr("guard_prefilter.decided")
+    if result is not None:
+        metrics.incr(f"guard_prefilter.{result.category}")
+    return result
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Guardrail 判定快取。
+
+長輩常重複傳送「早安」「謝謝」「我今天有吃藥」這類短句，同樣的內容不需要每次都
+呼叫 LLM 審查。以正規化後文字的 hash 為 key，先查行程內 L1，再查 Redis。
+
+正規化：NFKC、轉小寫、移除空白/標點/控制字元，並把繁體折疊為簡體，
+使「早安！」「早 安」「早安。」共用同一筆判定。
+"""
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+from typing import Optional
+
+from .. import metrics
+from .lru_cache import TTLCache
+from .redis_store import get_redis
+
+logger = logging.getLogger(__name__)
+
+GUARD_CACHE_ENABLED = os.getenv("GUARD_CACHE_ENABLED", "true").lower() == "true"
+GUARD_CACHE_TTL_SECONDS = int(os.getenv("GUARD_CACHE_TTL_SECONDS", 7 * 86400))
+GUARD_CACHE_L1_SIZE = int(os.getenv("GUARD_CACHE_L1_SIZE", 2048))
+GUARD_CACHE_L1_TTL_SECONDS = int(os.getenv("GUARD_CACHE_L1_TTL_SECONDS", 3600))
+# 長文重複機率低，不寫入快取以免佔用空間
+GUARD_CACHE_MAX_CHARS = int(os.getenv("GUARD_CACHE_MAX_CHARS", 200))
+# 審查規則（ModelGuardrailTool 的 prompt）變動時遞增，讓舊判定自然失效
+GUARD_CACHE_VERSION = os.getenv("GUARD_CACHE_VERSION", "v1")
+
+_l1 = TTLCache(GUARD_CACHE_L1_SIZE, GUARD_CACHE_L1_TTL_SECONDS, name="guard_cache.l1")
+
+_converter = None
+_converter_lock = threading.Lock()
+
+
+def _t2s(text: str) -> str:
+    global _converter
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                from opencc import OpenCC
+
+                _converter = OpenCC("t2s.json")
+    return _converter.convert(text)
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    # P*: 標點、Z*: 空白、C*: 控制字元
+    text = "".join(ch for ch in text if unicodedata.category(ch)[0] not in "PZC")
+    return _t2s(text) if text else text
+
+
+def cache_key(text: str) -> Optional[str]:
+    norm = normalize_text(text)
+    if not norm or len(norm) > GUARD_CACHE_MAX_CHARS:
+        return None
+    digest = hashlib.sha1(norm.encode("utf-8")).hexdigest()
+    return f"guard:{GUARD_CACHE_VERSION}:{digest}"
+
+
+def get_verdict(text: str) -> Optional[str]:
+    """命中時回傳 OK 或 BLOCK: <原因>；未命中回傳 None。"""
+    if not GUARD_CACHE_ENABLED:
+        return None
+    key = cache_key(text)
+    if key is None:
+        return None
+
+    verdict = _l1.get(key)
+    if verdict is not None:
+        metrics.incr("guard_cache.hit")
+        metrics.incr("guard_cache.l1_hit")
+        return verdict
+
+    try:
+        verdict = get_redis().get(key)
+    except Exception as e:
+        logger.warning("Redis 讀取失敗: %s", e)
+        verdict = None
+    if verdict is None:
+        metrics.incr("guard_cache.miss")
+        return None
+    metrics.incr("guard_cache.hit")
+    _l1.set(key, verdict)
+    return verdict
+
+
+def put_verdict(text: str, verdict: str) -> None:
+    """只應寫入 LLM 成功回傳的判定；審查失敗時的預設放行不可快取。"""
+    if not GUARD_CACHE_ENABLED or not verdict:
+        return
+    key = cache_key(text)
+    if key is None:
+        return
+    _l1.set(key, verdict)
+    try:
+        get_redis().set(key, verdict, ex=GUARD_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("Redis 寫入失敗: %s", e)
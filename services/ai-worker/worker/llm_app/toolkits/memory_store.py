@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 # file: toolkits/memory_store.py
 import hashlib
+import logging
 import math
 import os
 import time
@@ -21,7 +22,12 @@ except Exception as e:
         "需要 pymilvus，請先安裝並連上 Milvus：pip install pymilvus"
     ) from e
 
-EMBED_DIM = int(os.getenv("EMBED_DIM", 1536))  # text-embedding-3-small = 1536
+from ..embedding_backends import check_collection_dim, get_embedding_backend
+
+logger = logging.getLogger(__name__)
+
+# 與目前的 embedding backend 一致（openai 1536 維、本機模型 384 維）
+EMBED_DIM = get_embedding_backend().dims
 MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
 COLL = os.getenv("MEMORY_COLLECTION", "user_memory_v2")
 
@@ -46,22 +52,9 @@ def ensure_memory_collection():
     _connect()
     if utility.has_collection(COLL):
         c = Collection(COLL)
-        # P1-7: 若 collection 已存在，回讀 dim，矯正 EMBED_DIM
-        try:
-            schema = c.schema
-            for field in schema.fields:
-                if (
-                    field.name == "embedding"
-                    and hasattr(field, "params")
-                    and "dim" in field.params
-                ):
-                    global EMBED_DIM
-                    actual_dim = field.params["dim"]
-                    if actual_dim != EMBED_DIM:
-                        print(f"⚠️ 矯正 EMBED_DIM: {EMBED_DIM} → {actual_dim}")
-                        EMBED_DIM = actual_dim
-        except Exception as e:
-            print(f"[dim correction error] {e}")
+        # P1-7: 若 collection 已存在，檢查 dim 是否與目前的 embedding backend 一致；
+        # 不一致時寫入/檢索都會失敗，需先執行 migrate_embeddings 重建向量
+        check_collection_dim(c)
 
         # 只在需要時才 load
         if not _collection_loaded:
@@ -230,10 +223,10 @@ def retrieve_memory_pack(
         output_fields=["pk"],  # 只取 pk
     )
     hits = [h for h in res[0] if float(getattr(h, "distance", 0.0)) >= sim_thr]
-    print(f"🔍 記憶檢索結果: 共找到 {len(res[0])} 筆候選，{len(hits)} 筆超過門檻 {sim_thr}")
-    if res[0]:
-        similarities = [f'{float(getattr(h, "distance", 0.0)):.3f}' for h in res[0][:3]]
-        print(f"📊 相似度分佈: {similarities}")
+    logger.debug("記憶檢索結果: 共找到 %s 筆候選，%s 筆超過門檻 %s", len(res[0]), len(hits), sim_thr)
+    if res[0] and logger.isEnabledFor(logging.DEBUG):
+        similarities = [round(float(getattr(h, "distance", 0.0)), 3) for h in res[0][:3]]
+        logger.debug("相似度分佈", extra={"similarities": similarities})
     if not hits:
         return ""
 
@@ -274,9 +267,7 @@ def retrieve_memory_pack(
                     new_times_seen = int(e.get("times_seen", 1)) + 1
                     original_embedding = e.get("embedding")
                     if original_embedding is None:
-                        print(
-                            f"[warning] missing embedding for pk={pk}, skipping update"
-                        )
+                        logger.warning("missing embedding for pk=%s, skipping update", pk)
                         continue
                     row_data = {
                         "pk": pk,
@@ -299,7 +290,7 @@ def retrieve_memory_pack(
                 # c.upsert 接受 list of dictionaries 作為輸入
                 c.upsert(rows_to_update)
         except Exception as ex:
-            print(f"[memory usage update error] {ex}")
+            logger.warning("記憶使用次數更新失敗: %s", ex)
 
     lines = [f'- {x["row"].get("text")} ' for x in picked]
     return "⭐ 個人長期記憶：\n" + "\n".join(lines) if lines else ""
@@ -310,7 +301,7 @@ def get_recent_memories(user_id: str, topk: int = 5, days_limit: int = 7) -> str
     【新函式】專為主動關懷設計。
     不進行語意搜尋，而是直接獲取指定天數內、最新的 topk 筆記憶。
     """
-    print(f"🔍 正在為 user_id={user_id} 檢索最近 {days_limit} 天內的記憶...")
+    logger.debug("正在為 user_id=%s 檢索最近 %s 天內的記憶", user_id, days_limit)
     c = ensure_memory_collection()
     
     # 1. 計算時間範圍
@@ -332,7 +323,7 @@ def get_recent_memories(user_id: str, topk: int = 5, days_limit: int = 7) -> str
         )
         
         if not results:
-            print(f"❌ 用戶 {user_id} 在最近 {days_limit} 天內沒有可檢索的記憶。")
+            logger.info("用戶 %s 在最近 %s 天內沒有可檢索的記憶。", user_id, days_limit)
             return ""
             
         # 4. 在 Python 端進行排序，並選取 topk
@@ -347,9 +338,9 @@ def get_recent_memories(user_id: str, topk: int = 5, days_limit: int = 7) -> str
         lines.reverse() 
         
         formatted_string = "\n".join(lines)
-        print(f"🧠 為用戶 {user_id} 檢索到 {len(top_results)} 筆近期記憶。")
+        logger.info("為用戶 %s 檢索到 %s 筆近期記憶。", user_id, len(top_results))
         return formatted_string
         
     except Exception as e:
-        print(f"[get_recent_memories error] 檢索近期記憶時發生錯誤: {e}")
+        logger.exception("檢索近期記憶時發生錯誤: %s", e)
         return ""
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+使用者畫像（chat_user_profiles 的三個 JSONB 欄位）的 read-through 快取。
+
+每回合組 prompt 都要讀 Profile，但 Profile 只在 session 結束時由 Profiler 更新，
+因此幾乎每次讀取都能命中快取，不必開 SQLAlchemy session 查 Postgres。
+
+- L1：行程內 TTLCache，TTL 短（預設 30 秒），本行程的失效會直接清掉
+- Redis：profile:v1:{user_id} 存 JSON，內含寫入時的世代號 gen；
+  profile:gen:{user_id} 為目前世代，update_profile_facts / 建立 Profile 時 INCR，
+  兩個 key 以一次 MGET 讀出，gen 不符的舊資料視為未命中。
+  讀 DB 前先取得 gen，若讀取期間剛好被更新，寫回的資料 gen 已過期，不會蓋掉新值
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from .. import metrics
+from .lru_cache import TTLCache
+from .redis_store import get_redis
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_ENABLED = os.getenv("PROFILE_CACHE_ENABLED", "true").lower() == "true"
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", 86400))
+PROFILE_CACHE_L1_SIZE = int(os.getenv("PROFILE_CACHE_L1_SIZE", 1024))
+PROFILE_CACHE_L1_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_L1_TTL_SECONDS", 30))
+# 快取內容的格式變動時遞增
+PROFILE_CACHE_VERSION = "v1"
+
+_l1 = TTLCache(PROFILE_CACHE_L1_SIZE, PROFILE_CACHE_L1_TTL_SECONDS, name="profile_cache.l1")
+
+
+def _entry_key(user_id) -> str:
+    return f"profile:{PROFILE_CACHE_VERSION}:{user_id}"
+
+
+def _gen_key(user_id) -> str:
+    return f"profile:gen:{user_id}"
+
+
+def lookup(user_id) -> Tuple[Optional[Dict[str, Any]], int]:
+    """回傳 (profile dict 或 None, 目前世代)；未命中時呼叫端讀 DB 後以同一個世代呼叫 store()。"""
+    if not PROFILE_CACHE_ENABLED:
+        return None, 0
+    uid = str(user_id)
+    cached = _l1.get(uid)
+    if cached is not None:
+        metrics.incr("profile_cache.hit")
+        metrics.incr("profile_cache.l1_hit")
+        metrics.incr("profile_cache.db_saved")
+        return cached, -1
+
+    try:
+        raw, gen = get_redis().mget(_entry_key(uid), _gen_key(uid))
+    except Exception as e:
+        logger.warning("Redis 讀取失敗: %s", e)
+        metrics.incr("profile_cache.miss")
+        return None, -1
+    gen = int(gen or 0)
+    if raw:
+        try:
+            entry = json.loads(raw)
+        except ValueError:
+            entry = None
+        if entry and entry.get("gen") == gen:
+            profile = entry.get("profile") or {}
+            _l1.set(uid, profile)
+            metrics.incr("profile_cache.hit")
+            metrics.incr("profile_cache.db_saved")
+            return profile, gen
+    metrics.incr("profile_cache.miss")
+    return None, gen
+
+
+def store(user_id, profile: Dict[str, Any], gen: int) -> None:
+    """寫回 DB 讀到的 Profile；gen < 0 表示讀取世代失敗，只放 L1 不寫 Redis。"""
+    if not PROFILE_CACHE_ENABLED:
+        return
+    uid = str(user_id)
+    _l1.set(uid, profile)
+    if gen < 0:
+        return
+    try:
+        payload = json.dumps({"gen": gen, "profile": profile}, ensure_ascii=False)
+        get_redis().set(_entry_key(uid), payload, ex=PROFILE_CACHE_TTL_SECONDS)
+    except Exception as e:
+        logger.warning("Redis 寫入失敗: %s", e)
+
+
+def invalidate(user_id) -> None:
+    """Profile 被更新或建立後呼叫：遞增世代並刪除舊資料。"""
+    uid = str(user_id)
+    _l1.pop(uid)
+    try:
+        with get_redis().pipeline() as p:
+            p.incr(_gen_key(uid))
+            p.delete(_entry_key(uid))
+            p.execute()
+        metrics.incr("profile_cache.invalidated")
+    except Exception as e:
+        logger.warning("失效處理失敗: %s", e)
+
+
+def stats() -> Dict[str, float]:
+    """命中率與省下的 DB 查詢次數。"""
+    return {
+        "hit_ratio": metrics.hit_ratio("profile_cache"),
+        "db_saved": metrics.get("profile_cache.db_saved"),
+        "l1_hit": metrics.get("profile_cache.l1_hit"),
+    }
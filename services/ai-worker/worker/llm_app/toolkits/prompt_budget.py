@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+以 token 為單位分配 prompt 上下文的預算。
+
+build_prompt_from_redis 以往用字元數控長度，中文字與英數的 token 成本差很多，
+prompt 大小難以預估；逐輪丟棄對話時還每次重新 render 整段字串。
+
+這裡把每個區塊（使用者畫像、長期記憶、歷史摘要、近期對話）拆成可獨立丟棄的項目，
+每個項目只計算一次 token（tokenizer 與計數結果都有快取），依優先順序在單次走訪中
+填入總預算；放不下的項目整個略過，單一項目過長時才以 token 截斷。
+"""
+import logging
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from .. import metrics
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 2400))
+PROFILE_MAX_TOKENS = int(os.getenv("PROFILE_MAX_TOKENS", 600))
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", 600))
+STM_MAX_TOKENS = int(os.getenv("STM_MAX_TOKENS", 1200))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", 1500))
+# 剩餘預算少於此值時不再截斷硬塞，避免只放進半句話
+MIN_SECTION_TOKENS = int(os.getenv("MIN_SECTION_TOKENS", 48))
+
+_SECTION_SEP = "\n\n"
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    model = os.getenv("MODEL_NAME", "gpt-4o-mini")
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # 首次使用需下載 BPE 檔（可用 TIKTOKEN_CACHE_DIR 預先放好）；失敗時改用估計值
+        logger.warning("無法載入 tokenizer，改以字元數估計: %s", e)
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """文字的 token 數；同一段文字（例如每回合都會帶入的 Profile、摘要）只計算一次。"""
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is None:
+        # 沒有 tiktoken 時以字元數估計（中文約一字一 token，偏保守）
+        return len(text)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, keep: str = "head") -> str:
+    """截到 max_tokens 以內；keep="tail" 時保留結尾（最新的內容）。"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    enc = _encoding()
+    if enc is None:
+        return text[-max_tokens:] if keep == "tail" else text[:max_tokens]
+    tokens = enc.encode(text, disallowed_special=())
+    kept = tokens[-max_tokens:] if keep == "tail" else tokens[:max_tokens]
+    # 切在多位元組字元中間時去掉殘缺的字
+    return enc.decode(kept, errors="ignore")
+
+
+@dataclass
+class Section:
+    """
+    key：區塊名稱（metrics 與 debug 用）；header：標題行。
+    items：可整項丟棄的單位（對話回合、摘要段落、記憶條目），依時間 / 排名順序排列。
+    keep：預算不足時保留 "head"（排名在前）或 "tail"（最新）。
+    """
+
+    key: str
+    header: str
+    items: List[str]
+    keep: str = "head"
+    max_tokens: Optional[int] = None
+    joiner: str = "\n"
+    chosen: List[str] = field(default_factory=list, init=False)
+    tokens: int = field(default=0, init=False)
+
+    def render(self) -> str:
+        return self.header + "\n" + self.joiner.join(self.chosen) if self.chosen else ""
+
+
+def _fill(section: Section, limit: int) -> None:
+    sep_tokens = count_tokens(section.joiner)
+    used = count_tokens(section.header) + 1
+    if used >= limit:
+        return
+    order = reversed(section.items) if section.keep == "tail" else iter(section.items)
+    chosen: List[str] = []
+    for item in order:
+        if not item:
+            continue
+        cost = count_tokens(item) + (sep_tokens if chosen else 0)
+        if used + cost <= limit:
+            chosen.append(item)
+            used += cost
+            continue
+        # 放不下：若還沒有任何內容且剩餘夠多，截斷這一項；否則停在這裡，保持時間 / 排名連續
+        room = limit - used - (sep_tokens if chosen else 0)
+        if not chosen and room >= MIN_SECTION_TOKENS:
+            chosen.append(truncate_tokens(item, room, keep=section.keep))
+            used += room
+        break
+    if section.keep == "tail":
+        chosen.reverse()
+    section.chosen = chosen
+    section.tokens = used if chosen else 0
+
+
+def allocate(sections: List[Section], budget: int = PROMPT_TOKEN_BUDGET, order: Optional[List[str]] = None) -> str:
+    """
+    sections 依優先順序排列，單次走訪把總預算分給各區塊（每區塊另受 max_tokens 限制）；
+    回傳依 order（區塊 key 的顯示順序，預設同優先順序）串接的 prompt。
+    """
+    sep_tokens = count_tokens(_SECTION_SEP)
+    remaining = budget
+    for section in sections:
+        limit = remaining if section.max_tokens is None else min(remaining, section.max_tokens)
+        _fill(section, limit)
+        if section.chosen:
+            remaining = max(0, remaining - section.tokens - sep_tokens)
+        dropped = len([i for i in section.items if i]) - len(section.chosen)
+        if dropped > 0:
+            metrics.incr(f"prompt_budget.{section.key}.dropped_items", dropped)
+        metrics.incr(f"prompt_budget.{section.key}.tokens", section.tokens)
+    metrics.incr("prompt_budget.builds")
+    metrics.incr("prompt_budget.used_tokens", budget - remaining)
+
+    by_key: Dict[str, Section] = {s.key: s for s in sections}
+    keys = order or [s.key for s in sections]
+    return _SECTION_SEP.join(r for r in (by_key[k].render() for k in keys if k in by_key) if r)
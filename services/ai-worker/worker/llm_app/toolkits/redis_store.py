@@ -1,28 +1,56 @@
 # -*- coding: utf-8 -*-
 import hashlib
 import json
+import logging
 import os
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import redis
+from .. import metrics, request_context
 from ..repositories.profile_repository import ProfileRepository
 
+try:
+    import msgpack
+except ImportError:  # 沒有 msgpack 時退回精簡 JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
 REDIS_TTL_SECONDS = int(os.getenv("REDIS_TTL_SECONDS", 86400))
 ALERT_STREAM_KEY = os.getenv("ALERT_STREAM_KEY", "alerts:stream")
 ALERT_STREAM_GROUP = os.getenv("ALERT_STREAM_GROUP", "case_mgr")
+# 近似上限（XADD MAXLEN ~），0 表示不修剪；web-app 的 case_mgr 消費者會確認並處理
+ALERT_STREAM_MAXLEN = int(os.getenv("ALERT_STREAM_MAXLEN", 10000))
 
 SESSION_TIMEOUT_SECONDS = 300
+# user_id → 最後活躍時間（秒）的排序集合；排程任務只需讀分數過期的那一段，不必 SCAN 整個 keyspace
+SESSION_INDEX_KEY = "session:index"
+SESSION_INDEX_MIGRATED_KEY = "session:index:migrated"
+# 每次排程最多認領的過期 Session 數；認領後分數推到 now + lease，finalize 失敗時 lease 到期會重試
+SESSION_EXPIRE_BATCH = int(os.getenv("SESSION_EXPIRE_BATCH", 200))
+SESSION_CLAIM_LEASE_SECONDS = int(os.getenv("SESSION_CLAIM_LEASE_SECONDS", 600))
+# 已摘要的回合超過此數量才歸檔並自 history 修剪；修剪後保留最近 HISTORY_KEEP_SUMMARIZED 筆
+HISTORY_COMPACTION = os.getenv("HISTORY_COMPACTION", "true").lower() == "true"
+HISTORY_COMPACT_MIN_ROUNDS = int(os.getenv("HISTORY_COMPACT_MIN_ROUNDS", 20))
+HISTORY_KEEP_SUMMARIZED = int(os.getenv("HISTORY_KEEP_SUMMARIZED", 0))
 
 def start_or_refresh_session(user_id: str, line_user_id: str = None) -> None:
     """
     啟動一個新 Session 或刷新既有 Session 的過期時間。
     只有在 Session 是新啟動時，才會更新資料庫的 last_contact_ts。
     """
+    # 呼叫端沒帶 line_user_id 時，沿用同一位使用者目前請求上下文中的值
+    ctx = request_context.current()
+    if not line_user_id and ctx and ctx.user_id == str(user_id):
+        line_user_id = ctx.line_user_id
+
     r = get_redis()
     active_key = f"session:active:{user_id}"
-    last_active_key = f"session:last_active:{user_id}"
 
     # 檢查是否為新 Session
     is_new_session = not r.exists(active_key)
@@ -32,26 +60,38 @@ def start_or_refresh_session(user_id: str, line_user_id: str = None) -> None:
         # 1. 設置或刷新活躍標記，TTL 為 5 分鐘
         pipe.set(active_key, "1", ex=SESSION_TIMEOUT_SECONDS)
         
-        # 2. 更新最後活躍時間戳 (永不過期，供排程任務掃描)
-        pipe.set(last_active_key, int(time.time()))
+        # 2. 更新 Session 索引中的最後活躍時間 (永不過期，供排程任務找出過期 Session)
+        pipe.zadd(SESSION_INDEX_KEY, {str(user_id): int(time.time())})
         
         pipe.execute()
 
     # 如果是新 Session，才更新 Profile 的最後聯繫時間
     if is_new_session:
-        try:
-            repo = ProfileRepository()
-            # 【新增】只有在 line_user_id 有效時才傳遞，避免用 None 覆蓋舊值
-            if line_user_id:
-                repo.touch_last_contact_ts(int(user_id), line_user_id=line_user_id)
-            else:
-                repo.touch_last_contact_ts(int(user_id))
-            print(f"✨ New session for user {user_id}. 'last_contact_ts' updated.")
-        except (ValueError, TypeError):
-            # 如果 user_id 不是一個有效的數字字串，則跳過對資料庫的操作，避免崩潰。
-            print(f"⚠️ [Session Start] user_id '{user_id}' 不是有效的整數，已跳過 Profile 時間戳更新。")
+        _schedule_contact_touch(user_id, line_user_id)
     
-    print(f"🔄 Session for user {user_id} has been {'started' if is_new_session else 'refreshed'}.")
+    logger.debug("Session for user %s has been %s.", user_id, "started" if is_new_session else "refreshed")
+
+
+# 新 Session 的 last_contact_ts 寫入 Postgres 不在回覆路徑上等待
+_touch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="contact-touch")
+
+
+def _touch_last_contact(user_id: str, line_user_id: Optional[str]) -> None:
+    try:
+        repo = ProfileRepository()
+        # 【新增】只有在 line_user_id 有效時才傳遞，避免用 None 覆蓋舊值
+        if line_user_id:
+            repo.touch_last_contact_ts(int(user_id), line_user_id=line_user_id)
+        else:
+            repo.touch_last_contact_ts(int(user_id))
+        logger.info("New session for user %s. 'last_contact_ts' updated.", user_id)
+    except (ValueError, TypeError):
+        # 如果 user_id 不是一個有效的數字字串，則跳過對資料庫的操作，避免崩潰。
+        logger.warning("[Session Start] user_id %r 不是有效的整數，已跳過 Profile 時間戳更新。", user_id)
+
+
+def _schedule_contact_touch(user_id: str, line_user_id: Optional[str]) -> None:
+    request_context.submit(_touch_executor, _touch_last_contact, user_id, line_user_id)
 
 
 def is_session_active(user_id: str) -> bool:
@@ -60,38 +100,95 @@ def is_session_active(user_id: str) -> bool:
     return bool(r.exists(f"session:active:{user_id}"))
 
 
+def migrate_session_index(r: Optional[redis.Redis] = None) -> int:
+    """
+    一次性遷移：把舊版的 session:last_active:{user_id} 併入 session:index 後刪除。
+    以 SESSION_INDEX_MIGRATED_KEY 標記完成，多個行程同時啟動時只有一個會執行 SCAN。
+    """
+    r = r or get_redis()
+    if not r.set(SESSION_INDEX_MIGRATED_KEY, int(time.time()), nx=True):
+        return 0
+    moved = 0
+    try:
+        for batch in _scan_batches(r, "session:last_active:*"):
+            values = r.mget(batch)
+            scores = {}
+            for key, value in zip(batch, values):
+                if value is not None:
+                    scores[key.split(":")[-1]] = int(value)
+            with r.pipeline(transaction=False) as p:
+                if scores:
+                    # GT：索引裡已有較新的活躍時間時不覆蓋
+                    p.zadd(SESSION_INDEX_KEY, scores, gt=True)
+                p.delete(*batch)
+                p.execute()
+            moved += len(scores)
+    except Exception:
+        # 失敗時清掉標記，下次排程重試
+        r.delete(SESSION_INDEX_MIGRATED_KEY)
+        raise
+    if moved:
+        logger.info("已將 %s 筆 session:last_active 併入 %s", moved, SESSION_INDEX_KEY)
+    return moved
+
+
+def _scan_batches(r: redis.Redis, pattern: str, count: int = 500):
+    batch = []
+    for key in r.scan_iter(match=pattern, count=count):
+        batch.append(key)
+        if len(batch) >= count:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# 認領分數 <= 截止時間、且 active key 已消失的 Session；認領後分數改為 lease 到期時間，
+# 避免多個排程同時 finalize 同一位使用者。仍活躍（剛好又有新訊息）的只略過不改。
+# KEYS: session:index；ARGV: cutoff, limit, lease_until
+_CLAIM_EXPIRED_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local claimed = {}
+for _, uid in ipairs(ids) do
+    if redis.call('EXISTS', 'session:active:' .. uid) == 0 then
+        redis.call('ZADD', KEYS[1], ARGV[3], uid)
+        table.insert(claimed, uid)
+    end
+end
+return claimed
+"""
+_claim_expired_script = None
+_session_index_ready = False
+
+
 def get_expired_sessions(timeout_seconds: int = SESSION_TIMEOUT_SECONDS) -> List[str]:
     """
-    掃描所有使用者的最後活躍時間，找出已過期的 Session。
-    這是給排程任務使用的。
+    從 session:index 取出閒置超過 timeout_seconds 的使用者。
+    這是給排程任務使用的；成本與過期數量成正比，與總 key 數無關。
     """
+    global _claim_expired_script, _session_index_ready
     r = get_redis()
-    # 使用 SCAN 避免在大量用戶時阻塞 Redis
-    cursor = '0'
-    expired_users = []
+    if not _session_index_ready:
+        migrate_session_index(r)
+        _session_index_ready = True
+    if _claim_expired_script is None:
+        _claim_expired_script = r.register_script(_CLAIM_EXPIRED_LUA)
+
     now = int(time.time())
-    
-    while cursor != 0:
-        cursor, keys = r.scan(cursor=cursor, match="session:last_active:*", count=100)
-        if not keys:
-            continue
-        
-        last_active_times = r.mget(keys)
-        for i, key in enumerate(keys):
-            last_active_time = last_active_times[i]
-            if last_active_time and (now - int(last_active_time) > timeout_seconds):
-                # 檢查 active key 是否也真的消失了，雙重確認
-                user_id = key.split(':')[-1]
-                if not is_session_active(user_id):
-                    expired_users.append(user_id)
-    return expired_users
+    return list(
+        _claim_expired_script(
+            keys=[SESSION_INDEX_KEY],
+            args=[now - timeout_seconds, SESSION_EXPIRE_BATCH, now + SESSION_CLAIM_LEASE_SECONDS],
+            client=r,
+        )
+    )
 
 def cleanup_session_keys(user_id: str) -> None:
     """在 finalize_session 後，清除所有 session 相關的 key"""
     r = get_redis()
     keys_to_delete = [
         f"session:active:{user_id}",
-        f"session:last_active:{user_id}",
+        f"session:last_active:{user_id}",  # 舊版索引，遷移前建立的 Session 可能還留著
     ]
     # 連同原有的 purge_user_session 一起刪除
     original_keys = [
@@ -101,9 +198,15 @@ def cleanup_session_keys(user_id: str) -> None:
         f"session:{user_id}:alerts",
         f"session:{user_id}:state",
     ]
-    all_keys = keys_to_delete + original_keys
-    r.delete(*all_keys)
-    print(f"🧹 All session keys for user {user_id} have been cleaned up.")
+    archived = int(r.get(_offset_key(user_id)) or 0)
+    all_keys = keys_to_delete + original_keys + [_offset_key(user_id)]
+    with r.pipeline() as p:
+        p.delete(*all_keys)
+        p.zrem(SESSION_INDEX_KEY, str(user_id))
+        p.execute()
+    if archived:
+        _archive_repo().delete_rounds(user_id)
+    logger.info("All session keys for user %s have been cleaned up.", user_id)
 
 
 @lru_cache(maxsize=1)
@@ -112,6 +215,13 @@ def get_redis() -> redis.Redis:
     return redis.Redis.from_url(url, decode_responses=True)
 
 
+@lru_cache(maxsize=1)
+def get_redis_binary() -> redis.Redis:
+    """不做 decode 的連線，用於存放二進位資料（例如 float32 向量）。"""
+    url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    return redis.Redis.from_url(url, decode_responses=False)
+
+
 def _touch_ttl(keys: List[str]) -> None:
     if not keys:
         return
@@ -142,36 +252,183 @@ def make_request_id(user_id: str, text: str, now_ms: Optional[int] = None) -> st
     return hashlib.sha1(f"{user_id}|{text}|{bucket}".encode()).hexdigest()
 
 
-def append_round(user_id: str, round_obj: Dict, line_user_id: str = None) -> None:
+# ---- history 編碼 ----
+# 回合以 msgpack 加短欄位名存放；舊資料（JSON 字串）仍可讀，判斷依據是首位元組 "{"
+_SHORT_FIELDS = {"input": "i", "output": "o", "rid": "r"}
+_LONG_FIELDS = {v: k for k, v in _SHORT_FIELDS.items()}
+
+
+def _encode_round(round_obj: Dict) -> bytes:
+    short = {_SHORT_FIELDS.get(k, k): v for k, v in round_obj.items()}
+    if msgpack is not None:
+        return msgpack.packb(short, use_bin_type=True)
+    return json.dumps(short, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _decode_round(raw) -> Dict:
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    if raw[:1] == b"{":
+        obj = json.loads(raw)
+    else:
+        obj = msgpack.unpackb(raw, raw=False)
+    return {_LONG_FIELDS.get(k, k): v for k, v in obj.items()}
+
+
+def _history_key(user_id: str) -> str:
+    return f"session:{user_id}:history"
+
+
+def _offset_key(user_id: str) -> str:
+    """已歸檔並自 history 頭部修剪掉的回合數；邏輯序號 = 實體索引 + offset。"""
+    return f"session:{user_id}:history:offset"
+
+
+def _archive_repo():
+    # 延遲匯入：只有歸檔 / 讀取歸檔時才需要資料庫
+    from ..repositories.chat_archive_repository import ChatArchiveRepository
+    return ChatArchiveRepository()
+
+
+# 一次呼叫完成：請求去重、寫入回合、刷新 Session（active 標記 + 索引）、延長 history TTL，
+# 並回傳是否為新 Session 與尚未摘要的回合數；EXISTS 與 SET 之間不再有競態
+# 帶鎖寫入時先檢查 fencing token：鎖已被其他 worker 重新取得就拒絕寫入（回傳 -1）
+# KEYS: processed 去重 key, history, session:active, session:index, summary:rounds, history:offset, 鎖的 fence key
+# ARGV: 編碼後的回合, user_id, 現在時間（秒）, 去重 / history TTL（秒）, Session 逾時（秒）, fence（0 表示不檢查）
+_APPEND_ROUND_LUA = """
+if ARGV[6] ~= '0' and redis.call('GET', KEYS[7]) ~= ARGV[6] then
+    return {-1, 0, 0}
+end
+local ttl = tonumber(ARGV[4])
+if not redis.call('SET', KEYS[1], '1', 'NX', 'EX', ttl) then
+    return {0, 0, 0}
+end
+local total = redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ttl)
+local is_new = 1 - redis.call('EXISTS', KEYS[3])
+redis.call('SET', KEYS[3], '1', 'EX', tonumber(ARGV[5]))
+redis.call('ZADD', KEYS[4], tonumber(ARGV[3]), ARGV[2])
+local cursor = tonumber(redis.call('GET', KEYS[5]) or '0')
+local offset = tonumber(redis.call('GET', KEYS[6]) or '0')
+return {1, is_new, math.max(0, total + offset - cursor)}
+"""
+_append_round_script = None
+_append_round_lua_ok = True
+
+
+def append_round(
+    user_id: str,
+    round_obj: Dict,
+    line_user_id: str = None,
+    request_id: Optional[str] = None,
+    lock: Optional["RedisLock"] = None,
+) -> Tuple[bool, int]:
+    """
+    寫入一個對話回合並刷新 Session；帶 request_id 時同一請求只會寫入一次。
+    帶 lock 時以其 fencing token 確認鎖仍屬於自己，否則不寫入。
+    回傳 (是否寫入, 尚未摘要的回合數)。新 Session 的 last_contact_ts 改在背景更新。
+    """
+    global _append_round_script, _append_round_lua_ok
+    ctx = request_context.current()
+    if not line_user_id and ctx and ctx.user_id == str(user_id):
+        line_user_id = ctx.line_user_id
+
     r = get_redis()
-    key = f"session:{user_id}:history"
-    r.rpush(key, json.dumps(round_obj, ensure_ascii=False))
-    # [取代] 原本的 ensure_active_state 和 _touch_ttl
+    payload = _encode_round(round_obj)
+    rid = request_id or round_obj.get("rid") or make_request_id(user_id, round_obj.get("input", ""))
+    if _append_round_lua_ok:
+        try:
+            if _append_round_script is None:
+                _append_round_script = r.register_script(_APPEND_ROUND_LUA)
+            appended, is_new, pending = _append_round_script(
+                keys=[
+                    f"processed:{user_id}:{rid}",
+                    _history_key(user_id),
+                    f"session:active:{user_id}",
+                    SESSION_INDEX_KEY,
+                    f"session:{user_id}:summary:rounds",
+                    _offset_key(user_id),
+                    lock.fence_key if lock else _offset_key(user_id),
+                ],
+                args=[
+                    payload,
+                    str(user_id),
+                    int(time.time()),
+                    REDIS_TTL_SECONDS,
+                    SESSION_TIMEOUT_SECONDS,
+                    lock.fence if lock else 0,
+                ],
+                client=r,
+            )
+            if appended == -1:
+                metrics.incr("lock.fenced_writes")
+                logger.warning("鎖 %s 已被其他 worker 取得，略過寫入回合", lock.name)
+                return False, 0
+            if is_new:
+                _schedule_contact_touch(user_id, line_user_id)
+            return bool(appended), int(pending)
+        except redis.ResponseError as e:
+            logger.warning("Lua 寫入回合不可用，改用多次呼叫: %s", e)
+            _append_round_lua_ok = False
+
+    if lock is not None and not lock.still_valid():
+        metrics.incr("lock.fenced_writes")
+        return False, 0
+    if not try_register_request(user_id, rid):
+        return False, 0
+    r.rpush(_history_key(user_id), payload)
     start_or_refresh_session(user_id, line_user_id=line_user_id)
+    return True, unsummarized_count(user_id)
 
 # 【新增】主動關懷專用函式
 def append_proactive_round(user_id: str, round_obj: Dict) -> None:
     """專門用於寫入主動關懷訊息，但不重置閒置計時器。"""
-    r = get_redis()
-    key = f"session:{user_id}:history"
-    r.rpush(key, json.dumps(round_obj, ensure_ascii=False))
+    get_redis().rpush(_history_key(user_id), _encode_round(round_obj))
+
+
+def _cursor_and_offset(r: redis.Redis, user_id: str) -> Tuple[int, int, int]:
+    """(摘要游標, 修剪 offset, history 實體長度)，三者在同一個 MULTI 內讀取。"""
+    with r.pipeline(transaction=True) as p:
+        p.get(f"session:{user_id}:summary:rounds")
+        p.get(_offset_key(user_id))
+        p.llen(_history_key(user_id))
+        cursor, offset, total = p.execute()
+    return int(cursor or 0), int(offset or 0), int(total)
 
 
 def history_len(user_id: str) -> int:
-    return get_redis().llen(f"session:{user_id}:history")
+    """整個 session 的回合數（含已歸檔修剪的部分）。"""
+    _, offset, total = _cursor_and_offset(get_redis_binary(), user_id)
+    return offset + total
 
 
 def fetch_unsummarized_tail(user_id: str, k: int = 6) -> List[Dict]:
-    r = get_redis()
-    cursor = int(r.get(f"session:{user_id}:summary:rounds") or 0)
-    items = r.lrange(f"session:{user_id}:history", cursor, -1)
-    return [json.loads(x) for x in items[-k:]]
+    r = get_redis_binary()
+    cursor, offset, _ = _cursor_and_offset(r, user_id)
+    items = r.lrange(_history_key(user_id), max(0, cursor - offset), -1)
+    return [_decode_round(x) for x in items[-k:]]
+
+
+def iter_all_history(user_id: str) -> Iterator[Dict]:
+    """依序產出整個 session 的回合：先從歸檔逐批讀，再讀 Redis 中尚未修剪的部分。"""
+    r = get_redis_binary()
+    # 先讀 Redis 再讀歸檔：讀取期間若剛好修剪，被修剪的回合已先寫入歸檔
+    with r.pipeline(transaction=True) as p:
+        p.get(_offset_key(user_id))
+        p.lrange(_history_key(user_id), 0, -1)
+        offset, items = p.execute()
+    offset = int(offset or 0)
+    if offset:
+        for i, payload in enumerate(_archive_repo().iter_rounds(user_id)):
+            if i >= offset:
+                break
+            yield payload
+    for x in items:
+        yield _decode_round(x)
 
 
 def fetch_all_history(user_id: str) -> List[Dict]:
-    r = get_redis()
-    items = r.lrange(f"session:{user_id}:history", 0, -1)
-    return [json.loads(x) for x in items]
+    return list(iter_all_history(user_id))
 
 
 def get_summary(user_id: str) -> Tuple[str, int]:
@@ -181,24 +438,100 @@ def get_summary(user_id: str) -> Tuple[str, int]:
     return text, rounds
 
 
+# 一次取回摘要、游標與最近 k 個未摘要回合；只讀需要的 LRANGE 範圍。
+# 游標是邏輯序號，history 頭部已修剪 offset 筆，實體索引要扣掉 offset
+# KEYS: summary:text, summary:rounds, history, history:offset；ARGV: k
+_SNAPSHOT_LUA = """
+local text = redis.call('GET', KEYS[1]) or ''
+local cursor = tonumber(redis.call('GET', KEYS[2]) or '0')
+local offset = tonumber(redis.call('GET', KEYS[4]) or '0')
+local total = redis.call('LLEN', KEYS[3])
+local k = tonumber(ARGV[1])
+local start = math.max(cursor - offset, total - k, 0)
+local items = {}
+if start < total then
+    items = redis.call('LRANGE', KEYS[3], start, total - 1)
+end
+return {text, cursor, items}
+"""
+_snapshot_script = None
+_snapshot_lua_ok = True
+
+
+def _snapshot_keys(user_id: str) -> List[str]:
+    return [
+        f"session:{user_id}:summary:text",
+        f"session:{user_id}:summary:rounds",
+        _history_key(user_id),
+        _offset_key(user_id),
+    ]
+
+
+def _snapshot_pipelined(r: redis.Redis, user_id: str, k: int) -> Tuple[str, int, List[bytes]]:
+    """無法執行 Lua 時的替代：MULTI 內讀最後 k 筆，再丟掉游標之前（已摘要）的部分。"""
+    tkey, ckey, hkey, okey = _snapshot_keys(user_id)
+    with r.pipeline(transaction=True) as p:
+        p.get(tkey)
+        p.get(ckey)
+        p.get(okey)
+        p.llen(hkey)
+        p.lrange(hkey, -k, -1)
+        text, cursor, offset, total, items = p.execute()
+    cursor = int(cursor or 0)
+    first_index = int(offset or 0) + total - len(items)
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    return text or "", cursor, items[max(0, cursor - first_index):]
+
+
+def get_session_snapshot(user_id: str, k: int = 6) -> Tuple[str, int, List[Dict]]:
+    """
+    一次來回取得 (摘要文字, 摘要游標, 最近 k 個未摘要回合)，
+    等同 get_summary + fetch_unsummarized_tail，但不讀整段未摘要歷史。
+    游標為邏輯序號，不受 history 修剪影響。
+    """
+    global _snapshot_script, _snapshot_lua_ok
+    # history 為二進位編碼，用不做 decode 的連線
+    r = get_redis_binary()
+    k = max(1, int(k))
+    if _snapshot_lua_ok:
+        try:
+            if _snapshot_script is None:
+                _snapshot_script = r.register_script(_SNAPSHOT_LUA)
+            text, cursor, items = _snapshot_script(keys=_snapshot_keys(user_id), args=[k], client=r)
+            return (text or b"").decode("utf-8"), int(cursor), [_decode_round(x) for x in items]
+        except redis.ResponseError as e:
+            # 例如託管 Redis 停用了 EVAL：改用 pipeline，之後不再嘗試 Lua
+            logger.warning("Lua 快照不可用，改用 pipeline: %s", e)
+            _snapshot_lua_ok = False
+    text, cursor, items = _snapshot_pipelined(r, user_id, k)
+    return text, cursor, [_decode_round(x) for x in items]
+
+
+def unsummarized_count(user_id: str) -> int:
+    """尚未被摘要的回合數（邏輯 history 長度 - 摘要游標）。"""
+    cursor, offset, total = _cursor_and_offset(get_redis(), user_id)
+    return max(0, offset + total - cursor)
+
+
 def peek_next_n(user_id: str, n: int) -> Tuple[Optional[int], List[Dict]]:
-    r = get_redis()
-    cursor = int(r.get(f"session:{user_id}:summary:rounds") or 0)
-    total = r.llen(f"session:{user_id}:history")
-    if (total - cursor) < n:
+    r = get_redis_binary()
+    cursor, offset, total = _cursor_and_offset(r, user_id)
+    start = max(0, cursor - offset)
+    if (total - start) < n:
         return None, []
-    items = r.lrange(f"session:{user_id}:history", cursor, cursor + n - 1)
-    return cursor, [json.loads(x) for x in items]
+    items = r.lrange(_history_key(user_id), start, start + n - 1)
+    return cursor, [_decode_round(x) for x in items]
 
 
 def peek_remaining(user_id: str) -> Tuple[int, List[Dict]]:
-    r = get_redis()
-    cursor = int(r.get(f"session:{user_id}:summary:rounds") or 0)
-    total = r.llen(f"session:{user_id}:history")
-    if total <= cursor:
+    r = get_redis_binary()
+    cursor, offset, total = _cursor_and_offset(r, user_id)
+    start = max(0, cursor - offset)
+    if total <= start:
         return cursor, []
-    items = r.lrange(f"session:{user_id}:history", cursor, total - 1)
-    return cursor, [json.loads(x) for x in items]
+    items = r.lrange(_history_key(user_id), start, total - 1)
+    return cursor, [_decode_round(x) for x in items]
 
 
 def commit_summary_chunk(user_id: str, expected_cursor: int, advance: int, add_text: str) -> bool:
@@ -225,24 +558,79 @@ def commit_summary_chunk(user_id: str, expected_cursor: int, advance: int, add_t
                 return False
 
 
+# 僅在 offset 仍是讀取時的值才修剪，避免兩個行程重複修剪
+# KEYS: history, history:offset；ARGV: 預期 offset, 修剪筆數
+_TRIM_HISTORY_LUA = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('LTRIM', KEYS[1], tonumber(ARGV[2]), -1)
+redis.call('INCRBY', KEYS[2], tonumber(ARGV[2]))
+return 1
+"""
+_trim_history_script = None
+
+
+def compact_history(user_id: str) -> int:
+    """
+    把已摘要（游標之前）的回合寫入 Postgres 歸檔後自 history 頭部 LTRIM，回傳修剪筆數。
+    游標與其他讀取都以邏輯序號計算，修剪後不需調整 summary:rounds。
+    """
+    global _trim_history_script
+    if not HISTORY_COMPACTION:
+        return 0
+    r = get_redis_binary()
+    cursor, offset, _ = _cursor_and_offset(r, user_id)
+    trim = cursor - offset - HISTORY_KEEP_SUMMARIZED
+    if trim < HISTORY_COMPACT_MIN_ROUNDS:
+        return 0
+    rounds = [_decode_round(x) for x in r.lrange(_history_key(user_id), 0, trim - 1)]
+    if len(rounds) < trim:
+        return 0
+    # 先歸檔再修剪；以 (user_id, round_index) 去重，重試或並行歸檔都不會重複
+    _archive_repo().archive_rounds(user_id, offset, rounds)
+    if _trim_history_script is None:
+        _trim_history_script = r.register_script(_TRIM_HISTORY_LUA)
+    if not _trim_history_script(keys=[_history_key(user_id), _offset_key(user_id)], args=[offset, trim], client=r):
+        return 0
+    _touch_ttl([_offset_key(user_id)])
+    logger.info("已歸檔並修剪 %s 筆已摘要回合（offset %s → %s）", trim, offset, offset + trim)
+    return trim
+
+
+_alert_group_ready = False
+
+
 def ensure_alert_group() -> None:
+    """建立通報的消費者群組；每個行程只需成功一次（啟動時呼叫）。"""
+    global _alert_group_ready
+    if _alert_group_ready:
+        return
     r = get_redis()
     try:
         r.xgroup_create(name=ALERT_STREAM_KEY, groupname=ALERT_STREAM_GROUP, id='$', mkstream=True)
     except redis.ResponseError as e:
         if 'BUSYGROUP' not in str(e):
             raise
+    _alert_group_ready = True
 
 
 def xadd_alert(user_id: str, reason: str, severity: str = "info", extra: Optional[Dict] = None) -> str:
+    # 群組須在第一則通報之前存在，否則以 id='$' 建立時會漏掉這則
     ensure_alert_group()
     r = get_redis()
     fields = {"user_id": user_id, "reason": reason, "severity": severity, "ts": str(int(time.time() * 1000))}
     if extra:
         fields["extra"] = json.dumps(extra, ensure_ascii=False)
-    xid = r.xadd(ALERT_STREAM_KEY, fields)
-    r.rpush(f"session:{user_id}:alerts", json.dumps(fields, ensure_ascii=False))
-    _touch_ttl([f"session:{user_id}:alerts"])
+    request_id = request_context.current_request_id()
+    if request_id:
+        fields["request_id"] = request_id
+    alerts_key = f"session:{user_id}:alerts"
+    with r.pipeline(transaction=False) as p:
+        p.xadd(ALERT_STREAM_KEY, fields, maxlen=ALERT_STREAM_MAXLEN or None, approximate=True)
+        p.rpush(alerts_key, json.dumps(fields, ensure_ascii=False))
+        p.pexpire(alerts_key, REDIS_TTL_SECONDS * 1000)
+        xid = p.execute()[0]
     return xid
 
 
@@ -318,30 +706,160 @@ def get_audio_result(user_id: str, audio_id: str) -> Optional[str]:
     return get_redis().get(f"audio:{user_id}:{audio_id}:result")
 
 
-def set_audio_result(user_id: str, audio_id: str, reply: str, ttl_sec: int = 86400) -> None:
-    get_redis().set(f"audio:{user_id}:{audio_id}:result", reply, ex=ttl_sec)
+# 只有 fencing token 仍是最新（鎖沒有被其他 worker 重新取得）時才寫入
+# KEYS: result key, fence key；ARGV: reply, ttl, fence
+_FENCED_SET_LUA = """
+if redis.call('GET', KEYS[2]) ~= ARGV[3] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+return 1
+"""
+_fenced_set_script = None
+
+
+def set_audio_result(
+    user_id: str, audio_id: str, reply: str, ttl_sec: int = 86400, lock: Optional["RedisLock"] = None
+) -> bool:
+    """寫入音檔的處理結果；帶 lock 時只有鎖仍屬於自己才寫入，回傳是否寫入。"""
+    global _fenced_set_script
+    r = get_redis()
+    key = f"audio:{user_id}:{audio_id}:result"
+    if lock is None:
+        r.set(key, reply, ex=ttl_sec)
+        return True
+    if _fenced_set_script is None:
+        _fenced_set_script = r.register_script(_FENCED_SET_LUA)
+    if _fenced_set_script(keys=[key, lock.fence_key], args=[reply, ttl_sec, lock.fence], client=r):
+        return True
+    metrics.incr("lock.fenced_writes")
+    logger.warning("鎖 %s 已被其他 worker 取得，略過寫入音檔結果", lock.name)
+    return False
+
+
+# ---- 分散式鎖：owner token + compare-and-delete + 自動續租 + fencing token ----
+# 取得鎖時遞增 fence 計數並回傳；之後的寫入以 fence 是否仍等於計數判斷鎖是否被他人接手
+# KEYS: lock key, fence key；ARGV: token, 鎖 ttl(ms), fence 計數 ttl(ms)
+_LOCK_ACQUIRE_LUA = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', tonumber(ARGV[2])) then
+    return 0
+end
+local fence = redis.call('INCR', KEYS[2])
+redis.call('PEXPIRE', KEYS[2], tonumber(ARGV[3]))
+return fence
+"""
+# KEYS: lock key；ARGV: token, ttl(ms)
+_LOCK_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+# KEYS: lock key；ARGV: token
+_LOCK_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+_lock_scripts: Dict[str, object] = {}
+# fence 計數保留的時間需遠長於鎖 TTL，否則過期後重新從 1 起算會讓舊持有者的 fence 再度有效
+LOCK_FENCE_TTL_SECONDS = int(os.getenv("LOCK_FENCE_TTL_SECONDS", 86400))
+
+
+def _lock_script(name: str, body: str):
+    script = _lock_scripts.get(name)
+    if script is None:
+        script = _lock_scripts[name] = get_redis().register_script(body)
+    return script
+
+
+class RedisLock:
+    """
+    以 owner token 取得的 Redis 鎖：只有持有者能釋放（compare-and-delete），
+    工作進行中背景執行緒每 ttl/3 續租一次；取得時配發遞增的 fencing token，
+    寫入結果時（set_audio_result / append_round）以 token 確認鎖沒有在中途被他人接手。
+    """
+
+    def __init__(self, name: str, ttl_sec: int = 60, renew: bool = True):
+        self.name = name
+        self.key = f"lock:{name}"
+        self.fence_key = f"lock:{name}:fence"
+        self.ttl_ms = int(ttl_sec * 1000)
+        self.renew = renew
+        self.token = uuid.uuid4().hex
+        self.fence = 0
+        self._stop = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+        self.lost = False
+
+    def acquire(self) -> bool:
+        try:
+            fence = _lock_script("acquire", _LOCK_ACQUIRE_LUA)(
+                keys=[self.key, self.fence_key],
+                args=[self.token, self.ttl_ms, LOCK_FENCE_TTL_SECONDS * 1000],
+            )
+        except redis.RedisError as e:
+            logger.warning("取得鎖 %s 失敗: %s", self.name, e)
+            return False
+        if not fence:
+            return False
+        self.fence = int(fence)
+        if self.renew:
+            self._renewer = threading.Thread(target=self._renew_loop, name=f"lock-renew-{self.name}", daemon=True)
+            self._renewer.start()
+        return True
+
+    def _renew_loop(self) -> None:
+        interval = self.ttl_ms / 3000
+        while not self._stop.wait(interval):
+            try:
+                ok = _lock_script("renew", _LOCK_RENEW_LUA)(keys=[self.key], args=[self.token, self.ttl_ms])
+            except redis.RedisError as e:
+                # 暫時連不上 Redis：下一輪再試，鎖仍可能在 TTL 內
+                logger.warning("續租鎖 %s 失敗: %s", self.name, e)
+                continue
+            if not ok:
+                self.lost = True
+                metrics.incr("lock.lost")
+                logger.warning("鎖 %s 已過期或被他人取得，停止續租", self.name)
+                return
+            metrics.incr("lock.renewed")
+
+    def still_valid(self) -> bool:
+        """fence 仍是最新的（沒有其他 worker 在之後取得過這把鎖）。"""
+        try:
+            return get_redis().get(self.fence_key) == str(self.fence)
+        except redis.RedisError:
+            return False
+
+    def release(self) -> bool:
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join(timeout=1)
+        try:
+            return bool(_lock_script("release", _LOCK_RELEASE_LUA)(keys=[self.key], args=[self.token]))
+        except redis.RedisError as e:
+            logger.warning("釋放鎖 %s 失敗: %s", self.name, e)
+            return False
+
+    def __enter__(self) -> "RedisLock":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
 
 
 # ---- Lightweight audio locks (separate from session state) ----
-def acquire_audio_lock(lock_id: str, ttl_sec: int = 60) -> bool:
-    """Try acquire a short-lived lock; return True on success.
+def acquire_audio_lock(lock_id: str, ttl_sec: int = 60) -> Optional[RedisLock]:
+    """Try acquire the audio lock; return the held RedisLock (auto-renewing), or None.
 
     Use a dedicated key independent from session state to avoid interference.
     """
-    r = get_redis()
-    key = f"lock:audio:{lock_id}"
-    try:
-        # SET NX with expiration
-        return bool(r.set(key, "1", nx=True, ex=ttl_sec))
-    except Exception:
-        return False
+    lock = RedisLock(f"audio:{lock_id}", ttl_sec=ttl_sec)
+    return lock if lock.acquire() else None
 
 
-def release_audio_lock(lock_id: str) -> None:
-    r = get_redis()
-    key = f"lock:audio:{lock_id}"
-    try:
-        r.delete(key)
-    except Exception:
-        pass
-
+def release_audio_lock(lock: Optional[RedisLock]) -> None:
+    if lock is not None:
+        lock.release()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+背景摘要佇列：把分段摘要移出回覆的關鍵路徑。
+
+log_session 只負責排程；背景執行緒依使用者合併待摘要的回合：同一位使用者在
+佇列中最多只有一個工作，執行期間又累積的新回合會在完成後再排一次。
+每次工作取 floor(未摘要回合 / SUMMARY_CHUNK_SIZE) * SUMMARY_CHUNK_SIZE 回合，
+一次 LLM 呼叫摘要完，仍透過 peek_next_n / commit_summary_chunk 的 CAS 游標提交。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Optional
+
+from .. import metrics
+from .redis_store import compact_history, peek_next_n, unsummarized_count
+from .tools import summarize_chunk_and_commit
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", 5))
+# 單次工作最多合併幾回合，避免摘要 prompt 過長
+SUMMARY_MAX_MERGE_ROUNDS = int(os.getenv("SUMMARY_MAX_MERGE_ROUNDS", 20))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", 2))
+
+_QUEUED, _RUNNING, _RUNNING_DIRTY = "queued", "running", "running_dirty"
+
+
+class SummaryQueue:
+    def __init__(self, workers: int = SUMMARY_WORKERS):
+        self.workers = max(1, workers)
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._state: Dict[str, str] = {}
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._cond:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._loop, name=f"summary-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def schedule(self, user_id: str) -> None:
+        """排入該使用者的摘要工作；已在佇列或執行中時合併為同一個工作。"""
+        self._ensure_started()
+        with self._cond:
+            state = self._state.get(user_id)
+            if state == _RUNNING:
+                self._state[user_id] = _RUNNING_DIRTY
+            if state is not None:
+                metrics.incr("summary.coalesced")
+                return
+            self._state[user_id] = _QUEUED
+        metrics.incr("summary.scheduled")
+        self._queue.put(user_id)
+
+    def wait_idle(self, user_id: str, timeout: Optional[float] = None) -> bool:
+        """等待該使用者沒有排隊或執行中的摘要工作（finalize 前呼叫）。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while user_id in self._state:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _loop(self) -> None:
+        while True:
+            user_id = self._queue.get()
+            with self._cond:
+                self._state[user_id] = _RUNNING
+            try:
+                self._summarize(user_id)
+            except Exception as e:
+                metrics.incr("summary.failed")
+                logger.exception("%s 摘要失敗: %s", user_id, e)
+            with self._cond:
+                if self._state.get(user_id) == _RUNNING_DIRTY:
+                    self._state[user_id] = _QUEUED
+                    self._queue.put(user_id)
+                else:
+                    self._state.pop(user_id, None)
+                    self._cond.notify_all()
+
+    def _summarize(self, user_id: str) -> None:
+        pending = unsummarized_count(user_id)
+        rounds = min(pending // SUMMARY_CHUNK_SIZE * SUMMARY_CHUNK_SIZE, SUMMARY_MAX_MERGE_ROUNDS)
+        if rounds <= 0:
+            return
+        start, chunk = peek_next_n(user_id, rounds)
+        if start is None or not chunk:
+            return
+        t0 = time.perf_counter()
+        if summarize_chunk_and_commit(user_id, start_round=start, history_chunk=chunk):
+            metrics.incr("summary.jobs")
+            metrics.incr("summary.merged_rounds", len(chunk))
+            # 已摘要的回合歸檔後自 Redis 修剪；失敗不影響摘要本身，下次提交後再試
+            try:
+                metrics.incr("summary.compacted_rounds", compact_history(user_id))
+            except Exception as e:
+                logger.warning("%s history 歸檔修剪失敗: %s", user_id, e)
+        else:
+            # 游標已被其他流程（例如 finalize）推進，下一次排程會重新讀取
+            metrics.incr("summary.cas_conflict")
+        metrics.observe("summary.job", (time.perf_counter() - t0) * 1000)
+
+
+_summary_queue: Optional[SummaryQueue] = None
+_summary_queue_lock = threading.Lock()
+
+
+def get_summary_queue() -> SummaryQueue:
+    global _summary_queue
+    if _summary_queue is None:
+        with _summary_queue_lock:
+            if _summary_queue is None:
+                _summary_queue = SummaryQueue()
+    return _summary_queue
@@ -1,13 +1,42 @@
+import logging
 import os
 from typing import List
 
 from crewai.tools import BaseTool
-from openai import OpenAI
 from pymilvus import Collection, connections
 
 from ..embedding import to_vector
+from ..embedding_backends import check_collection_dim
+from .. import request_context
+from ..openai_client import get_openai_client, record_usage
+from . import guardrail_cache
+from .guard_prefilter import PREFILTER_ALERT_MEMO_KEY
 from .redis_store import commit_summary_chunk, xadd_alert
 
+logger = logging.getLogger(__name__)
+
+GUARD_TIMEOUT_SEC = float(os.getenv("GUARD_TIMEOUT_SEC", 15))
+
+# guardrail 的 system prompt 固定不變，作為可被 prefix cache 命中的前綴
+_GUARD_SYSTEM_PROMPT = (
+    "你是安全審查器，需精準判斷是否必須攔截。\n"
+    "【允許（回 OK）】以下情況一律放行：\n"
+    "- 症狀敘述或一般健康資訊的詢問（例如：症狀、成因、風險因子、何時就醫的提醒）。\n"
+    "- 一般生活保健/衛教/注意事項等非個案化、非指令性的建議。\n"
+    "【必須攔截（回 BLOCK: <原因>）】符合任一條件：\n"
+    "1) 違法/危險行為的教學、買賣、製作或規避（毒品、武器、暴力、駭客、爆裂物等）。\n"
+    "2) 自傷/他傷/自殺/自殘的指導或鼓勵。\n"
+    "3) 成人性內容或未成年相關不當內容的請求。\n"
+    "4) 醫療/用藥/劑量/診斷/處置等『具體、個案化、可執行』的專業指示或方案。\n"
+    "5) 法律、投資、稅務等高風險領域之『具體、可執行』的專業指導。\n"
+    "【判斷原則】僅在請求明確落入上述攔截條件時才 BLOCK；\n"
+    "若是描述狀況或尋求一般性說明/保健建議，請回 OK。若不確定，預設回 OK。\n"
+    "【輸出格式】只能是：\n"
+    "OK\n"
+    "或\n"
+    "BLOCK: <極簡原因>\n"
+)
+
 _milvus_loaded = False
 _collection = None
 
@@ -28,6 +57,7 @@ class SearchMilvusTool(BaseTool):
                         uri=os.getenv("MILVUS_URI", "http://localhost:19530"),
                     )
                 _collection = Collection("copd_qa")
+                check_collection_dim(_collection)
                 _collection.load()
                 _milvus_loaded = True
             thr = float(os.getenv("SIMILARITY_THRESHOLD", 0.6))
@@ -66,7 +96,7 @@ def summarize_chunk_and_commit(
     )
     prompt = f"請將下列對話做 80-120 字摘要，聚焦：健康問題、情緒、生活要點。\n\n{text}"
     try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        client = get_openai_client()
         res = client.chat.completions.create(
             model=os.getenv("MODEL_NAME", "gpt-4o-mini"),
             messages=[
@@ -75,6 +105,7 @@ def summarize_chunk_and_commit(
             ],
             temperature=0.3,
         )
+        record_usage(res.usage, label="summary")
         body = (res.choices[0].message.content or "").strip()
         header = f"--- 第{start_round + 1}至{start_round + len(history_chunk)}輪對話摘要 ---\n"
         return commit_summary_chunk(
@@ -84,7 +115,7 @@ def summarize_chunk_and_commit(
             add_text=header + body,
         )
     except Exception as e:
-        print(f"[摘要錯誤] {e}")
+        logger.exception("摘要失敗: %s", e)
         return False
 
 
@@ -98,9 +129,12 @@ class AlertCaseManagerTool(BaseTool):
 
     def _run(self, reason: str) -> str:
         try:
-            uid = self.runtime_context.get("user_id") or os.getenv(
-                "CURRENT_USER_ID", "unknown"
-            )
+            ctx = request_context.current()
+            xid = ctx.memo.get(PREFILTER_ALERT_MEMO_KEY) if ctx is not None else None
+            if xid:
+                # 本回合預篩已通報過，不重複送出
+                return f"⚠️ 已通報個管師（事件ID: {xid}），事由：{reason}"
+            uid = request_context.current_user_id()
             xid = xadd_alert(user_id=uid, reason=reason, severity="high")
             return f"⚠️ 已通報個管師（事件ID: {xid}），事由：{reason}"
         except Exception as e:
@@ -114,48 +148,38 @@ class ModelGuardrailTool(BaseTool):
     )
 
     def _run(self, text: str) -> str:
+        # 判定快取由呼叫端（AgentManager.run_guardrail）查詢，這裡只負責 LLM 審查並寫入結果
         try:
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            # guardrail 只輸出極短結果，逾時設短一些，失敗時照常放行
+            client = get_openai_client(timeout=GUARD_TIMEOUT_SEC)
             guard_model = os.getenv(
                 "GUARD_MODEL", os.getenv("MODEL_NAME", "gpt-4o-mini")
             )
-            sys = (
-                "你是安全審查器，需精準判斷是否必須攔截。\n"
-                "【允許（回 OK）】以下情況一律放行：\n"
-                "- 症狀敘述或一般健康資訊的詢問（例如：症狀、成因、風險因子、何時就醫的提醒）。\n"
-                "- 一般生活保健/衛教/注意事項等非個案化、非指令性的建議。\n"
-                "【必須攔截（回 BLOCK: <原因>）】符合任一條件：\n"
-                "1) 違法/危險行為的教學、買賣、製作或規避（毒品、武器、暴力、駭客、爆裂物等）。\n"
-                "2) 自傷/他傷/自殺/自殘的指導或鼓勵。\n"
-                "3) 成人性內容或未成年相關不當內容的請求。\n"
-                "4) 醫療/用藥/劑量/診斷/處置等『具體、個案化、可執行』的專業指示或方案。\n"
-                "5) 法律、投資、稅務等高風險領域之『具體、可執行』的專業指導。\n"
-                "【判斷原則】僅在請求明確落入上述攔截條件時才 BLOCK；\n"
-                "若是描述狀況或尋求一般性說明/保健建議，請回 OK。若不確定，預設回 OK。\n"
-                "【輸出格式】只能是：\n"
-                "OK\n"
-                "或\n"
-                "BLOCK: <極簡原因>\n"
-            )
             user = f"使用者輸入：{text}\n請依規則只輸出 OK 或 BLOCK: <原因>。"
             res = client.chat.completions.create(
                 model=guard_model,
                 messages=[
-                    {"role": "system", "content": sys},
+                    {"role": "system", "content": _GUARD_SYSTEM_PROMPT},
                     {"role": "user", "content": user},
                 ],
                 temperature=0,
                 max_tokens=24,
             )
+            record_usage(res.usage, label="guardrail")
             out = (res.choices[0].message.content or "").strip()
             # 預設寬鬆通過：若非明確 BLOCK，一律視為 OK
             if not out.startswith("BLOCK:"):
-                return "OK"
+                out = "OK"
             # 僅保留精簡 BLOCK 理由
             if len(out) > 256:
                 out = out[:256]
+            try:
+                guardrail_cache.put_verdict(text, out)
+            except Exception as e:
+                # 快取只是加速，寫入失敗不影響判定結果
+                logger.warning("guardrail 判定快取寫入失敗: %s", e)
             return out
         except Exception as e:
             # Guardrail 故障時，不要阻擋主流程
-            print(f"[guardrail_error] {e}")
+            logger.warning("guardrail 呼叫失敗，放行: %s", e)
             return "OK"
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# file: log_config.py
+"""
+AI Worker 的日誌設定：結構化（JSON）輸出、各模組層級、詳細內容取樣、非阻塞寫出。
+
+- LOG_FORMAT=json|text（預設 json），每筆帶上目前請求的 user_id / request_id
+- LOG_LEVEL=INFO 為 root 層級；LOG_LEVELS="llm_app.HealthBot=DEBUG,pika=WARNING" 覆寫個別模組
+- 詳細內容（完整 prompt、任務 payload 等）以 extra={"sample": "<類別>"} 記錄，
+  只有 LOG_SAMPLE_RATES 指定比例的紀錄會輸出，例如 "prompt=0.05,payload=0.1"；
+  未列出的類別使用 LOG_SAMPLE_RATE（預設 0.01）。WARNING 以上不取樣
+- 呼叫端只把 record 放進佇列（QueueHandler），格式化與寫 stdout 由 QueueListener
+  的背景執行緒負責，消費者執行緒不會因 stdout 變慢而被卡住
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from typing import Dict, Optional
+
+from llm_app.request_context import RequestContextFilter
+
+# LogRecord 的內建屬性；其餘屬性視為 extra 欄位輸出
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "ctx_tag",
+    "sample",
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key in ("user_id", "request_id"):
+            value = getattr(record, key, "-")
+            if value and value != "-":
+                payload[key] = value
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key not in payload and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(ctx_tag)s%(message)s"
+
+
+class SamplingFilter(logging.Filter):
+    """帶有 sample 屬性的 record 依類別比例取樣；WARNING 以上一律保留。"""
+
+    def __init__(self, rates: Dict[str, float], default_rate: float):
+        super().__init__()
+        self.rates = rates
+        self.default_rate = default_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "sample", None)
+        if category is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < self.rates.get(category, self.default_rate)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """在呼叫端執行緒先合併訊息與例外文字，佇列中只放可安全跨執行緒的資料。"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _parse_pairs(spec: str) -> Dict[str, str]:
+    pairs = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+def setup_logging() -> None:
+    """設定 root logger（可重複呼叫，只生效一次）。"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        fmt = os.getenv("LOG_FORMAT", "json").lower()
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+        rates = {k: float(v) for k, v in _parse_pairs(os.getenv("LOG_SAMPLE_RATES", "")).items()}
+        handler = _ContextQueueHandler(queue.SimpleQueue())
+        # 上下文與取樣都要在呼叫端執行緒判斷（ContextVar 不會跟著 record 進到背景執行緒）
+        handler.addFilter(RequestContextFilter())
+        handler.addFilter(SamplingFilter(rates, float(os.getenv("LOG_SAMPLE_RATE", 0.01))))
+
+        root = logging.getLogger()
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        logging.getLogger("apscheduler").setLevel(logging.WARNING)
+        for name, level in _parse_pairs(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(level.upper())
+
+        _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """停止背景寫出執行緒並送出佇列中剩餘的紀錄。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
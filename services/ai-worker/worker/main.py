@@ -1,64 +1,50 @@
 import os
-import pika
-import json
 import time
 import logging
 # from llm_app.llm_service import LLMService # 移到資料庫初始化之後
-from stt_app.stt_service import STTService
-from tts_app.tts_service import TTSService
-logging.getLogger('apscheduler').setLevel(logging.WARNING)
+from stt_app.stt_service import get_stt_service
+from tts_app.tts_service import get_tts_service
+from model_lifecycle import PRELOAD_MODELS, preload_models
+from mq_app.consumer import ConcurrentConsumer
+from mq_app.publisher import publish_notification
+from mq_app.stages import (
+    AUDIO_PIPELINE_MODE,
+    STAGE_ENGINES,
+    local_stages,
+    start_stage_consumers,
+    submit_audio_task,
+)
+from log_config import setup_logging
+# JSON 結構化日誌（自動帶上 user_id / request_id），由背景執行緒寫出
+setup_logging()
+logger = logging.getLogger("ai_worker")
 
 def initialize_database():
     """
     確保所有必要的資料庫和表格都已建立。
     這個函式可安全地重複執行。
     """
-    print("--- 開始進行資料庫初始化檢查 ---", flush=True)
+    logger.info("開始進行資料庫初始化檢查")
     try:
         from llm_app.models.chat_profile import create_profile_table_if_not_exists
         # 呼叫 SQLAlchemy 的 create_all()，它會自動檢查表格是否存在
         create_profile_table_if_not_exists()
-        print("--- 資料庫初始化檢查完成 ---", flush=True)
+        logger.info("資料庫初始化檢查完成")
     except ImportError as e:
-        print(f"[!] 初始化錯誤：無法導入模組。請確認路徑設定。 {e}", flush=True)
+        logger.error("初始化錯誤：無法導入模組。請確認路徑設定。 %s", e)
     except Exception as e:
         # 在實際生產環境中，這裡可能需要更複雜的重試邏輯
-        print(f"[!] 資料庫初始化失敗: {e}", flush=True)
-        print("[!] 可能是資料庫服務尚未完全就緒，稍後重試...", flush=True)
+        logger.error("資料庫初始化失敗（可能是資料庫服務尚未完全就緒，稍後重試）: %s", e)
         # 拋出異常，讓主循環可以捕捉並重試
         raise
 
 from llm_app.llm_service import LLMService, llm_service_instance
 from llm_app.ProactiveCare.scheduler import scheduler, initialize_scheduler
 
-def publish_notification(message: dict, patient_id: int):
-    """將訊息發佈到通知佇列。"""
-    rabbitmq_host = os.environ.get("RABBITMQ_HOST", "rabbitmq")
-    notification_queue = os.environ.get("RABBITMQ_NOTIFICATION_QUEUE", "notifications_queue")
-    try:
-        message_with_id = message.copy()
-        message_with_id['patient_id'] = patient_id
-        connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
-        channel = connection.channel()
-        channel.queue_declare(queue=notification_queue, durable=True)
-        channel.basic_publish(
-            exchange='',
-            routing_key=notification_queue,
-            body=json.dumps(message_with_id),
-            properties=pika.BasicProperties(delivery_mode=2)
-        )
-        print(f"已發送通知: {message_with_id}", flush=True)
-        connection.close()
-    except pika.exceptions.AMQPConnectionError as e:
-        print(f"連線到 RabbitMQ 以發送通知時出錯: {e}", flush=True)
-        raise
-
-
 def process_text_task(task_data={}):
     """透過 llm-app 來處理文字訊息。"""
-    print("建立 LLM 服務...", flush=True)
     response = llm_service_instance.generate_response(task_data=task_data)
-    print(f"成功呼叫 LLM 服務。回應: {response}", flush=True)
+    logger.info("成功呼叫 LLM 服務", extra={"sample": "payload", "response": response})
     return response
 
 
@@ -68,28 +54,28 @@ def process_audio_task(patient_id: int, audio_duration_ms=60000, task_data={}):
     """
     try:
         # 步驟 1: STT - 語音轉文字
-        print(f"--- 開始 STT 處理: {task_data['object_name']} ---", flush=True)
-        user_transcript = STTService().transcribe_audio(task_data['bucket_name'], task_data['object_name'])
+        logger.info("開始 STT 處理: %s", task_data['object_name'])
+        user_transcript = get_stt_service().transcribe_audio(task_data['bucket_name'], task_data['object_name'])
         if not user_transcript:
             raise ValueError("STT 服務未返回有效的轉錄文字")
         task_data['text'] = user_transcript  # 將轉錄文字加入 task_data
-        print(f"STT 結果: {user_transcript}", flush=True)
+        logger.info("STT 完成", extra={"sample": "payload", "transcript": user_transcript})
 
 
         # 步驟 2: LLM - 產生 AI 回應
-        print(f"--- 開始 LLM 處理 ---", flush=True)
+        logger.info("開始 LLM 處理")
         ai_response = llm_service_instance.generate_response(task_data=task_data)
         if not ai_response:
             raise ValueError("LLM 服務未返回有效的 AI 回應")
-        print(f"LLM 結果: {ai_response}", flush=True)
+        logger.info("LLM 完成", extra={"sample": "payload", "ai_response": ai_response})
 
 
         # 步驟 3: TTS - 文字轉語音
-        print(f"--- 開始 TTS 處理 ---", flush=True)
-        response_audio_url, duration_ms = TTSService().synthesize_text(ai_response)
+        logger.info("開始 TTS 處理")
+        response_audio_url, duration_ms = get_tts_service().synthesize_text(ai_response)
         if not response_audio_url:
             raise ValueError("TTS 服務未返回有效的音訊物件名稱")
-        print(f"TTS 結果: {response_audio_url}", flush=True)
+        logger.info("TTS 完成: %s", response_audio_url)
 
         # 步驟 4: 發送成功通知
         notification_message = {
@@ -103,7 +89,7 @@ def process_audio_task(patient_id: int, audio_duration_ms=60000, task_data={}):
         publish_notification(notification_message, patient_id)
 
     except Exception as e:
-        print(f"音訊處理管道中發生錯誤: {e}", flush=True)
+        logger.exception("音訊處理管道中發生錯誤: %s", e)
         error_notification = {
             "status": "error",
             "original_file": task_data['object_name'],
@@ -112,6 +98,39 @@ def process_audio_task(patient_id: int, audio_duration_ms=60000, task_data={}):
         publish_notification(error_notification, patient_id)
         raise
 
+def handle_task(task_data: dict):
+    """處理一則來自 task_queue 的任務（在消費者的執行緒池中執行）。"""
+    logger.info("收到任務 patient_id=%s", task_data.get('patient_id'))
+    logger.info("任務內容", extra={"sample": "payload", "task": task_data})
+    try:
+        patient_id = task_data.get('patient_id')
+        if not patient_id:
+            raise ValueError("任務資料缺少 'patient_id'")
+
+        if 'text' in task_data:
+            logger.info("開始為病患 %s 處理文字任務", patient_id)
+            llm_response = process_text_task(task_data=task_data)
+            notification = {
+                "status": "completed",
+                "user_transcript": task_data['text'],
+                "ai_response": llm_response
+            }
+            publish_notification(notification, patient_id)
+        elif 'bucket_name' in task_data and 'object_name' in task_data:
+            if AUDIO_PIPELINE_MODE == "staged":
+                # 分段模式：送入 transcribe 佇列後即完成，後續由各階段消費者接手
+                correlation_id = submit_audio_task(task_data)
+                logger.info("病患 %s 的音訊任務已送入分段管道 (%s)", patient_id, correlation_id)
+                return
+            audio_duration_ms = task_data.get('duration_ms')
+            logger.info("開始為病患 %s 處理音訊任務", patient_id)
+            process_audio_task(patient_id, audio_duration_ms, task_data=task_data)
+        else:
+            logger.warning("未知的任務格式: %s", list(task_data))
+        logger.info("任務成功完成")
+    except Exception as e:
+        logger.exception("處理任務時出錯: %s", e)
+
 if __name__ == '__main__':
 
     # 【新增】在主循環開始前，先執行資料庫初始化
@@ -124,10 +143,10 @@ if __name__ == '__main__':
             break # 初始化成功，跳出循環
         except Exception as e:
             if i < max_retries - 1:
-                print(f"初始化失敗，將在 {retry_delay} 秒後重試 ({i+1}/{max_retries})...", flush=True)
+                logger.warning("初始化失敗，將在 %s 秒後重試 (%s/%s)", retry_delay, i + 1, max_retries)
                 time.sleep(retry_delay)
             else:
-                print("達到最大重試次數，初始化失敗，程式即將退出。", flush=True)
+                logger.critical("達到最大重試次數，初始化失敗，程式即將退出。")
                 exit(1) # 重試全部失敗後，退出程式
     
     # 【新增】在背景執行緒中啟動 APScheduler
@@ -136,53 +155,39 @@ if __name__ == '__main__':
         initialize_scheduler()
         # 2. 啟動排程器
         scheduler.start()
-        print('✅ [AI Worker] 排程服務已成功啟動。', flush=True)
+        logger.info("排程服務已成功啟動")
     except Exception as e:
-        print(f"❌ [AI Worker] 啟動排程服務失敗: {e}", flush=True)
+        logger.exception("啟動排程服務失敗: %s", e)
+
+    # 通報 stream 的消費者群組在啟動時建立一次，之後 xadd_alert 不再每次呼叫 XGROUP CREATE
+    try:
+        from llm_app.toolkits.redis_store import ensure_alert_group
+        ensure_alert_group()
+    except Exception as e:
+        logger.warning("建立通報消費者群組失敗，將於第一次通報時重試: %s", e)
+
+    # 分段模式下，此行程只負責 AUDIO_PIPELINE_STAGES 指定的階段，也只載入那些階段需要的模型
+    engines = ("stt", "tts")
+    if AUDIO_PIPELINE_MODE == "staged":
+        stages = local_stages()
+        engines = tuple(e for stage in stages for e in STAGE_ENGINES.get(stage, ()))
+
+    # 預先載入並暖機 STT/TTS 模型，之後每個任務都共用常駐實例
+    if PRELOAD_MODELS and engines:
+        report = preload_models(engines)
+        logger.info("模型已常駐: %s", report)
+
+    if AUDIO_PIPELINE_MODE == "staged":
+        start_stage_consumers(stages)
+        logger.info("音訊分段管道已啟動: %s", stages)
 
-    rabbitmq_host = os.environ.get("RABBITMQ_HOST", "rabbitmq")
     task_queue = os.environ.get("RABBITMQ_QUEUE", "task_queue")
 
-    while True:
-        try:
-            connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbitmq_host))
-            channel = connection.channel()
-            channel.queue_declare(queue=task_queue, durable=True)
-            print(' [*] AI Worker 正在等待訊息。按 CTRL+C 離開', flush=True)
-
-            def callback(ch, method, properties, body):
-                task_data = json.loads(body)
-                print(f"\n [x] 收到任務: {task_data}", flush=True)
-                try:
-                    patient_id = task_data.get('patient_id')
-                    if not patient_id:
-                        raise ValueError("任務資料缺少 'patient_id'")
-
-                    if 'text' in task_data:
-                        print(f" [*] 開始為病患 {patient_id} 處理文字任務...", flush=True)
-                        llm_response = process_text_task(task_data=task_data)
-                        notification = {
-                            "status": "completed",
-                            "user_transcript": task_data['text'],
-                            "ai_response": llm_response
-                        }
-                        publish_notification(notification, patient_id)
-                    elif 'bucket_name' in task_data and 'object_name' in task_data:
-                        audio_duration_ms = task_data.get('duration_ms')
-                        print(f" [*] 開始為病患 {patient_id} 處理音訊任務...", flush=True)
-                        process_audio_task(patient_id, audio_duration_ms, task_data=task_data)
-                    else:
-                        print(f" [!] 未知的任務格式: {task_data}", flush=True)
-                    print(f" [✔] 任務成功完成。", flush=True)
-                except Exception as e:
-                    print(f" [!] 處理任務時出錯: {e}", flush=True)
-                ch.basic_ack(delivery_tag=method.delivery_tag)
-
-            channel.basic_consume(queue=task_queue, on_message_callback=callback)
-            channel.start_consuming()
-        except pika.exceptions.AMQPConnectionError as e:
-            print(f"與 RabbitMQ 的連線失敗: {e}。5 秒後重試...", flush=True)
-            time.sleep(5)
-        except Exception as e:
-            print(f"發生未預期的錯誤: {e}。正在重啟消費者...", flush=True)
-            time.sleep(5)
+    # 以執行緒池併發處理任務；同一位病患的任務依序執行，不同病患可平行
+    consumer = ConcurrentConsumer(
+        queue=task_queue,
+        handler=handle_task,
+        key_fn=lambda task: task.get('patient_id'),
+    )
+    logger.info("AI Worker 正在等待訊息。按 CTRL+C 離開")
+    consumer.run_forever()
@@ -0,0 +1,89 @@
+# 檔名: model_lifecycle.py
+# 說明: 模型生命週期管理。每個行程只載入一次 STT / TTS 引擎，
+#       啟動時以假資料暖機，之後所有任務都共用常駐實例。
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+# 啟動時是否預先載入模型；關閉後會在第一個任務進來時才載入
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "true").lower() == "true"
+# 載入後是否以假資料跑一次推論（觸發 CUDA kernel / torch.compile 編譯）
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
+_lock = threading.Lock()
+_load_report: Dict[str, Dict[str, float]] = {}
+
+
+def _stt_factory():
+    from stt_app.stt_service import get_stt_service
+
+    return get_stt_service()
+
+
+def _tts_factory():
+    from tts_app.tts_service import get_tts_service
+
+    return get_tts_service()
+
+
+_ENGINE_FACTORIES: Dict[str, Callable] = {
+    "stt": _stt_factory,
+    "tts": _tts_factory,
+}
+
+
+def _load_and_warm(name: str, factory: Callable) -> None:
+    t0 = time.perf_counter()
+    service = factory()
+    load_seconds = time.perf_counter() - t0
+
+    warmup_seconds = 0.0
+    if MODEL_WARMUP and hasattr(service, "warmup"):
+        t1 = time.perf_counter()
+        try:
+            service.warmup()
+        except Exception as e:
+            # 暖機失敗不影響服務，只是第一個任務會比較慢
+            logger.warning("[Model Lifecycle] %s 暖機失敗: %s", name, e)
+        warmup_seconds = time.perf_counter() - t1
+
+    _load_report[name] = {
+        "load_seconds": round(load_seconds, 3),
+        "warmup_seconds": round(warmup_seconds, 3),
+    }
+    logger.info(
+        "[Model Lifecycle] %s 已常駐：載入 %.2fs，暖機 %.2fs",
+        name,
+        load_seconds,
+        warmup_seconds,
+    )
+
+
+def preload_models(engines: Iterable[str] = ("stt", "tts")) -> Dict[str, Dict[str, float]]:
+    """
+    載入並暖機指定的模型引擎，可安全地重複呼叫（已載入的引擎會略過）。
+    回傳各引擎的載入與暖機耗時（秒）。
+    """
+    with _lock:
+        for name in engines:
+            if name in _load_report:
+                continue
+            factory = _ENGINE_FACTORIES.get(name)
+            if factory is None:
+                logger.warning("[Model Lifecycle] 未知的模型引擎: %s", name)
+                continue
+            try:
+                _load_and_warm(name, factory)
+            except Exception as e:
+                logger.error("[Model Lifecycle] %s 載入失敗: %s", name, e)
+    return get_load_report()
+
+
+def get_load_report() -> Dict[str, Dict[str, float]]:
+    """回傳目前已常駐引擎的載入與暖機耗時。"""
+    return {name: dict(stats) for name, stats in _load_report.items()}
@@ -0,0 +1 @@
+# RabbitMQ 消費 / 發佈共用元件
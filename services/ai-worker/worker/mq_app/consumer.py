@@ -0,0 +1,210 @@
+# 檔名: consumer.py
+# 說明: 具併發能力的 RabbitMQ 消費者。
+#       - 以 basic_qos(prefetch_count) 控制同時在手上的訊息數量
+#       - 以有上限的執行緒池處理任務，不同使用者的任務可平行執行
+#       - 同一個 key（例如 patient_id）的任務依到達順序逐一執行
+#       - 任務完成後才 ack（透過 add_callback_threadsafe 回到連線執行緒）；
+#         handler 拋出 RejectMessage 時改為 nack
+#       - 重連後舊連線上尚未開始的任務不再執行（無法 ack，RabbitMQ 會重新投遞）；
+#         重新投遞的訊息若仍在舊連線上執行中，等它完成後直接 ack，不重複處理
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = int(os.getenv("AI_WORKER_CONCURRENCY", 4))
+DEFAULT_PREFETCH = int(os.getenv("AI_WORKER_PREFETCH", DEFAULT_CONCURRENCY * 2))
+
+
+class RejectMessage(Exception):
+    """handler 拋出時以 basic_nack 回覆；requeue=True 讓 RabbitMQ 重新投遞。"""
+
+    def __init__(self, message: str = "", requeue: bool = False):
+        super().__init__(message)
+        self.requeue = requeue
+
+
+class _Job:
+    __slots__ = ("task_data", "connection", "channel", "delivery_tag", "generation", "ident")
+
+    def __init__(self, task_data, connection, channel, delivery_tag, generation=0, ident=None):
+        self.task_data = task_data
+        self.connection = connection
+        self.channel = channel
+        self.delivery_tag = delivery_tag
+        # 第幾次連線收到的；重連後舊連線的 delivery_tag 已失效
+        self.generation = generation
+        # 辨識重新投遞的同一則訊息：message_id，沒有時用內容的 hash
+        self.ident = ident
+
+
+def _message_ident(properties, body: bytes) -> str:
+    message_id = getattr(properties, "message_id", None)
+    return message_id or hashlib.sha1(body).hexdigest()
+
+
+class ConcurrentConsumer:
+    """
+    從單一佇列消費 JSON 任務並交給 handler 處理。
+
+    handler(task_data) 拋出的例外只會被記錄，訊息一樣會被 ack（與原本的行為一致）；
+    拋出 RejectMessage 時改以 nack 回覆。
+    key_fn(task_data) 回傳相同值的任務會依序執行；回傳 None 則不限制順序。
+    """
+
+    def __init__(
+        self,
+        queue: str,
+        handler: Callable[[Dict[str, Any]], None],
+        key_fn: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+        max_workers: int = DEFAULT_CONCURRENCY,
+        prefetch_count: int = DEFAULT_PREFETCH,
+        host: Optional[str] = None,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.key_fn = key_fn
+        self.max_workers = max(1, max_workers)
+        # prefetch 小於 worker 數會讓部分執行緒永遠閒置
+        self.prefetch_count = max(prefetch_count, self.max_workers)
+        self.host = host or os.environ.get("RABBITMQ_HOST", "rabbitmq")
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix=f"consumer-{queue}"
+        )
+        self._lock = threading.Lock()
+        # key -> 等待中的任務；key 存在代表該 key 目前有任務正在執行
+        self._pending: Dict[str, Deque[_Job]] = {}
+        self._generation = 0
+        # ident -> 正在執行的任務；以及執行期間重新投遞、等它完成後直接 ack 的副本
+        self._inflight: Dict[str, _Job] = {}
+        self._redelivered: Dict[str, List[_Job]] = {}
+
+    # ---- 訊息進入點（在連線執行緒中執行） ----
+    def _on_message(self, connection, ch, method, properties, body):
+        try:
+            task_data = json.loads(body)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            logger.error("[Consumer] 無法解析任務，直接丟棄: %s", e)
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        job = _Job(
+            task_data, connection, ch, method.delivery_tag, self._generation, _message_ident(properties, body)
+        )
+        if method.redelivered:
+            with self._lock:
+                if job.ident in self._inflight:
+                    # 舊連線上的同一則訊息還在處理，完成後 ack 這份副本即可
+                    self._redelivered.setdefault(job.ident, []).append(job)
+                    logger.info("[Consumer] 重新投遞的訊息仍在處理中，完成後直接 ack")
+                    return
+
+        key = self.key_fn(task_data) if self.key_fn else None
+        if key is None:
+            self._executor.submit(self._run_one, job)
+            return
+
+        key = str(key)
+        with self._lock:
+            if key in self._pending:
+                # 同一使用者已有任務在跑，排在後面等它完成
+                self._pending[key].append(job)
+                return
+            self._pending[key] = deque()
+        self._executor.submit(self._run_chain, key, job)
+
+    # ---- 執行緒池中執行 ----
+    def _run_chain(self, key: str, job: _Job) -> None:
+        while True:
+            self._run_one(job)
+            with self._lock:
+                waiting = self._pending.get(key)
+                if not waiting:
+                    self._pending.pop(key, None)
+                    return
+                job = waiting.popleft()
+
+    def _run_one(self, job: _Job) -> None:
+        with self._lock:
+            if job.generation != self._generation:
+                # 連線已重建：這則訊息無法再 ack，RabbitMQ 會在新連線上重新投遞
+                return
+            self._inflight[job.ident] = job
+        requeue = None  # None 表示 ack
+        try:
+            self.handler(job.task_data)
+        except RejectMessage as e:
+            logger.warning("[Consumer] 任務被拒絕（requeue=%s）: %s", e.requeue, e)
+            requeue = e.requeue
+        except Exception as e:
+            logger.error("[Consumer] 處理任務時出錯: %s", e, exc_info=True)
+        finally:
+            with self._lock:
+                self._inflight.pop(job.ident, None)
+                duplicates = self._redelivered.pop(job.ident, [])
+            for done in [job, *duplicates]:
+                self._ack(done, requeue)
+
+    def _ack(self, job: _Job, requeue: Optional[bool] = None) -> None:
+        """requeue 為 None 時 ack，否則 nack。"""
+        # pika 的 BlockingConnection 不是 thread-safe，ack 必須交回連線執行緒
+        try:
+            job.connection.add_callback_threadsafe(
+                functools.partial(self._ack_in_connection_thread, job, requeue)
+            )
+        except Exception as e:
+            # 連線已斷，RabbitMQ 會重新投遞這則訊息
+            logger.warning("[Consumer] 無法 ack（連線已關閉）: %s", e)
+
+    @staticmethod
+    def _ack_in_connection_thread(job: _Job, requeue: Optional[bool] = None) -> None:
+        if not job.channel.is_open:
+            return
+        if requeue is None:
+            job.channel.basic_ack(delivery_tag=job.delivery_tag)
+        else:
+            job.channel.basic_nack(delivery_tag=job.delivery_tag, requeue=requeue)
+
+    # ---- 主循環 ----
+    def run_forever(self) -> None:
+        """連線、消費並在斷線時自動重連。此函式不會返回。"""
+        while True:
+            try:
+                connection = pika.BlockingConnection(
+                    pika.ConnectionParameters(host=self.host, heartbeat=60)
+                )
+                with self._lock:
+                    # 之後收到的訊息屬於新連線；舊連線上排隊中的任務不再執行
+                    self._generation += 1
+                channel = connection.channel()
+                channel.queue_declare(queue=self.queue, durable=True)
+                channel.basic_qos(prefetch_count=self.prefetch_count)
+                channel.basic_consume(
+                    queue=self.queue,
+                    on_message_callback=functools.partial(self._on_message, connection),
+                )
+                logger.info(
+                    "[Consumer] 開始消費 %s（workers=%d, prefetch=%d）",
+                    self.queue,
+                    self.max_workers,
+                    self.prefetch_count,
+                )
+                channel.start_consuming()
+            except pika.exceptions.AMQPConnectionError as e:
+                logger.warning("[Consumer] 與 RabbitMQ 的連線失敗: %s。5 秒後重試...", e)
+                time.sleep(5)
+            except Exception as e:
+                logger.error("[Consumer] 發生未預期的錯誤: %s。正在重啟消費者...", e)
+                time.sleep(5)
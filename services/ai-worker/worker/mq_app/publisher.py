@@ -0,0 +1,210 @@
+# 檔名: publisher.py
+# 說明: 長駐連線的 RabbitMQ 發佈器。
+#       - 連線與 channel 放在連線池中重複使用，不再每則訊息都做 TCP/AMQP 握手
+#       - 每個 channel 同一時間只借給一個執行緒（pika 連線不是 thread-safe）
+#       - channel 啟用 publisher confirms，並快取已宣告過的佇列
+#       - 借出時先檢查閒置連線，失效的直接丟棄並改借下一條（不算重試次數）
+#       - 發佈途中連線失效時自動重連並重送一次
+
+import json
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import pika
+from pika.exceptions import AMQPChannelError, AMQPConnectionError, StreamLostError
+
+logger = logging.getLogger(__name__)
+
+PUBLISHER_POOL_SIZE = int(
+    os.getenv("RABBITMQ_PUBLISHER_POOL_SIZE", os.getenv("AI_WORKER_CONCURRENCY", 4))
+)
+# 閒置的發佈連線不會主動處理心跳，因此心跳間隔設長一些；失效時由重連機制處理
+PUBLISHER_HEARTBEAT = int(os.getenv("RABBITMQ_PUBLISHER_HEARTBEAT", 600))
+CHECKOUT_TIMEOUT = float(os.getenv("RABBITMQ_PUBLISHER_CHECKOUT_TIMEOUT", 30))
+
+# 這些錯誤代表連線或 channel 已不可用，需丟棄後重連
+_RECONNECT_ERRORS = (AMQPConnectionError, AMQPChannelError, StreamLostError)
+
+
+class _PooledChannel:
+    """一條長駐連線與其上的一個 confirm channel。"""
+
+    def __init__(self, parameters: pika.ConnectionParameters):
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+        self.channel.confirm_delivery()
+        self.declared_queues = set()
+
+    @property
+    def is_open(self) -> bool:
+        return self.connection.is_open and self.channel.is_open
+
+    def keepalive(self) -> None:
+        # 處理借出前累積的心跳與關閉通知，失效的連線會在這裡拋錯
+        self.connection.process_data_events(time_limit=0)
+
+    def publish(self, queue_name: str, body: str, properties: pika.BasicProperties) -> None:
+        if queue_name not in self.declared_queues:
+            self.channel.queue_declare(queue=queue_name, durable=True)
+            self.declared_queues.add(queue_name)
+        # confirm 模式下 basic_publish 會等到 broker 確認才返回
+        self.channel.basic_publish(
+            exchange="",
+            routing_key=queue_name,
+            body=body,
+            properties=properties,
+        )
+
+    def close(self) -> None:
+        try:
+            if self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+
+
+class PooledPublisher:
+    """以連線池發佈 JSON 訊息到 RabbitMQ 的持久化佇列。"""
+
+    def __init__(self, parameters: pika.ConnectionParameters, pool_size: int = PUBLISHER_POOL_SIZE):
+        self.parameters = parameters
+        self.pool_size = max(1, pool_size)
+        self._idle: "queue.LifoQueue[_PooledChannel]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _acquire(self) -> Tuple[_PooledChannel, bool]:
+        """借出一條連線，回傳 (連線, 是否為新建立)。"""
+        try:
+            return self._idle.get_nowait(), False
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.pool_size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return _PooledChannel(self.parameters), True
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=CHECKOUT_TIMEOUT), False
+        except queue.Empty:
+            raise AMQPConnectionError("等待可用的 RabbitMQ 發佈連線逾時")
+
+    def _acquire_live(self) -> _PooledChannel:
+        """
+        借出可用的連線。閒置太久的連線可能已被 broker 或網路關閉，
+        檢查失敗就丟棄並改借下一條；只有新建立的連線也失敗時才拋錯。
+        """
+        while True:
+            slot, fresh = self._acquire()
+            try:
+                if not slot.is_open:
+                    raise AMQPConnectionError("發佈連線已關閉")
+                slot.keepalive()
+                return slot
+            except _RECONNECT_ERRORS as e:
+                self._discard(slot)
+                if fresh:
+                    raise
+                logger.info("[Publisher] 丟棄失效的閒置連線: %s", e)
+
+    def _discard(self, slot: _PooledChannel) -> None:
+        slot.close()
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def _checkout(self):
+        slot = self._acquire_live()
+        try:
+            yield slot
+        except BaseException:
+            # 發生任何錯誤都不確定 channel 狀態，直接丟棄
+            self._discard(slot)
+            raise
+        else:
+            self._idle.put(slot)
+
+    def publish_batch(
+        self,
+        queue_name: str,
+        messages: Iterable[Dict[str, Any]],
+        properties: Optional[pika.BasicProperties] = None,
+    ) -> int:
+        """
+        在同一個 confirm channel 上依序發佈多則訊息，回傳成功發佈的數量。
+        發佈途中連線失效時會重連一次並從尚未確認的訊息繼續送。
+        """
+        bodies = [json.dumps(m, ensure_ascii=False) for m in messages]
+        properties = properties or pika.BasicProperties(delivery_mode=2)
+        sent = 0
+        for attempt in (1, 2):
+            try:
+                with self._checkout() as slot:
+                    while sent < len(bodies):
+                        slot.publish(queue_name, bodies[sent], properties)
+                        sent += 1
+                return sent
+            except _RECONNECT_ERRORS as e:
+                if attempt == 2:
+                    raise
+                logger.warning("[Publisher] RabbitMQ 連線失效，重新連線後重送: %s", e)
+        return sent
+
+    def publish(
+        self,
+        queue_name: str,
+        message: Dict[str, Any],
+        properties: Optional[pika.BasicProperties] = None,
+    ) -> None:
+        """發佈單則訊息並等待 broker 確認。"""
+        self.publish_batch(queue_name, [message], properties=properties)
+
+    def close(self) -> None:
+        """關閉所有閒置中的連線。"""
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(slot)
+
+
+_publisher: Optional[PooledPublisher] = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> PooledPublisher:
+    """工廠函式，取得行程共用的 PooledPublisher。"""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                parameters = pika.ConnectionParameters(
+                    host=os.environ.get("RABBITMQ_HOST", "rabbitmq"),
+                    heartbeat=PUBLISHER_HEARTBEAT,
+                )
+                _publisher = PooledPublisher(parameters)
+    return _publisher
+
+
+def publish_notification(message: Dict[str, Any], patient_id) -> None:
+    """將訊息發佈到通知佇列（notifications_queue），附上 patient_id。"""
+    notification_queue = os.environ.get("RABBITMQ_NOTIFICATION_QUEUE", "notifications_queue")
+    try:
+        message_with_id = message.copy()
+        message_with_id["patient_id"] = patient_id
+        get_publisher().publish(notification_queue, message_with_id)
+        logger.info("已發送通知 patient_id=%s", patient_id, extra={"sample": "payload", "body": message_with_id})
+    except AMQPConnectionError as e:
+        logger.error("連線到 RabbitMQ 以發送通知時出錯: %s", e)
+        raise
@@ -0,0 +1,255 @@
+# 檔名: stages.py
+# 說明: 分段式音訊管道 STT → LLM → TTS → 通知。
+#       每個階段有自己的佇列與消費者池，可在不同容器中獨立擴充，
+#       GPU/CPU 密集的模型階段與網路密集的 LLM 階段因此可以重疊執行。
+#
+#       階段之間傳遞的訊息（envelope）：
+#       {
+#         "correlation_id": "...",          # 整個音訊回合共用的追蹤 ID
+#         "patient_id": ...,
+#         "task": {...},                    # 原始任務（bucket_name / object_name / line_user_id ...）
+#         "reply": {"type": "notification"} # 或 {"type": "voice_chat", "queue": ..., "task_id": ...,
+#                                           #      "conversation_id": ..., "patient_id": ...}
+#         "user_transcript": "...",         # transcribe 之後
+#         "ai_response": "...",             # respond 之後
+#         "response_audio_url": "...",      # synthesize 之後
+#         "audio_duration_ms": 1234,
+#         "error_message": "..."            # 任一階段失敗時，直接送往 notify
+#       }
+#
+#       失敗時的處理與 inline 模式一致：
+#       - notification：帶著錯誤送往 notify，發出 status=error 的通知
+#       - voice_chat：不回覆，nack 該階段的訊息（不重新排入），如同 VoiceWorker 的 basic_nack
+#       送往下一站失敗時 nack 並重新排入，避免 ack 後訊息遺失
+
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import pika
+
+from .consumer import ConcurrentConsumer, RejectMessage
+from .publisher import get_publisher, publish_notification
+
+logger = logging.getLogger(__name__)
+
+# inline：沿用單一 handler 依序跑完 STT/LLM/TTS；staged：拆成階段佇列
+AUDIO_PIPELINE_MODE = os.getenv("AUDIO_PIPELINE_MODE", "inline").lower()
+
+STAGE_QUEUES: Dict[str, str] = {
+    "transcribe": os.getenv("AUDIO_TRANSCRIBE_QUEUE", "audio_transcribe_queue"),
+    "respond": os.getenv("AUDIO_RESPOND_QUEUE", "audio_respond_queue"),
+    "synthesize": os.getenv("AUDIO_SYNTHESIZE_QUEUE", "audio_synthesize_queue"),
+    "notify": os.getenv("AUDIO_NOTIFY_QUEUE", "audio_notify_queue"),
+}
+
+# 各階段的預設併發數：模型階段受限於 GPU，LLM 階段主要在等網路
+_DEFAULT_STAGE_CONCURRENCY = {
+    "transcribe": 1,
+    "respond": 8,
+    "synthesize": 1,
+    "notify": 2,
+}
+
+# 每個階段需要常駐的模型引擎
+STAGE_ENGINES = {
+    "transcribe": ("stt",),
+    "synthesize": ("tts",),
+}
+
+
+def stage_concurrency(stage: str) -> int:
+    env_key = f"AUDIO_{stage.upper()}_CONCURRENCY"
+    return int(os.getenv(env_key, _DEFAULT_STAGE_CONCURRENCY[stage]))
+
+
+def local_stages() -> List[str]:
+    """此行程要負責的階段（AUDIO_PIPELINE_STAGES，逗號分隔；預設全部）。"""
+    raw = os.getenv("AUDIO_PIPELINE_STAGES", ",".join(STAGE_QUEUES))
+    stages = [s.strip() for s in raw.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGE_QUEUES]
+    if unknown:
+        raise ValueError(f"未知的音訊管道階段: {unknown}")
+    return stages
+
+
+def _publish_stage(stage: str, envelope: Dict[str, Any]) -> None:
+    properties = pika.BasicProperties(
+        delivery_mode=2, correlation_id=envelope["correlation_id"]
+    )
+    get_publisher().publish(STAGE_QUEUES[stage], envelope, properties=properties)
+
+
+def submit_audio_task(task_data: Dict[str, Any], reply: Optional[Dict[str, Any]] = None) -> str:
+    """把一個音訊任務送進分段管道的第一站，回傳 correlation_id。"""
+    correlation_id = task_data.get("correlation_id") or uuid.uuid4().hex
+    envelope = {
+        "correlation_id": correlation_id,
+        "patient_id": task_data.get("patient_id"),
+        "task": task_data,
+        "reply": reply or {"type": "notification"},
+    }
+    _publish_stage("transcribe", envelope)
+    logger.info("[Pipeline %s] 已送入 transcribe 階段", correlation_id)
+    return correlation_id
+
+
+def _is_voice_chat(envelope: Dict[str, Any]) -> bool:
+    return (envelope.get("reply") or {}).get("type") == "voice_chat"
+
+
+def _forward(cid: Optional[str], stage: str, envelope: Dict[str, Any]) -> None:
+    """送往下一站；失敗時 nack 並重新排入，由 RabbitMQ 重新投遞這一站。"""
+    try:
+        _publish_stage(stage, envelope)
+    except Exception as e:
+        raise RejectMessage(f"[Pipeline {cid}] 無法送往 {stage} 階段: {e}", requeue=True) from e
+
+
+def _stage_handler(stage: str, work: Callable[[Dict[str, Any]], None], next_stage: str):
+    """包裝階段工作：成功時送往下一站，失敗時帶著錯誤直接送往 notify（voice_chat 則 nack）。"""
+
+    def handler(envelope: Dict[str, Any]) -> None:
+        cid = envelope.get("correlation_id")
+        try:
+            work(envelope)
+        except Exception as e:
+            logger.error("[Pipeline %s] %s 階段失敗: %s", cid, stage, e, exc_info=True)
+            if _is_voice_chat(envelope):
+                raise RejectMessage(f"[Pipeline {cid}] {stage} 階段失敗: {e}", requeue=False) from e
+            envelope["error_message"] = str(e)
+            next_target = "notify"
+        else:
+            next_target = next_stage
+        _forward(cid, next_target, envelope)
+
+    return handler
+
+
+# ---- 各階段工作 ----
+def _transcribe(envelope: Dict[str, Any]) -> None:
+    from stt_app.stt_service import get_stt_service
+
+    task = envelope["task"]
+    transcript = get_stt_service().transcribe_audio(task["bucket_name"], task["object_name"])
+    # voice_chat 在 inline 模式下允許空白轉錄（仍會回覆），這裡保持一致
+    if not transcript and not _is_voice_chat(envelope):
+        raise ValueError("STT 服務未返回有效的轉錄文字")
+    envelope["user_transcript"] = transcript or ""
+
+
+def _respond(envelope: Dict[str, Any]) -> None:
+    if _is_voice_chat(envelope):
+        # 與 VoiceWorker.process_voice_chat_task 相同的回覆與備用回應
+        from voice_app.voice_reply import generate_reply_with_fallback
+
+        reply = envelope["reply"]
+        envelope["ai_response"] = generate_reply_with_fallback(
+            envelope["user_transcript"], reply.get("patient_id"), reply.get("conversation_id")
+        )
+        return
+
+    from llm_app.llm_service import llm_service_instance
+
+    task_data = dict(envelope["task"])
+    task_data["text"] = envelope["user_transcript"]
+    ai_response = llm_service_instance.generate_response(task_data=task_data)
+    if not ai_response:
+        raise ValueError("LLM 服務未返回有效的 AI 回應")
+    envelope["ai_response"] = ai_response
+
+
+def _synthesize(envelope: Dict[str, Any]) -> None:
+    from tts_app.tts_service import get_tts_service
+
+    object_name, duration_ms = get_tts_service().synthesize_text(envelope["ai_response"])
+    if not object_name and not _is_voice_chat(envelope):
+        raise ValueError("TTS 服務未返回有效的音訊物件名稱")
+    envelope["response_audio_url"] = object_name
+    envelope["audio_duration_ms"] = duration_ms
+
+
+def _notify(envelope: Dict[str, Any]) -> None:
+    """依 reply 類型送出結果；notifications_queue 的訊息格式與 inline 模式完全相同。"""
+    reply = envelope.get("reply") or {"type": "notification"}
+    task = envelope.get("task") or {}
+    error = envelope.get("error_message")
+
+    if reply.get("type") == "voice_chat":
+        if not reply.get("queue"):
+            return
+        if error:
+            response = {"task_id": reply.get("task_id"), "status": "error", "error_message": error}
+        else:
+            response = {
+                "task_id": reply.get("task_id"),
+                "status": "completed",
+                "user_transcription": envelope["user_transcript"],
+                "ai_response_text": envelope["ai_response"],
+                "ai_audio_object": envelope["response_audio_url"],
+                "duration_ms": envelope["audio_duration_ms"],
+                "conversation_id": reply.get("conversation_id") or "new_conversation",
+            }
+        response["patient_id"] = reply.get("patient_id", envelope.get("patient_id"))
+        get_publisher().publish(reply["queue"], response)
+        return
+
+    if error:
+        message = {
+            "status": "error",
+            "original_file": task.get("object_name"),
+            "error_message": error,
+        }
+    else:
+        message = {
+            "status": "completed",
+            "original_file": task.get("object_name"),
+            "user_transcript": envelope["user_transcript"],
+            "ai_response": envelope["ai_response"],
+            "response_audio_url": envelope["response_audio_url"],
+            "audio_duration_ms": envelope["audio_duration_ms"],
+        }
+    publish_notification(message, envelope.get("patient_id"))
+
+
+def _notify_handler(envelope: Dict[str, Any]) -> None:
+    try:
+        _notify(envelope)
+    except Exception as e:
+        # 結果還沒送出，不可 ack；重新排入後再送一次
+        raise RejectMessage(f"[Pipeline {envelope.get('correlation_id')}] 無法送出結果: {e}", requeue=True) from e
+    logger.info("[Pipeline %s] 回合完成", envelope.get("correlation_id"))
+
+
+def build_stage_consumer(stage: str) -> ConcurrentConsumer:
+    """建立單一階段的消費者；同一位病患的訊息在每個階段內都依序處理。"""
+    handlers = {
+        "transcribe": _stage_handler("transcribe", _transcribe, "respond"),
+        "respond": _stage_handler("respond", _respond, "synthesize"),
+        "synthesize": _stage_handler("synthesize", _synthesize, "notify"),
+        "notify": _notify_handler,
+    }
+    concurrency = stage_concurrency(stage)
+    return ConcurrentConsumer(
+        queue=STAGE_QUEUES[stage],
+        handler=handlers[stage],
+        key_fn=lambda envelope: envelope.get("patient_id"),
+        max_workers=concurrency,
+        prefetch_count=concurrency * 2,
+    )
+
+
+def start_stage_consumers(stages: Optional[List[str]] = None) -> List[threading.Thread]:
+    """在背景執行緒中啟動指定階段的消費者（每個階段各自一條 RabbitMQ 連線）。"""
+    threads = []
+    for stage in stages or local_stages():
+        consumer = build_stage_consumer(stage)
+        thread = threading.Thread(
+            target=consumer.run_forever, name=f"audio-stage-{stage}", daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+        logger.info("[Pipeline] %s 階段消費者已啟動（concurrency=%d）", stage, consumer.max_workers)
+    return threads
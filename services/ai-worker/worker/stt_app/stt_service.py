@@ -2,6 +2,7 @@ import io
 import logging
 import os
 import tempfile
+import threading
 from typing import Optional
 
 import torch
@@ -25,8 +26,6 @@ except Exception:
     TORCH_AVAILABLE = False
     TORCHAUDIO_AVAILABLE = False
 
-# 設定日誌
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
@@ -96,6 +95,14 @@ class STTService:
             logger.error(f"ASR 模型載入失敗，改用佔位 STT：{exc}")
             self.asr_pipe = None
 
+    def warmup(self) -> None:
+        """以一秒靜音跑一次推論，讓第一個真實任務不必承擔初始化成本"""
+        if self.asr_pipe is None:
+            return
+        silence = torch.zeros(16000, dtype=torch.float32).numpy()
+        self.asr_pipe(silence)
+        logger.info("ASR 模型暖機完成")
+
     def list_audio_files(self, bucket_name: str) -> list:
         """列出指定 bucket 中的所有音檔"""
         try:
@@ -260,11 +267,17 @@ class STTService:
             raise
 
 
-_stt_service_instance = STTService()
+_stt_service_instance: Optional[STTService] = None
+_stt_service_lock = threading.Lock()
 
 
 def get_stt_service() -> STTService:
-    """Factory function to get the STTService instance."""
+    """Factory function to get the process-wide STTService instance."""
+    global _stt_service_instance
+    if _stt_service_instance is None:
+        with _stt_service_lock:
+            if _stt_service_instance is None:
+                _stt_service_instance = STTService()
     return _stt_service_instance
 
 
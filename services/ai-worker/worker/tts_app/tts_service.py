@@ -1,9 +1,11 @@
 # 檔名: tts_service.py
 # 說明: 此檔案整合了 TTS 模型引擎與 MinIO 上傳服務，提供一個完整的文字轉語音服務。
 
+import logging
 import os
 import subprocess
 import tempfile
+import threading
 import uuid
 from pathlib import Path
 from typing import List, Optional, Tuple
@@ -21,12 +23,14 @@ from opencc import OpenCC
 from snac import SNAC
 from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
 
+logger = logging.getLogger(__name__)
+
 # --- Hugging Face CLI 登入 ---
 # 在 Docker 環境中，.env 的變數由 docker-compose 的 env_file 直接注入，
 # 因此不需要使用 load_dotenv()。我們直接從 os.environ 讀取。
 HUGGING_FACE_TOKEN = os.getenv("HUGGING_FACE_TOKEN")
 if HUGGING_FACE_TOKEN:
-    print(">>> 偵測到 Hugging Face Token，正在執行 CLI 登入...", flush=True)
+    logger.info("偵測到 Hugging Face Token，正在執行 CLI 登入...")
     try:
         # 執行登入指令。check=True 會在指令失敗時拋出錯誤。
         subprocess.run(
@@ -35,20 +39,14 @@ if HUGGING_FACE_TOKEN:
             capture_output=True,  # 避免將 token 顯示在日誌中
             text=True,
         )
-        print("✅ Hugging Face CLI 登入成功。", flush=True)
+        logger.info("Hugging Face CLI 登入成功")
     except FileNotFoundError:
-        print(
-            "⚠️  警告: `huggingface-cli` 指令不存在。請確保 `huggingface-hub` 套件已安裝。",
-            flush=True,
-        )
+        logger.warning("`huggingface-cli` 指令不存在。請確保 `huggingface-hub` 套件已安裝。")
     except subprocess.CalledProcessError as e:
         # 登入失敗，可能因為 token 無效
-        print(
-            f"⚠️  警告: Hugging Face CLI 登入失敗。Token 可能無效。錯誤: {e.stderr}",
-            flush=True,
-        )
+        logger.warning("Hugging Face CLI 登入失敗。Token 可能無效。錯誤: %s", e.stderr)
 else:
-    print(">>> 未提供 Hugging Face Token，將以匿名方式進行操作。", flush=True)
+    logger.info("未提供 Hugging Face Token，將以匿名方式進行操作。")
 
 
 # --- TTS 核心引擎 (原 optimized_inference_engine.py) ---
@@ -64,7 +62,7 @@ class OptimizedOrpheusTTS:
         tokenizer_id: str,
         snac_id: str = "hubertsiuzdak/snac_24khz",
     ):
-        print(">>> 正在初始化 Orpheus TTS 引擎 (已啟用性能優化)...", flush=True)
+        logger.info("正在初始化 Orpheus TTS 引擎 (已啟用性能優化)...")
 
         compute_dtype = (
             torch.bfloat16
@@ -79,28 +77,28 @@ class OptimizedOrpheusTTS:
             bnb_4bit_use_double_quant=True,
         )
 
-        print(f">>> 使用 4-bit 量化載入，計算精度為: {compute_dtype}", flush=True)
+        logger.info("使用 4-bit 量化載入，計算精度為: %s", compute_dtype)
 
         # 不再需要傳遞 token 參數
         self.model = AutoModelForCausalLM.from_pretrained(
             model_id, quantization_config=quantization_config, device_map="auto"
         )
 
-        print(">>> 正在使用 torch.compile() 編譯模型以獲取極致性能...", flush=True)
+        logger.info("正在使用 torch.compile() 編譯模型...")
         try:
             self.model = torch.compile(
                 self.model, mode="reduce-overhead", fullgraph=True
             )
-            print("✅ 模型編譯成功。", flush=True)
+            logger.info("模型編譯成功")
         except Exception as e:
-            print(f"⚠️ 模型編譯失敗，將使用未編譯版本。錯誤: {e}", flush=True)
+            logger.warning("模型編譯失敗，將使用未編譯版本。錯誤: %s", e)
 
         # 不再需要傳遞 token 參數
         self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_id)
         self.snac_model = SNAC.from_pretrained(snac_id).cpu()
         self.cc = OpenCC("t2s.json")
 
-        print("✅ Orpheus TTS 引擎已成功載入並優化。", flush=True)
+        logger.info("Orpheus TTS 引擎已成功載入並優化")
 
     def _prepare_prompts_for_batch(
         self, prompts: List[str], voice: str
@@ -180,10 +178,26 @@ class OptimizedOrpheusTTS:
             output_waveforms.append(audio_hat)
         return output_waveforms
 
+    def warmup(self, voice: str, prompt: str = "你好") -> None:
+        """以短句跑一次 generate 與 SNAC 解碼，觸發 torch.compile 編譯與 CUDA 初始化。"""
+        input_ids, attention_mask = self._prepare_prompts_for_batch([prompt], voice)
+        input_ids, attention_mask = input_ids.to(self.model.device), attention_mask.to(
+            self.model.device
+        )
+        with torch.no_grad():
+            generated_ids = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=28,
+                do_sample=False,
+                eos_token_id=128258,
+            )
+        self._decode_and_redistribute(generated_ids.to("cpu"))
+
     def synthesize(
         self, prompt: str, voice: str, output_path: str, speed_rate: float = 1.0
     ):
-        print(f"\n>>> 正在合成: '{prompt}'", flush=True)
+        logger.info("正在合成語音", extra={"sample": "payload", "prompt": prompt})
         input_ids, attention_mask = self._prepare_prompts_for_batch([prompt], voice)
         input_ids, attention_mask = input_ids.to(self.model.device), attention_mask.to(
             self.model.device
@@ -206,15 +220,15 @@ class OptimizedOrpheusTTS:
         if output_samples and output_samples[0].numel() > 0:
             audio_numpy = output_samples[0].squeeze().numpy()
             if speed_rate != 1.0:
-                print(f"   >>> 正在調整語速為: {speed_rate}x", flush=True)
+                logger.debug("正在調整語速為: %sx", speed_rate)
                 audio_numpy = pyrb.time_stretch(
                     y=audio_numpy, sr=24000, rate=speed_rate
                 )
 
             sf.write(output_path, audio_numpy, 24000)
-            print(f"✅ 音訊已成功儲存至: {output_path}", flush=True)
+            logger.debug("音訊已成功儲存至: %s", output_path)
         else:
-            print("⚠️ 警告：未生成有效音訊。", flush=True)
+            logger.warning("未生成有效音訊")
 
 
 # --- 整合後的 TTS 服務 ---
@@ -252,11 +266,16 @@ class TTSService:
             found = self.minio_client.bucket_exists(self.bucket_name)
             if not found:
                 self.minio_client.make_bucket(self.bucket_name)
-                print(f"Bucket '{self.bucket_name}' created.", flush=True)
+                logger.info("Bucket '%s' created.", self.bucket_name)
         except S3Error as exc:
-            print(f"Error checking or creating bucket: {exc}", flush=True)
+            logger.error("Error checking or creating bucket: %s", exc)
             raise
 
+    def warmup(self) -> None:
+        """暖機 TTS 引擎，不寫檔也不上傳 MinIO。"""
+        self.tts_engine.warmup(voice=self.default_voice)
+        logger.info("TTS 引擎暖機完成")
+
     def synthesize_text(self, text: str) -> Tuple[str, int]:
         """
         使用 Orpheus TTS 引擎合成文字為音訊檔案，上傳到 MinIO，
@@ -300,13 +319,11 @@ class TTSService:
                     duration_ms = int(len(f) / f.samplerate * 1000)
                     metadata["duration-ms"] = str(duration_ms)
             except Exception as e:
-                print(f"無法使用 mutagen 讀取音訊元數據: {e}", flush=True)
+                logger.warning("無法讀取音訊元數據: %s", e)
 
             # 4. 上傳到 MinIO
             object_name = f"{uuid.uuid4()}.m4a"
-            print(
-                f"Uploading {object_name} to bucket {self.bucket_name}...", flush=True
-            )
+            logger.debug("Uploading %s to bucket %s...", object_name, self.bucket_name)
 
             with open(temp_audio_file, "rb") as audio_file_data:
                 self.minio_client.put_object(
@@ -318,29 +335,32 @@ class TTSService:
                     metadata=metadata,
                 )
 
-            print(f"成功上傳 {object_name}, 長度: {duration_ms}ms.", flush=True)
+            logger.info("成功上傳 %s, 長度: %sms", object_name, duration_ms)
             return object_name, duration_ms
 
         except Exception as e:
-            print(f"在 TTS 合成或上傳過程中發生錯誤: {e}", flush=True)
+            logger.error("在 TTS 合成或上傳過程中發生錯誤: %s", e)
             raise
         finally:
             # 5. 清理臨時檔案
             if temp_audio_file and os.path.exists(temp_audio_file):
                 os.remove(temp_audio_file)
-                print(f"已刪除臨時檔案: {temp_audio_file}", flush=True)
+                logger.debug("已刪除臨時檔案: %s", temp_audio_file)
 
 
 # --- 單例實例與工廠模式 ---
 _tts_service_instance: Optional[TTSService] = None
+_tts_service_lock = threading.Lock()
 
 
 def get_tts_service() -> TTSService:
     """工廠函式，用於獲取 TTSService 的單例。"""
     global _tts_service_instance
     if _tts_service_instance is None:
-        print("首次初始化 TTSService...", flush=True)
-        _tts_service_instance = TTSService()
+        with _tts_service_lock:
+            if _tts_service_instance is None:
+                logger.info("首次初始化 TTSService...")
+                _tts_service_instance = TTSService()
     return _tts_service_instance
 
 
@@ -0,0 +1,48 @@
+# 檔名: voice_reply.py
+# 說明: 語音聊天（voice_chat_queue）的回覆產生邏輯。
+#       inline 模式的 VoiceWorker 與分段管道的 respond 階段共用，兩者的回覆與備用回應一致。
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def generate_llm_response(message: str, patient_id: str, conversation_id: str) -> str:
+    """
+    生成LLM回應（同步版本）
+    """
+    # 簡化的LLM邏輯，基於關鍵詞回應
+    message_lower = message.lower()
+
+    if any(word in message_lower for word in ['你好', '哈囉', 'hello', '嗨']):
+        return "您好！我是您的AI健康助理，很高興為您服務。請問有什麼可以幫助您的嗎？"
+
+    elif any(word in message_lower for word in ['謝謝', '感謝', '謝了']):
+        return "不客氣！我很高興能夠幫助您。如果還有其他問題，請隨時告訴我。"
+
+    elif any(word in message_lower for word in ['再見', '拜拜', 'bye']):
+        return "再見！祝您身體健康，有需要時隨時回來找我。"
+
+    elif any(word in message_lower for word in ['頭痛', '痛', '不舒服']):
+        return "我理解您感到不適。建議您適當休息，如果症狀持續或加重，請儘快諮詢醫師。"
+
+    elif any(word in message_lower for word in ['睡眠', '失眠', '睡不著']):
+        return "良好的睡眠很重要。建議建立規律作息，避免睡前使用3C產品，如持續失眠請諮詢醫師。"
+
+    elif any(word in message_lower for word in ['運動', '健身']):
+        return "規律運動對健康很有益！建議每週至少150分鐘中等強度運動。請根據自己的身體狀況適量運動。"
+
+    elif any(word in message_lower for word in ['飲食', '吃', '營養']):
+        return "均衡飲食很重要！建議多吃蔬果、適量蛋白質，少糖少油。如有特殊飲食需求，請諮詢營養師。"
+
+    else:
+        return f"我聽到您說：「{message}」。作為AI健康助理，我建議保持良好生活習慣。如有健康疑慮，請諮詢專業醫師。"
+
+
+def generate_reply_with_fallback(message: str, patient_id: str, conversation_id: str) -> str:
+    """產生回覆；失敗時使用備用回應，不讓整個語音聊天任務失敗。"""
+    try:
+        return generate_llm_response(message, patient_id, conversation_id)
+    except Exception as e:
+        logger.warning("LLM處理失敗，使用備用回應: %s", e)
+        return f"我聽到您說：「{message}」。這是一個AI語音助理的回應。"
@@ -7,6 +7,8 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from stt_app.stt_service import get_stt_service
 from tts_app.tts_service import get_tts_service
 from llm_app.llm_service import get_llm_service
+from mq_app.stages import AUDIO_PIPELINE_MODE, submit_audio_task
+from voice_app.voice_reply import generate_llm_response, generate_reply_with_fallback
 
 # 配置日誌
 logging.basicConfig(
@@ -137,6 +139,30 @@ class VoiceWorker:
             object_name = task_data['object_name']
             patient_id = task_data.get('patient_id', 'anonymous')
             conversation_id = task_data.get('conversation_id')
+
+            if AUDIO_PIPELINE_MODE == "staged":
+                # 分段模式：交給 transcribe → respond → synthesize → notify 各階段處理，
+                # 最後由 notify 階段把結果送回 response_queue。respond 階段使用與下方相同的
+                # generate_reply_with_fallback；任一階段失敗時不回覆並 nack，與 inline 模式一致。
+                # 管道以實際的 patient_id 排序（沒有時不限制順序），'anonymous' 只作為回應欄位
+                correlation_id = submit_audio_task(
+                    {
+                        'patient_id': task_data.get('patient_id'),
+                        'bucket_name': bucket_name,
+                        'object_name': object_name,
+                        'correlation_id': task_data['task_id'],
+                    },
+                    reply={
+                        'type': 'voice_chat',
+                        'queue': task_data.get('response_queue'),
+                        'task_id': task_data['task_id'],
+                        'conversation_id': conversation_id,
+                        'patient_id': patient_id,
+                    },
+                )
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                logger.info("語音聊天任務已送入分段管道: %s", correlation_id)
+                return
             
             # Step 1: STT - 語音轉文字
             logger.info("開始STT處理: %s", object_name)
@@ -145,11 +171,7 @@ class VoiceWorker:
             
             # Step 2: LLM - 生成AI回應
             logger.info("開始LLM處理")
-            try:
-                ai_response_text = self.generate_llm_response(user_transcription, patient_id, conversation_id)
-            except Exception as e:
-                logger.warning("LLM處理失敗，使用備用回應: %s", e)
-                ai_response_text = f"我聽到您說：「{user_transcription}」。這是一個AI語音助理的回應。"
+            ai_response_text = generate_reply_with_fallback(user_transcription, patient_id, conversation_id)
             
             logger.info("LLM完成: %s", ai_response_text)
             
@@ -188,32 +210,7 @@ class VoiceWorker:
         """
         生成LLM回應（同步版本）
         """
-        # 簡化的LLM邏輯，基於關鍵詞回應
-        message_lower = message.lower()
-        
-        if any(word in message_lower for word in ['你好', '哈囉', 'hello', '嗨']):
-            return "您好！我是您的AI健康助理，很高興為您服務。請問有什麼可以幫助您的嗎？"
-        
-        elif any(word in message_lower for word in ['謝謝', '感謝', '謝了']):
-            return "不客氣！我很高興能夠幫助您。如果還有其他問題，請隨時告訴我。"
-        
-        elif any(word in message_lower for word in ['再見', '拜拜', 'bye']):
-            return "再見！祝您身體健康，有需要時隨時回來找我。"
-        
-        elif any(word in message_lower for word in ['頭痛', '痛', '不舒服']):
-            return "我理解您感到不適。建議您適當休息，如果症狀持續或加重，請儘快諮詢醫師。"
-        
-        elif any(word in message_lower for word in ['睡眠', '失眠', '睡不著']):
-            return "良好的睡眠很重要。建議建立規律作息，避免睡前使用3C產品，如持續失眠請諮詢醫師。"
-        
-        elif any(word in message_lower for word in ['運動', '健身']):
-            return "規律運動對健康很有益！建議每週至少150分鐘中等強度運動。請根據自己的身體狀況適量運動。"
-        
-        elif any(word in message_lower for word in ['飲食', '吃', '營養']):
-            return "均衡飲食很重要！建議多吃蔬果、適量蛋白質，少糖少油。如有特殊飲食需求，請諮詢營養師。"
-        
-        else:
-            return f"我聽到您說：「{message}」。作為AI健康助理，我建議保持良好生活習慣。如有健康疑慮，請諮詢專業醫師。"
+        return generate_llm_response(message, patient_id, conversation_id)
     
     def publish_response(self, queue_name: str, response_data: dict):
         """發送回應到指定隊列"""
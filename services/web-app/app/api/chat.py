@@ -7,6 +7,8 @@ from werkzeug.exceptions import BadRequest, NotFound
 
 import logging
 
+logger = logging.getLogger(__name__)
+
 bp = Blueprint('chat', __name__, url_prefix='/api/v1')
 
 @bp.route('/chat/text', methods=['POST'])
@@ -52,7 +54,7 @@ def post_text_message():
         
         rabbitmq_service = get_rabbitmq_service()
         task_queue_name = os.environ.get("RABBITMQ_QUEUE", "task_queue")
-        print(f"[*] Publishing task to {task_queue_name}: {message_body}", flush=True)
+        logger.info("Publishing task to %s", task_queue_name, extra={"sample": "payload", "body": message_body})
         rabbitmq_service.publish_message(
             queue_name=task_queue_name,
             message_body=message_body
@@ -193,7 +195,7 @@ def get_conversations(patient_id):
     except NotFound as e:
         return jsonify({"error": {"code": "NOT_FOUND", "message": str(e)}}), 404
     except Exception as e:
-        logging.error(f"Error getting conversations for patient {patient_id}: {e}", exc_info=True)
+        logger.error("Error getting conversations for patient %s: %s", patient_id, e, exc_info=True)
         return jsonify({"error": {"code": "INTERNAL_SERVER_ERROR", "message": "An unexpected error occurred."}}), 500
 
 @bp.route('/conversations/<string:conversation_id>/messages', methods=['GET'])
@@ -245,7 +247,7 @@ def get_messages(conversation_id):
     except NotFound as e:
         return jsonify({"error": {"code": "NOT_FOUND", "message": str(e)}}), 404
     except Exception as e:
-        logging.error(f"Error getting messages for conversation {conversation_id}: {e}", exc_info=True)
+        logger.error("Error getting messages for conversation %s: %s", conversation_id, e, exc_info=True)
         return jsonify({"error": {"code": "INTERNAL_SERVER_ERROR", "message": "An unexpected error occurred."}}), 500
 
 from app.core.line_service import get_line_service
@@ -291,10 +293,10 @@ def line_webhook():
     try:
         line_service.handle_webhook(body, signature)
     except InvalidSignatureError:
-        logging.warning("Invalid signature received for LINE webhook.")
+        logger.warning("Invalid signature received for LINE webhook.")
         abort(400, "Invalid signature.")
     except Exception as e:
-        logging.error(f"Error processing LINE webhook: {e}", exc_info=True)
+        logger.error("Error processing LINE webhook: %s", e, exc_info=True)
         # Return OK to LINE platform even if internal error occurs
         # to prevent retries for a message that is already causing an error.
         return 'OK'
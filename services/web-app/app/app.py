@@ -1,7 +1,9 @@
 # services/web-app/app/app.py
+import logging
 import os
 from flask import Flask, jsonify
 from .config import config
+from .logging_config import setup_logging
 from .extensions import db, migrate, swagger, jwt, socketio, init_mongo, scheduler
 from .api.auth import auth_bp
 from .api.patients import patients_bp
@@ -12,6 +14,7 @@ from .api.daily_metrics import daily_metrics_bp
 from .api.chat import bp as chat_bp  # Explicitly import and alias the blueprint
 from .api.voice import bp as voice_bp  # Import voice API blueprint
 from .core.notification_service import start_notification_listener
+from .core.alert_consumer_service import start_alert_consumer
 
 # 從原本示範任務，改為引入實際排程任務（保留原檔案中的示範函式，不再註冊）
 from .core.scheduler_service import scheduled_task
@@ -21,11 +24,17 @@ from .scheduled_jobs import (
     run_evening_summary_job,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def create_app(config_name="default"):
     """
     應用程式工廠函數。
     """
+    # 結構化日誌須在 app.logger 第一次使用前設定（測試時保留 pytest 的日誌擷取）
+    if config_name != "testing":
+        setup_logging()
+
     app = Flask(__name__)
 
     # 1. 載入設定
@@ -82,16 +91,19 @@ def create_app(config_name="default"):
     # WebSocket 事件處理
     @socketio.on("connect")
     def handle_connect():
-        print("Client connected")
+        logger.info("Client connected")
 
     @socketio.on("disconnect")
     def handle_disconnect():
-        print("Client disconnected")
+        logger.info("Client disconnected")
 
     # Start the background notification listener
     # We do this check to prevent the listener from starting during tests
     if config_name != "testing":
         start_notification_listener(app)
+        # 消費 ai-worker 的個案通報 stream，推送給治療師
+        if os.getenv("ALERT_CONSUMER_ENABLED", "true").lower() == "true":
+            start_alert_consumer(app)
 
         # 在應用程式上下文中新增排程任務
         with app.app_context():
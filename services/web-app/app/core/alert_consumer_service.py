@@ -0,0 +1,206 @@
+# services/web-app/app/core/alert_consumer_service.py
+"""
+消費 ai-worker 寫入 alerts:stream 的個案通報（消費者群組 case_mgr）。
+
+- 以 XREADGROUP + BLOCK 批次讀取，處理完成的一次 XACK
+- 其他消費者（例如已停止的 web-app 實例）未確認的訊息，閒置超過 ALERT_CLAIM_IDLE_MS
+  後以 XAUTOCLAIM 接手；投遞次數超過 ALERT_MAX_DELIVERIES 的移到 dead-letter stream
+- 每則通報透過 Socket.IO（房間與 notification_service 相同，以使用者 id 命名）
+  與 LINE 推播給病患的負責治療師（HealthProfile.staff_id）
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import redis
+
+from app.extensions import socketio
+
+logger = logging.getLogger(__name__)
+
+ALERT_STREAM_KEY = os.getenv("ALERT_STREAM_KEY", "alerts:stream")
+ALERT_STREAM_GROUP = os.getenv("ALERT_STREAM_GROUP", "case_mgr")
+ALERT_DEAD_LETTER_KEY = os.getenv("ALERT_DEAD_LETTER_KEY", "alerts:dead")
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", 50))
+ALERT_BLOCK_MS = int(os.getenv("ALERT_BLOCK_MS", 5000))
+ALERT_CLAIM_IDLE_MS = int(os.getenv("ALERT_CLAIM_IDLE_MS", 60000))
+ALERT_MAX_DELIVERIES = int(os.getenv("ALERT_MAX_DELIVERIES", 5))
+
+_SEVERITY_LABELS = {"high": "緊急", "info": "一般"}
+
+
+class AlertConsumerService:
+    def __init__(self, app, client=None, consumer_name=None):
+        self.app = app
+        self.client = client or redis.Redis.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True
+        )
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self._group_ready = False
+        self._last_claim = 0.0
+
+    def ensure_group(self):
+        """建立消費者群組；每個行程只需成功一次。"""
+        if self._group_ready:
+            return
+        try:
+            self.client.xgroup_create(name=ALERT_STREAM_KEY, groupname=ALERT_STREAM_GROUP, id="$", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    # ---- 讀取 ----
+    def read_batch(self):
+        """讀取新的通報，最多等待 ALERT_BLOCK_MS；回傳 [(id, fields), ...]。"""
+        resp = self.client.xreadgroup(
+            groupname=ALERT_STREAM_GROUP,
+            consumername=self.consumer_name,
+            streams={ALERT_STREAM_KEY: ">"},
+            count=ALERT_BATCH_SIZE,
+            block=ALERT_BLOCK_MS,
+        )
+        return [entry for _, entries in (resp or []) for entry in entries]
+
+    def claim_stale(self):
+        """接手其他消費者閒置過久的待確認通報；投遞過多次的改送 dead-letter。"""
+        pending = self.client.xpending_range(
+            ALERT_STREAM_KEY, ALERT_STREAM_GROUP, min="-", max="+", count=ALERT_BATCH_SIZE, idle=ALERT_CLAIM_IDLE_MS
+        )
+        poisoned = [p["message_id"] for p in pending if p["times_delivered"] >= ALERT_MAX_DELIVERIES]
+        if poisoned:
+            self.dead_letter(poisoned)
+
+        _, claimed, *_ = self.client.xautoclaim(
+            ALERT_STREAM_KEY,
+            ALERT_STREAM_GROUP,
+            self.consumer_name,
+            min_idle_time=ALERT_CLAIM_IDLE_MS,
+            start_id="0-0",
+            count=ALERT_BATCH_SIZE,
+        )
+        # 已被刪除（XTRIM）的訊息會以 None 回傳
+        return [(msg_id, fields) for msg_id, fields in claimed if fields]
+
+    def dead_letter(self, ids):
+        with self.client.pipeline(transaction=True) as p:
+            for msg_id in ids:
+                for entry_id, fields in self.client.xrange(ALERT_STREAM_KEY, min=msg_id, max=msg_id):
+                    p.xadd(ALERT_DEAD_LETTER_KEY, {**fields, "original_id": entry_id})
+            p.xack(ALERT_STREAM_KEY, ALERT_STREAM_GROUP, *ids)
+            p.execute()
+        logger.error("%s 則通報多次處理失敗，已移至 %s", len(ids), ALERT_DEAD_LETTER_KEY, extra={"ids": ids})
+
+    # ---- 處理 ----
+    def handle_entries(self, entries):
+        """處理一批通報，回傳成功（可確認）的 id；失敗的留在 pending 等待重試。"""
+        done = []
+        staff_cache = {}
+        for msg_id, fields in entries:
+            try:
+                self.dispatch(msg_id, fields, staff_cache)
+                done.append(msg_id)
+            except Exception as e:
+                logger.error("通報 %s 處理失敗: %s", msg_id, e, exc_info=True)
+        return done
+
+    def dispatch(self, msg_id, fields, staff_cache):
+        patient_id = fields.get("user_id")
+        alert = {
+            "id": msg_id,
+            "patient_id": patient_id,
+            "reason": fields.get("reason", ""),
+            "severity": fields.get("severity", "info"),
+            "ts": int(fields.get("ts") or 0),
+        }
+        if fields.get("extra"):
+            try:
+                alert["extra"] = json.loads(fields["extra"])
+            except ValueError:
+                alert["extra"] = fields["extra"]
+
+        if patient_id not in staff_cache:
+            staff_cache[patient_id] = self.staff_for(patient_id)
+        staff_id = staff_cache[patient_id]
+        alert["staff_id"] = staff_id
+
+        if staff_id:
+            socketio.emit("case_alert", alert, room=str(staff_id))
+            self.push_line(staff_id, alert)
+        else:
+            logger.warning("病患 %s 沒有負責治療師，通報 %s 僅記錄", patient_id, msg_id, extra={"alert": alert})
+
+        if alert["ts"]:
+            logger.info(
+                "通報已送出 patient_id=%s severity=%s",
+                patient_id,
+                alert["severity"],
+                extra={"alert_lag_ms": int(time.time() * 1000) - alert["ts"]},
+            )
+
+    def staff_for(self, patient_id):
+        """病患的負責治療師（HealthProfile.staff_id）；查不到時回傳 None。"""
+        from app.models import HealthProfile
+
+        try:
+            pid = int(patient_id)
+        except (TypeError, ValueError):
+            return None
+        with self.app.app_context():
+            profile = HealthProfile.query.filter_by(user_id=pid).first()
+            return profile.staff_id if profile else None
+
+    def push_line(self, staff_id, alert):
+        from .line_service import get_line_service
+
+        label = _SEVERITY_LABELS.get(alert["severity"], alert["severity"])
+        text = f"【{label}通報】病患 {alert['patient_id']}：{alert['reason']}"
+        with self.app.app_context():
+            get_line_service().push_text_message(user_id=staff_id, text=text)
+
+    # ---- 主迴圈 ----
+    def run_once(self):
+        """一輪：必要時先接手閒置的待確認通報，再讀新通報；處理完成的一次確認。回傳處理筆數。"""
+        self.ensure_group()
+        entries = []
+        now = time.monotonic()
+        if now - self._last_claim >= ALERT_CLAIM_IDLE_MS / 1000:
+            self._last_claim = now
+            entries.extend(self.claim_stale())
+        entries.extend(self.read_batch())
+        if not entries:
+            return 0
+        done = self.handle_entries(entries)
+        if done:
+            self.client.xack(ALERT_STREAM_KEY, ALERT_STREAM_GROUP, *done)
+        return len(done)
+
+    def run_forever(self, stop_event=None):
+        logger.info("通報消費者 %s 已啟動（%s / %s）", self.consumer_name, ALERT_STREAM_KEY, ALERT_STREAM_GROUP)
+        while not (stop_event and stop_event.is_set()):
+            try:
+                self.run_once()
+            except redis.ResponseError as e:
+                if "NOGROUP" in str(e):
+                    # stream 被刪除後重建：下一輪重新建立群組
+                    self._group_ready = False
+                else:
+                    logger.error("通報消費者 Redis 錯誤: %s", e)
+                time.sleep(1)
+            except redis.ConnectionError as e:
+                logger.warning("無法連線到 Redis: %s。5 秒後重試...", e)
+                time.sleep(5)
+            except Exception as e:
+                logger.exception("通報消費者發生未預期錯誤: %s", e)
+                time.sleep(5)
+
+
+def start_alert_consumer(app):
+    """在背景執行緒中啟動通報消費者。"""
+    service = AlertConsumerService(app)
+    thread = threading.Thread(target=service.run_forever, name="alert-consumer", daemon=True)
+    thread.start()
+    return service
@@ -9,6 +9,8 @@ from functools import partial # 用於包裝回呼函式，傳遞額外參數
 from app.extensions import socketio # 導入 Socket.IO 擴展，用於 WebSocket 通訊
 from app.core.chat_repository import ChatRepository # 導入聊天記錄的資料庫操作模組 (此處未實際使用)
 
+logger = logging.getLogger(__name__)
+
 def message_callback(ch, method, properties, body, app):
     """
     處理從 RabbitMQ 收到的訊息。此函式會在 Flask 的應用程式上下文中執行。
@@ -20,7 +22,7 @@ def message_callback(ch, method, properties, body, app):
     """
     # 確保在 Flask 的應用程式上下文 (app_context) 中執行，以便能使用 Flask 的擴展功能
     with app.app_context():
-        print(f" [x] 收到通知: {body.decode()}", flush=True)
+        logger.info("收到通知", extra={"sample": "payload", "body": body.decode(errors="replace")})
         try:
             # 將收到的 bytes 格式訊息解碼為 JSON 物件
             message = json.loads(body)
@@ -33,13 +35,13 @@ def message_callback(ch, method, properties, body, app):
                 raise ValueError("通知訊息缺少 'patient_id' 或 'ai_response' 欄位。")
 
             # --- 1. 透過 WebSocket 將通知推播到 Web 前端 ---
-            print(f" [>] 正在透過 WebSocket 發送通知: {message}", flush=True)
+            logger.info("正在透過 WebSocket 發送通知給使用者 %s", patient_id)
             # 使用 socketio.emit 向指定房間(room)發送 'notification' 事件
             # 房間名稱設定為 patient_id，確保只有該使用者會收到
             socketio.emit('notification', message, room=str(patient_id))
 
             # --- 2. 將通知推播回 LINE ---
-            print(f" [>] 正在將通知推播到 LINE 給使用者 {patient_id}", flush=True)
+            logger.info("正在將通知推播到 LINE 給使用者 %s", patient_id)
             from .line_service import get_line_service
             line_service = get_line_service()
 
@@ -63,10 +65,10 @@ def message_callback(ch, method, properties, body, app):
 
         except (json.JSONDecodeError, ValueError) as e:
             # 處理 JSON 解析錯誤或數值錯誤
-            logging.error(f"無效的訊息格式或 JSON 解碼失敗: {e}")
+            logger.error("無效的訊息格式或 JSON 解碼失敗: %s", e)
         except Exception as e:
             # 處理其他所有未預期的錯誤
-            logging.error(f" [!] 處理訊息時發生錯誤: {e}", exc_info=True)
+            logger.error("處理訊息時發生錯誤: %s", e, exc_info=True)
 
         # 向 RabbitMQ 發送確認信號 (acknowledgment)，表示訊息已成功處理
         # 這樣 RabbitMQ 才會將該訊息從佇列中移除
@@ -100,7 +102,7 @@ def listen_for_notifications(app):
             channel = connection.channel()
             # 宣告一個持久化的 (durable) 佇列，確保 RabbitMQ 重啟後訊息不會遺失
             channel.queue_declare(queue=notification_queue, durable=True)
-            print(' [*] 通知監聽器已啟動，等待訊息中。按 CTRL+C 離開')
+            logger.info("通知監聽器已啟動，等待訊息中。")
 
             # # 使用 functools.partial 將 app 參數預先綁定到 message_callback 函式
             # # 因為 pika 的回呼函式簽名不包含 app 參數，需要透過這種方式傳遞
@@ -114,9 +116,9 @@ def listen_for_notifications(app):
 
         except pika.exceptions.AMQPConnectionError as e:
             # 如果連線失敗，印出錯誤訊息並等待 5 秒後重試
-            print(f"無法連線到 RabbitMQ: {e}。5 秒後重試...")
+            logger.warning("無法連線到 RabbitMQ: %s。5 秒後重試...", e)
             time.sleep(5)
         except Exception as e:
             # 捕獲其他所有異常，防止監聽器崩潰
-            print(f"監聽器發生未預期錯誤: {e}。正在重新啟動...")
+            logger.exception("監聽器發生未預期錯誤: %s。正在重新啟動...", e)
             time.sleep(5)
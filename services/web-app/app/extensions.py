@@ -11,8 +11,11 @@ from flasgger import Swagger
 from flask_socketio import SocketIO
 from flask_apscheduler import APScheduler
 from pymongo import MongoClient
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 db = SQLAlchemy()
 migrate = Migrate()
 jwt = JWTManager()
@@ -34,9 +37,9 @@ def init_mongo():
 
     try:
         mongo_client.admin.command('ping')
-        print("MongoDB connection successful.")
+        logger.info("MongoDB connection successful.")
     except Exception as e:
-        print(f"MongoDB connection failed: {e}")
+        logger.error("MongoDB connection failed: %s", e)
 
 def get_db():
     """Returns the MongoDB database instance."""
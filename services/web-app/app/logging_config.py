@@ -0,0 +1,146 @@
+# services/web-app/app/logging_config.py
+"""
+Web App 的日誌設定：結構化（JSON）輸出、各模組層級、詳細內容取樣、非阻塞寫出。
+
+- LOG_FORMAT=json|text（預設 json）；在請求中記錄時自動帶上 method / path
+- LOG_LEVEL=INFO 為 root 層級；LOG_LEVELS="app.core=DEBUG,pika=WARNING" 覆寫個別模組
+- 詳細內容（任務 payload、通知內容等）以 extra={"sample": "<類別>"} 記錄，
+  依 LOG_SAMPLE_RATES（例如 "payload=0.1"）取樣，未列出的類別使用 LOG_SAMPLE_RATE；
+  WARNING 以上不取樣
+- 呼叫端只把 record 放進佇列，由 QueueListener 的背景執行緒格式化並寫到 stdout
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+from flask import has_request_context, request
+
+# LogRecord 的內建屬性；其餘屬性視為 extra 欄位輸出
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "sample",
+}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and key not in payload and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """帶有 sample 屬性的 record 依類別比例取樣；WARNING 以上一律保留。"""
+
+    def __init__(self, rates, default_rate):
+        super().__init__()
+        self.rates = rates
+        self.default_rate = default_rate
+
+    def filter(self, record):
+        category = getattr(record, "sample", None)
+        if category is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < self.rates.get(category, self.default_rate)
+
+
+class RequestInfoFilter(logging.Filter):
+    """在 Flask 請求中記錄時，加上 method / path（需在呼叫端執行緒取值）。"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class _PreparedQueueHandler(logging.handlers.QueueHandler):
+    """在呼叫端執行緒先合併訊息與例外文字，佇列中只放可安全跨執行緒的資料。"""
+
+    def prepare(self, record):
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _parse_pairs(spec):
+    pairs = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+def build_handler(fmt=None, sample_rates=None, default_rate=None):
+    """建立 (佇列 handler, 實際寫出的 stream handler)；參數未給時讀環境變數。"""
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    if sample_rates is None:
+        sample_rates = {k: float(v) for k, v in _parse_pairs(os.getenv("LOG_SAMPLE_RATES", "")).items()}
+    if default_rate is None:
+        default_rate = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+    handler = _PreparedQueueHandler(queue.SimpleQueue())
+    handler.addFilter(RequestInfoFilter())
+    handler.addFilter(SamplingFilter(sample_rates, default_rate))
+    return handler, stream
+
+
+def setup_logging():
+    """設定 root logger（可重複呼叫，只生效一次）；須在第一次使用 app.logger 之前呼叫。"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        handler, stream = build_handler()
+
+        root = logging.getLogger()
+        for old in list(root.handlers):
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        logging.getLogger("apscheduler").setLevel(logging.WARNING)
+        for name, level in _parse_pairs(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(level.upper())
+
+        _listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止背景寫出執行緒並送出佇列中剩餘的紀錄。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,97 @@
+# services/web-app/tests/test_alert_consumer_service.py
+import time
+from unittest.mock import MagicMock, patch
+
+import fakeredis
+import pytest
+
+from app.core import alert_consumer_service as acs
+
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def service(client):
+    svc = acs.AlertConsumerService(MagicMock(), client=client, consumer_name="c1")
+    svc.staff_for = MagicMock(return_value=7)
+    svc.push_line = MagicMock()
+    svc.ensure_group()
+    return svc
+
+
+def _add(client, user_id="1", reason="胸痛", severity="high"):
+    return client.xadd(acs.ALERT_STREAM_KEY, {"user_id": user_id, "reason": reason, "severity": severity, "ts": "0"})
+
+
+@patch("app.core.alert_consumer_service.socketio")
+def test_run_once_fans_out_and_acks(mock_socketio, service, client):
+    ids = [_add(client), _add(client, user_id="2")]
+
+    assert service.run_once() == 2
+
+    assert mock_socketio.emit.call_count == 2
+    event, payload = mock_socketio.emit.call_args_list[0].args
+    assert event == "case_alert"
+    assert payload["id"] == ids[0] and payload["reason"] == "胸痛"
+    assert mock_socketio.emit.call_args_list[0].kwargs["room"] == "7"
+    assert service.push_line.call_count == 2
+    assert client.xpending(acs.ALERT_STREAM_KEY, acs.ALERT_STREAM_GROUP)["pending"] == 0
+
+
+@patch("app.core.alert_consumer_service.socketio")
+def test_acks_in_one_call(mock_socketio, service, client):
+    for _ in range(3):
+        _add(client)
+    with patch.object(client, "xack", wraps=client.xack) as xack:
+        service.run_once()
+    xack.assert_called_once()
+    assert len(xack.call_args.args) == 2 + 3
+
+
+@patch("app.core.alert_consumer_service.socketio")
+def test_failed_entry_stays_pending(mock_socketio, service, client):
+    ok_id = _add(client, user_id="1")
+    bad_id = _add(client, user_id="2")
+
+    def push_line(staff_id, alert):
+        if alert["patient_id"] == "2":
+            raise RuntimeError("LINE down")
+
+    service.push_line.side_effect = push_line
+
+    assert service.run_once() == 1
+
+    pending = client.xpending_range(acs.ALERT_STREAM_KEY, acs.ALERT_STREAM_GROUP, "-", "+", 10)
+    assert [p["message_id"] for p in pending] == [bad_id]
+    assert ok_id not in [p["message_id"] for p in pending]
+
+
+@patch("app.core.alert_consumer_service.socketio")
+def test_stale_entries_are_claimed_and_poison_goes_to_dead_letter(mock_socketio, service, client, monkeypatch):
+    monkeypatch.setattr(acs, "ALERT_CLAIM_IDLE_MS", 1)
+    monkeypatch.setattr(acs, "ALERT_MAX_DELIVERIES", 2)
+    stale_id = _add(client, user_id="1")
+    poison_id = _add(client, user_id="2")
+    # 另一個消費者讀走但沒有確認；poison 已被投遞多次
+    client.xreadgroup(acs.ALERT_STREAM_GROUP, "gone", {acs.ALERT_STREAM_KEY: ">"})
+    client.xclaim(acs.ALERT_STREAM_KEY, acs.ALERT_STREAM_GROUP, "gone", 0, [poison_id])
+    time.sleep(0.01)
+
+    claimed = service.claim_stale()
+
+    assert [msg_id for msg_id, _ in claimed] == [stale_id]
+    dead = client.xrange(acs.ALERT_DEAD_LETTER_KEY)
+    assert len(dead) == 1 and dead[0][1]["original_id"] == poison_id
+    pending = client.xpending_range(acs.ALERT_STREAM_KEY, acs.ALERT_STREAM_GROUP, "-", "+", 10)
+    assert [p["message_id"] for p in pending] == [stale_id]
+
+
+def test_ensure_group_runs_once(client):
+    svc = acs.AlertConsumerService(MagicMock(), client=client, consumer_name="c1")
+    with patch.object(client, "xgroup_create", wraps=client.xgroup_create) as create:
+        svc.ensure_group()
+        svc.ensure_group()
+    create.assert_called_once()
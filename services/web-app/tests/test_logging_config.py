@@ -0,0 +1,66 @@
+import json
+import logging
+
+from app.logging_config import JsonFormatter, SamplingFilter, build_handler, _parse_pairs
+
+
+def _record(msg="hello %s", args=("world",), level=logging.INFO, **extra):
+    record = logging.LogRecord("app.test", level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_json_formatter_outputs_message_and_extra_fields():
+    record = _record(patient_id=42, sample="payload")
+    payload = json.loads(JsonFormatter().format(record))
+
+    assert payload["msg"] == "hello world"
+    assert payload["level"] == "INFO"
+    assert payload["logger"] == "app.test"
+    assert payload["patient_id"] == 42
+    # 取樣類別只用於過濾，不輸出
+    assert "sample" not in payload
+
+
+def test_json_formatter_includes_exception_text():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        import sys
+
+        record = logging.LogRecord("app.test", logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+    payload = json.loads(JsonFormatter().format(record))
+
+    assert "ValueError: boom" in payload["exc"]
+
+
+def test_sampling_filter_respects_category_rates():
+    f = SamplingFilter({"payload": 0.0, "prompt": 1.0}, default_rate=0.0)
+
+    assert f.filter(_record()) is True  # 沒有 sample 屬性的紀錄不取樣
+    assert f.filter(_record(sample="prompt")) is True
+    assert f.filter(_record(sample="payload")) is False
+    assert f.filter(_record(sample="other")) is False
+
+
+def test_sampling_filter_never_drops_warnings():
+    f = SamplingFilter({"payload": 0.0}, default_rate=0.0)
+
+    assert f.filter(_record(level=logging.WARNING, sample="payload")) is True
+
+
+def test_queue_handler_prepares_record_for_listener_thread():
+    handler, _ = build_handler(fmt="json", sample_rates={}, default_rate=1.0)
+    handler.handle(_record())
+
+    queued = handler.queue.get_nowait()
+    assert queued.msg == "hello world"
+    assert queued.args is None
+
+
+def test_parse_pairs_for_per_module_levels():
+    assert _parse_pairs("app.core=DEBUG, pika = WARNING,bad") == {
+        "app.core": "DEBUG",
+        "pika": "WARNING",
+    }
@@ -1,7 +1,7 @@
 import pytest
 from unittest.mock import MagicMock, patch
 import pika
-from pika.exceptions import AMQPConnectionError
+from pika.exceptions import AMQPConnectionError, StreamLostError
 
 # 要測試的模組
 from app.core.rabbitmq_service import RabbitMQService, get_rabbitmq_service
@@ -38,8 +38,93 @@ def test_publish_message_success(mock_pika):
     assert kwargs['routing_key'] == 'test_queue'
     assert kwargs['body'] == '{"key": "value"}'
     
-    # 驗證連線最後被關閉
-    mock_connection.close.assert_called_once()
+    # 驗證 channel 啟用 publisher confirms，且連線保持開啟供下次重用
+    mock_channel.confirm_delivery.assert_called_once()
+    mock_connection.close.assert_not_called()
+
+
+def test_publish_message_reuses_pooled_connection(mock_pika):
+    """
+    Consecutive publishes share one connection and declare each queue only once.
+    """
+    mock_connection = MagicMock()
+    mock_channel = MagicMock()
+    mock_pika.BlockingConnection.return_value = mock_connection
+    mock_connection.channel.return_value = mock_channel
+
+    service = RabbitMQService("amqp://test")
+    service.publish_message("test_queue", {"n": 1})
+    service.publish_message("test_queue", {"n": 2})
+    service.publish_message("other_queue", {"n": 3})
+
+    mock_pika.BlockingConnection.assert_called_once()
+    assert mock_channel.queue_declare.call_count == 2
+    assert mock_channel.basic_publish.call_count == 3
+
+
+def test_publish_message_reconnects_after_connection_loss(mock_pika):
+    """
+    A broken pooled connection is discarded and the publish is retried on a new one.
+    """
+    broken_connection, broken_channel = MagicMock(), MagicMock()
+    fresh_connection, fresh_channel = MagicMock(), MagicMock()
+    broken_connection.channel.return_value = broken_channel
+    fresh_connection.channel.return_value = fresh_channel
+    broken_channel.basic_publish.side_effect = StreamLostError("lost")
+    mock_pika.BlockingConnection.side_effect = [broken_connection, fresh_connection]
+
+    service = RabbitMQService("amqp://test")
+    service.publish_message("test_queue", {"key": "value"})
+
+    broken_connection.close.assert_called_once()
+    fresh_channel.basic_publish.assert_called_once()
+
+
+def test_publish_message_skips_stale_pooled_connections(mock_pika):
+    """
+    Dead idle connections are discarded at checkout without using up the retry,
+    so two stale pooled connections in a row do not fail the publish.
+    """
+    stale = []
+    for _ in range(2):
+        connection, channel = MagicMock(), MagicMock()
+        connection.channel.return_value = channel
+        connection.process_data_events.side_effect = StreamLostError("idle connection dropped")
+        stale.append((connection, channel))
+    fresh_connection, fresh_channel = MagicMock(), MagicMock()
+    fresh_connection.channel.return_value = fresh_channel
+    mock_pika.BlockingConnection.side_effect = [stale[0][0], stale[1][0], fresh_connection]
+
+    service = RabbitMQService("amqp://test", pool_size=2)
+    # 先讓池中有兩條閒置連線，之後它們都被 broker 關閉
+    slots = [service._acquire()[0] for _ in range(2)]
+    for slot in slots:
+        service._idle.put(slot)
+
+    service.publish_message("test_queue", {"key": "value"})
+
+    for connection, channel in stale:
+        connection.close.assert_called_once()
+        channel.basic_publish.assert_not_called()
+    fresh_channel.basic_publish.assert_called_once()
+    assert service._created == 1
+
+
+def test_publish_messages_sends_batch_on_one_channel(mock_pika):
+    """
+    publish_messages sends every message through a single checked-out channel.
+    """
+    mock_connection = MagicMock()
+    mock_channel = MagicMock()
+    mock_pika.BlockingConnection.return_value = mock_connection
+    mock_connection.channel.return_value = mock_channel
+
+    service = RabbitMQService("amqp://test")
+    sent = service.publish_messages("test_queue", [{"n": i} for i in range(5)])
+
+    assert sent == 5
+    mock_pika.BlockingConnection.assert_called_once()
+    assert mock_channel.basic_publish.call_count == 5
 
 def test_publish_message_connection_error(mock_pika):
     """